@@ -1,31 +1,93 @@
-from flask import Flask, request, jsonify
+import itertools
+import os
+from typing import Any
+
+from flask import Flask, Response, request, stream_with_context
 from flask_restful import Resource, Api, abort
 from marshmallow.exceptions import ValidationError
 from requests.exceptions import ConnectionError
 
-from process import ProxyParser, GitHubCrawler, PROXY_URL
-from schemas import InputSchema
+from cache import RefreshingCache
+from jobs import JOBS, Job, JobQueueFull
+from metrics import REGISTRY
+from process import ProxyParser, GitHubCrawler, PROXY_URLS
+from query_cache import QUERY_CACHE
+from schemas import BatchInputSchema, EnrichInputSchema, InputSchema, ProxyQuerySchema, RepositoryQuerySchema
+from serialization import compress, dumps, results_to_columns, to_columns
+from store import STORE
+
+# Seconds the fetched proxy list is served before it is refreshed in the background
+PROXY_CACHE_TTL = float(os.environ.get('PROXY_CACHE_TTL', 300))
 
 
 app = Flask(__name__)
 api = Api(app)
 
 
+def load_proxies() -> ProxyParser:
+    """Fetches a fresh proxy list, kept with its details so it can be filtered."""
+    proxies = ProxyParser()
+    proxies.fetch_proxies()
+    return proxies
+
+
+proxy_cache = RefreshingCache(load_proxies, PROXY_CACHE_TTL)
+
+
+def json_response(value: Any, status: int = 200) -> Response:
+    """Serializes the value to JSON, compressed with the best encoding the client accepts."""
+    body, encoding = compress(dumps(value), request.headers.get('Accept-Encoding', ''))
+    response = Response(body, status=status, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
 class Proxies(Resource):
     def get(self):
         """
-        Handle GET request to fetch proxies.
+        Handle GET request to fetch proxies, filtered by HTTPS support, country and age of their last check.
         """
+        schema = ProxyQuerySchema()
         try:
-            proxies = ProxyParser()
-            proxies.fetch_proxies()
-            return jsonify({"proxies": proxies.get_proxies()})
+            filters = schema.load(request.args)
+            details = filters.pop('details', False)
+            columns = filters.pop('response_format', 'records') == 'columns'
+            parser, cache_status = proxy_cache.get()
+            if columns:
+                # One array per field of the detailed records
+                proxies = to_columns(parser.get_records(**filters))
+            else:
+                proxies = parser.get_records(**filters) if details else parser.get_proxies(**filters)
+            response = json_response({"proxies": proxies})
+            response.headers['X-Cache'] = cache_status
+            return response
+        except ValidationError as e:
+            # Handle validation errors
+            abort(400, error_message={"Bad Request": e.messages})
         except ConnectionError as e:
-            abort(503, error_message={"Service Unavailable": f"Unable to connect to {PROXY_URL}: {e}"})
+            abort(503, error_message={"Service Unavailable": f"Unable to connect to {', '.join(PROXY_URLS)}: {e}"})
         except Exception as e:
             abort(500, error_message={"Internal Server Error": str(e)})
 
 
+class ProxiesCache(Resource):
+    def get(self):
+        """
+        Handle GET request to fetch the proxy cache counters.
+        """
+        return json_response(proxy_cache.get_stats())
+
+
+class CrawlerCache(Resource):
+    def get(self):
+        """
+        Handle GET request to fetch the query cache counters and memory footprint.
+        """
+        return json_response(QUERY_CACHE.get_stats())
+
+
 class Crawler(Resource):
     def post(self):
         """
@@ -37,11 +99,146 @@ class Crawler(Resource):
         schema = InputSchema()
         try:
             data = schema.load(request_json)
-            crawler = GitHubCrawler(data['proxies'])
+            crawler = GitHubCrawler(data['proxies'], max_age=data.get('max_age'), no_cache=data.get('no_cache', False))
+            options = {'max_pages': data.get('max_pages', 1), 'max_results': data.get('max_results'),
+                       'fields': data.get('extra_fields')}
+
+            if data.get('run_async'):
+                # Queue the crawl and return its id right away, results are polled on /crawler/<id>
+                job = JOBS.submit(lambda job: self._run_job(job, crawler, data, options))
+                response = json_response({"job_id": job.id, "status": job.status}, 202)
+                response.headers['Location'] = f"/crawler/{job.id}"
+                return response
+
+            if data.get('stream'):
+                # Stream results as newline-delimited JSON while the crawl is still running
+                failed_pages = {}
+                results = crawler.iter_crawl(data['keywords'], data['type'], on_page_error=failed_pages.__setitem__,
+                                             **options)
+                # Wait for the first result, so a failing crawl still gets a regular error response
+                first = next(results, None)
+                results = itertools.chain([] if first is None else [first], results)
+                return Response(stream_with_context(self._ndjson(results, failed_pages)),
+                                mimetype='application/x-ndjson')
 
             # Execute crawling with provided keywords and type
-            result = crawler.crawl(data['keywords'], data['type'])
-            return jsonify(result)
+            failed_pages = {}
+            with crawler.timings.span('total'):
+                result = crawler.crawl(data['keywords'], data['type'], on_page_error=failed_pages.__setitem__,
+                                       **options)
+            if data.get('response_format') == 'columns':
+                result = results_to_columns(result)
+            response = json_response(result)
+            response.headers['Server-Timing'] = crawler.timings.server_timing()
+            if failed_pages:
+                # The results of the other pages are still returned
+                response.headers['X-Failed-Pages'] = ','.join(str(page) for page in sorted(failed_pages))
+            return response
+        except ValidationError as e:
+            # Handle validation errors
+            abort(400, error_message={"Bad Request": e.messages})
+        except JobQueueFull as e:
+            abort(503, error_message={"Service Unavailable": str(e)})
+        except Exception as e:
+            abort(500, error_message={"Internal Server Error": str(e)})
+
+    @staticmethod
+    def _run_job(job: Job, crawler: GitHubCrawler, data: dict, options: dict) -> None:
+        """Runs a queued crawl, adding each result to the job as soon as it is complete."""
+        for result in crawler.iter_crawl(data['keywords'], data['type'], on_found=job.add_found,
+                                         on_page_error=job.add_page_error, **options):
+            job.add_result(result)
+
+    @staticmethod
+    def _ndjson(results, failed_pages):
+        """Serializes results one JSON document per line, followed by a line for every search page that failed."""
+        try:
+            for result in results:
+                yield dumps(result) + b"\n"
+        except Exception as e:
+            # Headers are already sent, so the error is reported as the last line of the stream
+            yield dumps({"error": str(e)}) + b"\n"
+            return
+        for page, error in sorted(failed_pages.items()):
+            yield dumps({"error": error, "page": page}) + b"\n"
+
+
+class CrawlerBatch(Resource):
+    def post(self):
+        """
+        Handle POST request to crawl several searches at once.
+        """
+        request_json = request.get_json()
+
+        # Validate and deserialize input
+        schema = BatchInputSchema()
+        try:
+            data = schema.load(request_json)
+            crawler = GitHubCrawler(data['proxies'], max_age=data.get('max_age'), no_cache=data.get('no_cache', False))
+
+            with crawler.timings.span('total'):
+                result = crawler.crawl_batch(data['queries'], max_pages=data.get('max_pages', 1),
+                                             max_results=data.get('max_results'), fields=data.get('extra_fields'))
+            if data.get('response_format') == 'columns':
+                for query in result['queries']:
+                    query['results'] = results_to_columns(query['results'])
+            response = json_response(result)
+            response.headers['Server-Timing'] = crawler.timings.server_timing()
+            return response
+        except ValidationError as e:
+            # Handle validation errors
+            abort(400, error_message={"Bad Request": e.messages})
+        except Exception as e:
+            abort(500, error_message={"Internal Server Error": str(e)})
+
+
+class CrawlerJob(Resource):
+    def get(self, job_id):
+        """
+        Handle GET request to fetch the status and the results collected so far of a crawl job.
+        """
+        job = JOBS.get(job_id)
+        if job is None:
+            abort(404, error_message={"Not Found": f"Unknown or expired job: {job_id}"})
+
+        offset = request.args.get('offset', 0, type=int)
+        return json_response(job.to_dict(max(offset, 0)))
+
+
+class Repositories(Resource):
+    def get(self):
+        """
+        Handle GET request to fetch stored repositories, filtered by owner and language, without crawling GitHub.
+        """
+        schema = RepositoryQuerySchema()
+        try:
+            filters = schema.load(request.args)
+            return json_response({"results": STORE.query(**filters)})
+        except ValidationError as e:
+            # Handle validation errors
+            abort(400, error_message={"Bad Request": e.messages})
+
+
+class RepositoriesEnrich(Resource):
+    def post(self):
+        """
+        Handle POST request to enrich selected repositories, typically ones returned by a crawl without enrichment.
+        """
+        request_json = request.get_json()
+
+        # Validate and deserialize input
+        schema = EnrichInputSchema()
+        try:
+            data = schema.load(request_json)
+            crawler = GitHubCrawler(data['proxies'])
+
+            with crawler.timings.span('total'):
+                result = crawler.enrich(data['urls'], fields=data.get('extra_fields'))
+            if data.get('response_format') == 'columns':
+                result = results_to_columns(result)
+            response = json_response({"results": result})
+            response.headers['Server-Timing'] = crawler.timings.server_timing()
+            return response
         except ValidationError as e:
             # Handle validation errors
             abort(400, error_message={"Bad Request": e.messages})
@@ -49,6 +246,21 @@ class Crawler(Resource):
             abort(500, error_message={"Internal Server Error": str(e)})
 
 
+class Metrics(Resource):
+    def get(self):
+        """
+        Handle GET request to fetch the crawler metrics in the Prometheus text format.
+        """
+        return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # Define the API resources
 api.add_resource(Proxies, "/proxies")
+api.add_resource(ProxiesCache, "/proxies/cache")
 api.add_resource(Crawler, "/crawler")
+api.add_resource(CrawlerBatch, "/crawler/batch")
+api.add_resource(CrawlerCache, "/crawler/cache")
+api.add_resource(CrawlerJob, "/crawler/<string:job_id>")
+api.add_resource(Repositories, "/repositories")
+api.add_resource(RepositoriesEnrich, "/repositories/enrich")
+api.add_resource(Metrics, "/metrics")
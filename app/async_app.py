@@ -0,0 +1,580 @@
+"""
+Asyncio server with the /proxies and /crawler endpoints of app.py. A crawl waits for GitHub without holding
+a worker, so one worker process keeps many crawls in flight, and they share one pool of upstream connections.
+
+Run with:
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:8000
+"""
+import asyncio
+import contextlib
+import math
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiohttp
+import requests
+from aiohttp import web
+from marshmallow.exceptions import ValidationError
+from requests.structures import CaseInsensitiveDict
+
+from app import proxy_cache
+from client import ACCEPT_ENCODING, CONDITIONAL_CACHE, ConditionalCache
+from jobs import JOBS, Job, JobQueueFull
+from metrics import (PARSE_FAILURES, REGISTRY, REPO_PAGE_BYTES, RETRIED_REQUESTS, UPSTREAM_CONNECTIONS,
+                     UPSTREAM_REQUESTS, COALESCED_CALLS, Timings)
+from process import (ENRICHMENT_LEASE_POLL, ENRICHMENT_LEASE_TTL, FETCH_RETRIES, GITHUB_URL, HEADERS,
+                     PROXY_URLS, REQUEST_TIMEOUT, RESULTS_PER_PAGE, RETRY_BACKOFF, RETRY_BACKOFF_MAX,
+                     STREAM_CHUNK_SIZE, STREAM_REPO_PAGES, GitHubCrawler, RepoPageReader, ResultAssembler,
+                     choose_ready_proxy, is_retryable, parse_repo_page, parse_search_hits)
+from proxy_pool import PROXY_POOL, ProxyPool, is_proxy_failure
+from query_cache import QUERY_CACHE, QueryCache, search_page_key
+from scheduler import SCHEDULER, AIMDLimiter, RequestScheduler
+from schemas import InputSchema, ProxyQuerySchema
+from serialization import compress, dumps, results_to_columns, to_columns
+from singleflight import AsyncSingleFlight
+from store import STORE, RepositoryStore
+
+# Connections of the upstream pool shared by every crawl of the worker process
+ASYNC_CONNECTION_LIMIT = int(os.environ.get('ASYNC_CONNECTION_LIMIT', 100))
+
+# Identical crawls and repository enrichments in flight on the event loop share one upstream fetch
+CRAWLS = AsyncSingleFlight('crawl')
+ENRICHMENTS = AsyncSingleFlight('enrichment')
+
+
+class PageParseError(Exception):
+    """Raised when a page was fetched but couldn't be parsed."""
+
+
+class AsyncLimiter:
+    """Holds the requests of an event loop while as many as the adaptive limit of the scheduler are in flight."""
+
+    def __init__(self, limiter: AIMDLimiter):
+        self.limiter = limiter
+        self.active = 0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < max(int(self.limiter.limit), 1))
+            self.active += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+
+SESSION_KEY = web.AppKey('session', aiohttp.ClientSession)
+LIMITER_KEY = web.AppKey('limiter', AsyncLimiter)
+POOL_KEY = web.AppKey('pool', ProxyPool)
+SCHEDULER_KEY = web.AppKey('scheduler', RequestScheduler)
+STORE_KEY = web.AppKey('store', RepositoryStore)
+CACHE_KEY = web.AppKey('cache', QueryCache)
+
+
+class AsyncGitHubCrawler:
+    """
+    Class to crawl GitHub like GitHubCrawler, with coroutines instead of threads. Requests go through the shared
+    aiohttp session, and share proxy health, pacing and the store with the threaded crawler of the process.
+    """
+
+    def __init__(self, proxies: List[str], session: aiohttp.ClientSession, limiter: AsyncLimiter,
+                 pool: ProxyPool = PROXY_POOL, scheduler: RequestScheduler = SCHEDULER,
+                 store: RepositoryStore = STORE, conditional: ConditionalCache = CONDITIONAL_CACHE,
+                 cache: QueryCache = QUERY_CACHE, max_age: Optional[float] = None, no_cache: bool = False):
+        self.proxies = proxies
+        self.session = session
+        self.limiter = limiter
+        self.pool = pool
+        self.scheduler = scheduler
+        self.store = store
+        self.conditional = conditional
+        self.cache = cache
+        self.max_age = max_age
+        self.no_cache = no_cache
+        self.timings = Timings()
+
+    async def crawl(self, keywords: List[str], search_type: str, max_pages: int = 1,
+                    max_results: Optional[int] = None, fields: Optional[List[str]] = None,
+                    on_page_error: Optional[Callable[[int, str], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Crawls GitHub for the given keywords and search type, and returns a list of results.
+        An identical crawl already in flight is waited for instead of crawling again.
+        A failed first page fails the crawl, while a later one is passed to `on_page_error` with its error.
+        """
+        async def run() -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+            errors = {}
+            results = [item async for item in self._iter_results(keywords, search_type, max_pages, max_results,
+                                                                  fields, errors.__setitem__)]
+            return [result for _, result in sorted(results, key=lambda item: item[0])], errors
+
+        # A crawl through other proxies or reading the cache differently doesn't get the results of this one
+        key = (tuple(keywords), search_type, max_pages, max_results, None if fields is None else tuple(sorted(fields)),
+               tuple(sorted(set(self.proxies))), self.max_age, self.no_cache)
+        (results, errors), _ = await CRAWLS.do(key, run)
+        if on_page_error is not None:
+            for page, error in sorted(errors.items()):
+                on_page_error(page, error)
+        return results
+
+    async def iter_crawl(self, keywords: List[str], search_type: str, max_pages: int = 1,
+                         max_results: Optional[int] = None, fields: Optional[List[str]] = None,
+                         on_page_error: Optional[Callable[[int, str], None]] = None
+                         ) -> AsyncIterator[Dict[str, Any]]:
+        """Crawls GitHub like `crawl`, but yields every result as soon as it is complete."""
+        async for _, result in self._iter_results(keywords, search_type, max_pages, max_results, fields,
+                                                  on_page_error):
+            yield result
+
+    async def _iter_results(self, keywords: List[str], search_type: str, max_pages: int,
+                            max_results: Optional[int], fields: Optional[List[str]] = None,
+                            on_page_error: Optional[Callable[[int, str], None]] = None
+                            ) -> AsyncIterator[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """
+        Fetches the search pages concurrently and enriches repositories as soon as their page is parsed.
+        Yields (position, result) pairs in completion order, where position is (page, index on page).
+        With `max_results`, the results are those of the first `max_results` hits in search order.
+        """
+        if max_results is not None:
+            max_pages = min(max_pages, math.ceil(max_results / RESULTS_PER_PAGE))
+        with self.timings.span('proxy_validation'):
+            await run_blocking(self.pool.validate, self.proxies)
+        # Fail before any page is requested when no proxy is usable
+        self._get_ready_proxy()
+
+        assembler = ResultAssembler(search_type, max_results, fields, on_page_error)
+        pending = {asyncio.ensure_future(self._get_search_page(keywords, search_type, page)): page
+                   for page in range(1, max_pages + 1)}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    position = pending.pop(task, None)
+                    if position is None:
+                        # A search page that was no longer needed
+                        continue
+
+                    if isinstance(position, int):
+                        # A search page finished: queue the repositories it lets in
+                        try:
+                            found = assembler.add_page(position, task.result())
+                        except Exception as e:
+                            found = assembler.page_failed(position, e)
+                        if assembler.order.full:
+                            for page_task in [t for t, p in pending.items() if isinstance(p, int)]:
+                                page_task.cancel()
+                                del pending[page_task]
+
+                        # Only repositories that are missing from the store or stale are fetched
+                        stored = {}
+                        if assembler.fetch_repo_pages:
+                            stored = await run_blocking(self.store.get_fresh, [hit['url'] for _, hit in found])
+
+                        to_enrich, complete = assembler.place(found, stored)
+                        for hit_position, repo_url in to_enrich:
+                            pending[asyncio.ensure_future(self._get_extra_info(repo_url))] = hit_position
+                        for item in complete:
+                            yield item
+                        continue
+
+                    yield position, assembler.enriched(position, task.result)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _get_search_page(self, keywords: List[str], search_type: str, page: int) -> List[Dict[str, Any]]:
+        """Returns the hits of one page of search results, from the query cache when they are fresh enough."""
+        key = search_page_key(keywords, search_type, page)
+        # The shared tier of the cache is a SQLite database
+        hits = await run_blocking(self.cache.get, key, self.max_age, self.no_cache)
+        if hits is None:
+            hits = await self._fetch_search_page(keywords, search_type, page)
+            await run_blocking(self.cache.put, key, hits)
+        return hits
+
+    async def _fetch_search_page(self, keywords: List[str], search_type: str, page: int) -> List[Dict[str, Any]]:
+        """Fetches one page of search results and returns the hits found on it."""
+        url = f"{GITHUB_URL}/search?q={'+'.join(keywords)}&type={search_type}"
+        if page > 1:
+            url = f"{url}&p={page}"
+
+        try:
+            return await self._fetch(url, 'search_fetch', self._read_search_page)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error fetching data from GitHub: {e}")
+        except PageParseError as e:
+            PARSE_FAILURES.inc(page='search')
+            raise Exception(f"Error parsing search page: {e}")
+
+    async def _read_search_page(self, upstream: aiohttp.ClientResponse) -> List[Dict[str, Any]]:
+        content = await upstream.read()
+        with self.timings.span('search_parse'):
+            try:
+                # A page without the embedded payload is parsed into a DOM
+                return await run_blocking(parse_search_hits, content)
+            except Exception as e:
+                raise PageParseError(e)
+
+    async def _get_extra_info(self, url: str) -> Dict[str, Any]:
+        """
+        Returns the result entry of the repository with its additional information. Concurrent enrichments
+        of the same repository share one fetch, within the event loop and with the processes sharing the store.
+        """
+        result, _ = await ENRICHMENTS.do(url, lambda: self._enrich(url))
+        return result
+
+    async def _enrich(self, url: str) -> Dict[str, Any]:
+        """Fetches the repository under a lease, or waits for the process holding it to store the repository."""
+        if await run_blocking(self.store.acquire_lease, url, ENRICHMENT_LEASE_TTL):
+            try:
+                return await self._fetch_extra_info(url)
+            finally:
+                await run_blocking(self.store.release_lease, url)
+
+        deadline = time.monotonic() + ENRICHMENT_LEASE_TTL
+        while await run_blocking(self.store.is_leased, url) and time.monotonic() < deadline:
+            await asyncio.sleep(ENRICHMENT_LEASE_POLL)
+        stored = await run_blocking(self.store.get_fresh, [url])
+        if url in stored:
+            COALESCED_CALLS.inc(kind='store')
+            return stored[url]
+        # The other process failed, or the store doesn't keep repositories: fetch them here
+        return await self._fetch_extra_info(url)
+
+    async def _fetch_extra_info(self, url: str) -> Dict[str, Any]:
+        """Fetches additional information about the repository, stores it and returns its result entry."""
+        try:
+            extra = await self._fetch(url, 'repo_fetch', read_repo_page if STREAM_REPO_PAGES else read_whole_repo_page)
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Error fetching extra info from GitHub: {e}")
+        except PageParseError as e:
+            PARSE_FAILURES.inc(page='repository')
+            raise Exception(f"Error parsing repository page: {e}")
+
+        await run_blocking(self.store.put, url, extra)
+        return {'url': url, 'extra': extra}
+
+    async def _fetch(self, url: str, stage: str, read: Callable[[aiohttp.ClientResponse], Awaitable[Any]]) -> Any:
+        """
+        Fetches the URL through the healthiest proxy and returns what `read` makes of the response. A request that
+        fails through its proxy or is throttled is sent again through another proxy after a jittered backoff.
+        """
+        tried: Set[str] = set()
+        for attempt in range(FETCH_RETRIES + 1):
+            proxy = self._get_ready_proxy(exclude=tried)
+            tried.add(proxy)
+            try:
+                return await self._send(url, stage, proxy, read)
+            except requests.exceptions.RequestException as e:
+                if attempt == FETCH_RETRIES or not is_retryable(e):
+                    raise
+            RETRIED_REQUESTS.inc(stage=stage)
+            await asyncio.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt)))
+
+    async def _send(self, url: str, stage: str, proxy: str,
+                    read: Callable[[aiohttp.ClientResponse], Awaitable[Any]]) -> Any:
+        """
+        Sends one request through the proxy, paced by the scheduler, and records how the proxy performed.
+        Failures are raised as the requests exceptions the threaded crawler handles. A page fetched before is
+        revalidated, and what `read` made of it is reused when GitHub answers 304.
+        """
+        timeout = aiohttp.ClientTimeout(sock_connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
+        cached = self.conditional.get(url)
+        headers = {**HEADERS, 'Accept-Encoding': ACCEPT_ENCODING, **(cached.headers if cached else {})}
+        try:
+            try:
+                # The slot is taken after the wait, as in RequestScheduler.slot
+                delay = self.scheduler.delay(proxy)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                async with self.limiter.slot():
+                    started = time.monotonic()
+                    with self.timings.span(stage):
+                        async with self.session.get(url, headers=headers, proxy=proxy_url(proxy),
+                                                    timeout=timeout) as upstream:
+                            # Error bodies are small, and tell GitHub's abuse detection from a real 403
+                            response = to_requests_response(upstream, await upstream.read()
+                                                            if upstream.status >= 400 else b'')
+                            UPSTREAM_REQUESTS.inc(status=response.status_code, proxy=proxy)
+                            if self.scheduler.record(proxy, response) and response.status_code != 429:
+                                self.pool.record_failure(proxy)
+                                raise requests.exceptions.HTTPError(
+                                    f"{response.status_code} Throttled for url: {url}", response=response)
+                            response.raise_for_status()
+                            if self.conditional.revalidated(cached, response.status_code):
+                                value = cached.value
+                            else:
+                                value = await read(upstream)
+                                self.conditional.put(url, response.headers, value, upstream.content.total_bytes)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise to_requests_error(e) from e
+        except requests.exceptions.RequestException as e:
+            if e.response is None:
+                UPSTREAM_REQUESTS.inc(status=type(e).__name__, proxy=proxy)
+            if is_proxy_failure(e):
+                self.pool.record_failure(proxy)
+            raise
+        self.pool.record_success(proxy, time.monotonic() - started)
+        return value
+
+    def _get_ready_proxy(self, exclude: Iterable[str] = ()) -> str:
+        return choose_ready_proxy(self.proxies, self.pool, self.scheduler, exclude)
+
+
+async def run_blocking(function: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs a blocking call in the default executor, so it doesn't stall the other crawls of the event loop: SQLite
+    queries of the store and the query cache, which wait for the processes sharing them, and full page parses.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def proxy_url(proxy: str) -> str:
+    """aiohttp needs the scheme that requests assumes for a bare `host:port` proxy."""
+    return proxy if '://' in proxy else f"http://{proxy}"
+
+
+def to_requests_response(upstream: aiohttp.ClientResponse, content: bytes) -> requests.Response:
+    """Converts the status and headers of an aiohttp response, for the helpers shared with the threaded crawler."""
+    response = requests.Response()
+    response.status_code = upstream.status
+    response.reason = upstream.reason
+    response.url = str(upstream.url)
+    response.headers = CaseInsensitiveDict(upstream.headers)
+    response._content = content
+    response._content_consumed = True
+    return response
+
+
+def to_requests_error(error: Exception) -> requests.exceptions.RequestException:
+    """Converts an aiohttp failure to the requests exception of the same failure."""
+    if isinstance(error, (aiohttp.ClientProxyConnectionError, aiohttp.ClientHttpProxyError)):
+        return requests.exceptions.ProxyError(str(error))
+    if isinstance(error, asyncio.TimeoutError):
+        return requests.exceptions.Timeout(str(error) or "Upstream request timed out")
+    return requests.exceptions.ConnectionError(str(error))
+
+
+async def read_whole_repo_page(upstream: aiohttp.ClientResponse) -> Dict[str, Any]:
+    content = await upstream.read()
+    REPO_PAGE_BYTES.inc(len(content))
+    try:
+        return await run_blocking(parse_repo_page, content)
+    except Exception as e:
+        raise PageParseError(e)
+
+
+async def read_repo_page(upstream: aiohttp.ClientResponse) -> Dict[str, Any]:
+    """
+    Reads a repository page chunk by chunk into the incremental parser and closes the connection as soon
+    as the owner and languages are found. A page the incremental parser can't make sense of is parsed whole.
+    """
+    reader = RepoPageReader(upstream.charset)
+    try:
+        async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+            extra = reader.feed(chunk)
+            if extra is not None:
+                upstream.close()
+                return extra
+    finally:
+        REPO_PAGE_BYTES.inc(reader.received)
+    try:
+        return await run_blocking(reader.parse_whole)
+    except Exception as e:
+        raise PageParseError(e)
+
+
+def json_response(request: web.Request, value: Any, status: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> web.Response:
+    """Serializes the value to JSON, compressed with the best encoding the client accepts, as app.py does."""
+    body, encoding = compress(dumps(value), request.headers.get('Accept-Encoding', ''))
+    response = web.Response(body=body, status=status, content_type='application/json', headers=headers)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def error_response(status: int, title: str, message: Any) -> web.Response:
+    """Builds the error body app.py answers with."""
+    return web.json_response({"error_message": {title: message}}, status=status)
+
+
+async def get_proxies(request: web.Request) -> web.Response:
+    """
+    Handle GET request to fetch proxies, filtered by HTTPS support, country and age of their last check.
+    """
+    schema = ProxyQuerySchema()
+    try:
+        filters = schema.load(request.query)
+    except ValidationError as e:
+        return error_response(400, "Bad Request", e.messages)
+
+    details = filters.pop('details', False)
+    columns = filters.pop('response_format', 'records') == 'columns'
+    try:
+        # A miss fetches the proxy lists, which blocks
+        parser, cache_status = await run_blocking(proxy_cache.get)
+        if columns:
+            proxies = to_columns(parser.get_records(**filters))
+        else:
+            proxies = parser.get_records(**filters) if details else parser.get_proxies(**filters)
+        return json_response(request, {"proxies": proxies}, headers={'X-Cache': cache_status})
+    except requests.exceptions.ConnectionError as e:
+        return error_response(503, "Service Unavailable", f"Unable to connect to {', '.join(PROXY_URLS)}: {e}")
+    except Exception as e:
+        return error_response(500, "Internal Server Error", str(e))
+
+
+async def post_crawler(request: web.Request) -> web.StreamResponse:
+    """
+    Handle POST request to start the GitHub crawler.
+    """
+    try:
+        request_json = await request.json()
+    except ValueError:
+        request_json = None
+
+    # Validate and deserialize input
+    schema = InputSchema()
+    try:
+        data = schema.load(request_json)
+        options = {'max_pages': data.get('max_pages', 1), 'max_results': data.get('max_results'),
+                   'fields': data.get('extra_fields')}
+        freshness = {'max_age': data.get('max_age'), 'no_cache': data.get('no_cache', False)}
+
+        if data.get('run_async'):
+            # Queued crawls run in the job threads, as with app.py
+            crawler = GitHubCrawler(data['proxies'], **freshness)
+            job = JOBS.submit(lambda job: _run_job(job, crawler, data, options))
+            return json_response(request, {"job_id": job.id, "status": job.status}, 202,
+                                 headers={'Location': f"/crawler/{job.id}"})
+
+        crawler = AsyncGitHubCrawler(data['proxies'], request.app[SESSION_KEY], request.app[LIMITER_KEY],
+                                     request.app[POOL_KEY], request.app[SCHEDULER_KEY], request.app[STORE_KEY],
+                                     cache=request.app[CACHE_KEY], **freshness)
+        failed_pages = {}
+        if data.get('stream'):
+            return await _stream(request, crawler.iter_crawl(data['keywords'], data['type'],
+                                                             on_page_error=failed_pages.__setitem__, **options),
+                                 failed_pages)
+
+        # Execute crawling with provided keywords and type
+        with crawler.timings.span('total'):
+            result = await crawler.crawl(data['keywords'], data['type'], on_page_error=failed_pages.__setitem__,
+                                         **options)
+        if data.get('response_format') == 'columns':
+            result = results_to_columns(result)
+        headers = {'Server-Timing': crawler.timings.server_timing()}
+        if failed_pages:
+            # The results of the other pages are still returned
+            headers['X-Failed-Pages'] = ','.join(str(page) for page in sorted(failed_pages))
+        return json_response(request, result, headers=headers)
+    except ValidationError as e:
+        # Handle validation errors
+        return error_response(400, "Bad Request", e.messages)
+    except JobQueueFull as e:
+        return error_response(503, "Service Unavailable", str(e))
+    except Exception as e:
+        return error_response(500, "Internal Server Error", str(e))
+
+
+async def get_crawler_job(request: web.Request) -> web.Response:
+    """
+    Handle GET request to fetch the status and the results collected so far of a crawl job.
+    """
+    job_id = request.match_info['job_id']
+    job = JOBS.get(job_id)
+    if job is None:
+        return error_response(404, "Not Found", f"Unknown or expired job: {job_id}")
+
+    try:
+        offset = int(request.query.get('offset', 0))
+    except ValueError:
+        offset = 0
+    return json_response(request, job.to_dict(max(offset, 0)))
+
+
+async def get_metrics(request: web.Request) -> web.Response:
+    """
+    Handle GET request to fetch the crawler metrics in the Prometheus text format.
+    """
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+
+def _run_job(job: Job, crawler: GitHubCrawler, data: dict, options: dict) -> None:
+    """Runs a queued crawl, adding each result to the job as soon as it is complete."""
+    for result in crawler.iter_crawl(data['keywords'], data['type'], on_found=job.add_found,
+                                     on_page_error=job.add_page_error, **options):
+        job.add_result(result)
+
+
+async def _stream(request: web.Request, results: AsyncIterator[Dict[str, Any]],
+                  failed_pages: Dict[int, str]) -> web.StreamResponse:
+    """
+    Streams results as newline-delimited JSON while the crawl is still running,
+    followed by a line for every search page that failed.
+    """
+    # Wait for the first result, so a failing crawl still gets a regular error response
+    try:
+        first = [await results.__anext__()]
+    except StopAsyncIteration:
+        first = []
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    for result in first:
+        await response.write(dumps(result) + b"\n")
+    try:
+        async for result in results:
+            await response.write(dumps(result) + b"\n")
+    except Exception as e:
+        # Headers are already sent, so the error is reported as the last line of the stream
+        await response.write(dumps({"error": str(e)}) + b"\n")
+    else:
+        for page, error in sorted(failed_pages.items()):
+            await response.write(dumps({"error": error, "page": page}) + b"\n")
+    await response.write_eof()
+    return response
+
+
+async def _count_connection(session: aiohttp.ClientSession, context: Any,
+                            params: aiohttp.TraceConnectionCreateEndParams) -> None:
+    UPSTREAM_CONNECTIONS.inc()
+
+
+async def _client_session(app: web.Application) -> AsyncIterator[None]:
+    """Opens the upstream connection pool shared by the crawls of the worker process, and closes it on shutdown."""
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_end.append(_count_connection)
+    app[SESSION_KEY] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT),
+                                             trace_configs=[trace])
+    app[LIMITER_KEY] = AsyncLimiter(app[SCHEDULER_KEY].limiter)
+    yield
+    await app[SESSION_KEY].close()
+
+
+def create_app(pool: ProxyPool = PROXY_POOL, scheduler: RequestScheduler = SCHEDULER,
+               store: RepositoryStore = STORE, cache: QueryCache = QUERY_CACHE) -> web.Application:
+    """
+    Creates the app, with the proxy health, pacing, store and query cache shared with the threaded crawler
+    by default.
+    """
+    app = web.Application()
+    app[POOL_KEY] = pool
+    app[SCHEDULER_KEY] = scheduler
+    app[STORE_KEY] = store
+    app[CACHE_KEY] = cache
+    app.cleanup_ctx.append(_client_session)
+    app.router.add_get('/proxies', get_proxies)
+    app.router.add_post('/crawler', post_crawler)
+    app.router.add_get('/crawler/{job_id}', get_crawler_job)
+    app.router.add_get('/metrics', get_metrics)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,540 @@
+"""
+Benchmarks for the crawler against a local fake GitHub server.
+
+Usage:
+    python benchmark.py engine [--results 30] [--rounds 3] [--latency 0.05] [--workers 8]
+    python benchmark.py parse [--fixtures DIR] [--rounds 20]
+    python benchmark.py suite [--requests 50] [--concurrency 4] [--latency 0.02] [--error-rate 0.0] [--etags]
+                              [--compress]
+    python benchmark.py serve [--requests 200] [--concurrency 50] [--workers 2] [--latency 0.1]
+    python benchmark.py serialize [--results 5000] [--rounds 5]
+    python benchmark.py compare BASELINE.json CURRENT.json
+
+Every command accepts --json PATH to also write its results, with the commit they were measured on.
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import importlib
+import json
+import multiprocessing as mp
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import requests
+
+from fake_github import FakeGitHub, render_repo_page, render_search_page
+from metrics import percentile
+
+
+def _process_tree(pid: int) -> List[int]:
+    """Returns the pid and the pids of all its descendants (Linux only)."""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _rss_kb(pid: int) -> int:
+    """Returns the resident set size of a single process in kilobytes."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class ResourceSampler:
+    """Samples RSS and process count of this process, and of its children, in a background thread."""
+
+    def __init__(self, interval: float = 0.01, children: bool = True):
+        self.interval = interval
+        self.children = children
+        self.peak_rss_kb = 0
+        self.peak_processes = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> 'ResourceSampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            pids = _process_tree(os.getpid()) if self.children else [os.getpid()]
+            self.peak_rss_kb = max(self.peak_rss_kb, sum(_rss_kb(pid) for pid in pids))
+            self.peak_processes = max(self.peak_processes, len(pids))
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self._stop.wait(self.interval)
+
+
+def _legacy_extra_info(url: str, proxies: Dict[str, str], return_dict: Dict[str, Any]) -> None:
+    """Process target of the former crawler: one fresh connection per repository."""
+    process = importlib.import_module('process')
+    response = requests.get(url=url, headers=process.HEADERS, proxies=proxies)
+    response.raise_for_status()
+    return_dict[uuid.uuid4().hex] = {'url': url, 'extra': process.parse_repo_page(response.content)}
+
+
+def legacy_crawl(keywords: List[str], proxy: str) -> List[Dict[str, Any]]:
+    """Reproduces the former process-per-repository crawl for comparison."""
+    process = importlib.import_module('process')
+    from bs4 import BeautifulSoup
+
+    proxies = {"http": proxy, "https": proxy}
+    manager = mp.Manager()
+    return_dict = manager.dict()
+    response = requests.get(url=f"{process.GITHUB_URL}/search?q={'+'.join(keywords)}&type=Repositories",
+                            headers=process.HEADERS, proxies=proxies)
+    response.raise_for_status()
+
+    soup = BeautifulSoup(response.content, 'html.parser')
+    div = soup.find('div', class_="Box-sc-g0xbh4-0 kXssRI")
+    jobs = []
+    for item in div.find_all('div', class_="Box-sc-g0xbh4-0 bDcVHV"):
+        a = item.find('a', class_="Link__StyledLink-sc-14289xe-0 dheQRw")
+        job = mp.Process(target=_legacy_extra_info, args=(f"{process.GITHUB_URL}{a['href']}", proxies, return_dict))
+        jobs.append(job)
+        job.start()
+    for job in jobs:
+        job.join()
+
+    results = list(return_dict.values())
+    manager.shutdown()
+    return results
+
+
+def measure(name: str, crawl: Callable[[], List[Dict[str, Any]]], rounds: int) -> Dict[str, Any]:
+    """Runs a crawl function repeatedly and reports throughput and resource peaks."""
+    repositories = 0
+    with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            repositories += len(crawl())
+        elapsed = time.perf_counter() - started
+
+    return {
+        'name': name,
+        'rounds': rounds,
+        'repositories': repositories,
+        'seconds': round(elapsed, 3),
+        'repositories_per_second': round(repositories / elapsed, 1),
+        'peak_rss_mb': round(sampler.peak_rss_kb / 1024, 1),
+        'peak_processes': sampler.peak_processes,
+        'peak_threads': sampler.peak_threads,
+    }
+
+
+def _benchmark_environment() -> None:
+    """
+    The fake server never throttles, so the request rate limits are off, and every crawl fetches its search
+    and repository pages instead of reading the query cache or a store left by earlier runs, unless set explicitly.
+    """
+    os.environ.setdefault('RATE_LIMIT', '0')
+    os.environ.setdefault('PROXY_RATE_LIMIT', '0')
+    os.environ.setdefault('STORE_PATH', ':memory:')
+    os.environ.setdefault('REPOSITORY_FRESHNESS', '0')
+    os.environ.setdefault('QUERY_CACHE_TTL', '0')
+
+
+def run_engine(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Compares the pooled thread engine with the former multiprocessing fan-out."""
+    with FakeGitHub(results=args.results, latency=args.latency, page_size=args.page_size) as fake:
+        # process reads GITHUB_URL at import time, so it is imported once the fake server is up
+        os.environ['GITHUB_URL'] = fake.url
+        _benchmark_environment()
+        process = importlib.import_module('process')
+        crawler = process.GitHubCrawler([fake.url], max_workers=args.workers)
+
+        return [
+            measure('threads', lambda: crawler.crawl(['benchmark'], 'Repositories'), args.rounds),
+            measure('multiprocessing', lambda: legacy_crawl(['benchmark'], fake.url), args.rounds),
+        ]
+
+
+def _load_fixtures(directory: str) -> Dict[str, bytes]:
+    """Returns the saved pages of a directory, or generated ones when none is given."""
+    if not directory:
+        return {
+            'search.html': render_search_page('benchmark', 10).encode('utf-8'),
+            'search-embedded.html': render_search_page('benchmark', 10, embedded=True).encode('utf-8'),
+            'repo.html': render_repo_page('owner', 'benchmark', 300_000).encode('utf-8'),
+        }
+
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(path, 'rb') as page:
+            fixtures[os.path.basename(path)] = page.read()
+    return fixtures
+
+
+def run_parse(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Measures the per-page cost of every installed parser backend, building the full tree and building
+    only the elements the crawler reads. Fixture names starting with 'search' are search pages,
+    the others repository pages.
+    """
+    parsing = importlib.import_module('parsing')
+    process = importlib.import_module('process')
+
+    rows = []
+    for name, content in _load_fixtures(args.fixtures).items():
+        parse = process.parse_search_page if name.startswith('search') else process.parse_repo_page
+        for features, installed in parsing.available_parsers().items():
+            if not installed:
+                continue
+
+            timings = {}
+            for mode, run in (('full', lambda: parsing.make_soup(content, features=features)),
+                              ('partial', lambda: parse(content, features))):
+                started = time.perf_counter()
+                for _ in range(args.rounds):
+                    run()
+                timings[mode] = (time.perf_counter() - started) / args.rounds * 1000
+
+            rows.append({
+                'page': name,
+                'kb': round(len(content) / 1024, 1),
+                'parser': features,
+                'full_ms': round(timings['full'], 2),
+                'partial_ms': round(timings['partial'], 2),
+            })
+    return rows
+
+
+def _serve(connection, options: Dict[str, Any]) -> None:
+    """Process target running a fake GitHub server until it is terminated."""
+    fake = FakeGitHub(**options).start()
+    connection.send((fake.url, fake.proxy_list_url))
+    threading.Event().wait()
+
+
+@contextlib.contextmanager
+def fake_github_process(**options) -> Iterator[Tuple[str, str]]:
+    """Runs a fake GitHub server in a child process, so it doesn't count towards the measured process."""
+    receiver, sender = mp.Pipe(duplex=False)
+    server = mp.Process(target=_serve, args=(sender, options), daemon=True)
+    server.start()
+    try:
+        yield receiver.recv()
+    finally:
+        server.terminate()
+        server.join()
+
+
+def load_test(name: str, send: Callable[[], bool], requests_count: int, concurrency: int) -> Dict[str, Any]:
+    """Sends requests from `concurrency` threads and reports throughput, latency and resource peaks."""
+    latencies = []
+
+    def timed() -> bool:
+        started = time.perf_counter()
+        ok = send()
+        latencies.append(time.perf_counter() - started)
+        return ok
+
+    with ResourceSampler(children=False) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(lambda _: timed(), range(requests_count)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'name': name,
+        'requests': requests_count,
+        'errors': outcomes.count(False),
+        'requests_per_second': round(requests_count / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_rss_mb': round(sampler.peak_rss_kb / 1024, 1),
+        'peak_processes': sampler.peak_processes,
+        'peak_threads': sampler.peak_threads,
+    }
+
+
+def upstream_usage(metrics: Any) -> Dict[str, Any]:
+    """Reports how often upstream connections were reused and the bytes conditional requests and compression saved."""
+    requests_count = metrics.UPSTREAM_REQUESTS.total()
+    connections = metrics.UPSTREAM_CONNECTIONS.total()
+    return {
+        'name': 'upstream',
+        'requests': int(requests_count),
+        'connections': int(connections),
+        'reuse_rate': round(1 - connections / requests_count, 3) if requests_count else 0.0,
+        'not_modified': int(metrics.CONDITIONAL_REQUESTS.get(result='not_modified')),
+        'saved_not_modified_kb': round(metrics.BYTES_SAVED.get(reason='not_modified') / 1024, 1),
+        'saved_compression_kb': round(metrics.BYTES_SAVED.get(reason='compression') / 1024, 1),
+    }
+
+
+def query_cache_usage(cache: Any) -> Dict[str, Any]:
+    """Reports the hit ratio, evictions and memory footprint of the query cache."""
+    stats = cache.get_stats()
+    return {'name': 'query_cache', 'hit_ratio': stats['hit_ratio'], 'misses': stats['misses'],
+            'evictions': stats['evictions'], 'entries': stats['entries'], 'kb': round(stats['bytes'] / 1024, 1)}
+
+
+def run_suite(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Runs crawls and proxy list fetches end to end through the Flask app against a fake GitHub, and reports
+    the upstream connection reuse, bytes saved and query cache usage over all of them.
+    """
+    options = {'results': args.results, 'latency': args.latency, 'page_size': args.page_size,
+               'error_rate': args.error_rate, 'proxies': args.proxies, 'fixtures': args.fixtures, 'seed': 0,
+               'embedded': args.embedded, 'etags': args.etags, 'compress': args.compress}
+    with fake_github_process(**options) as (github_url, proxy_list_url):
+        # The app reads its upstream URLs at import time
+        os.environ['GITHUB_URL'] = github_url
+        os.environ['PROXY_URL'] = proxy_list_url
+        os.environ['PROXY_URLS'] = proxy_list_url
+        _benchmark_environment()
+        app_module = importlib.import_module('app')
+        # Failed crawls are counted, not logged
+        app_module.app.logger.disabled = True
+        client = app_module.app.test_client()
+        counter = itertools.count()
+
+        def crawl() -> bool:
+            # Concurrent crawls of one search are coalesced, so every request searches other keywords by default
+            keywords = ['benchmark'] if args.same_search else [f"benchmark{next(counter)}"]
+            crawl_request = {'keywords': keywords, 'proxies': [github_url], 'type': 'Repositories',
+                             'max_pages': args.pages}
+            return client.post('/crawler', json=crawl_request).status_code == 200
+
+        def proxies_uncached() -> bool:
+            app_module.proxy_cache.clear()
+            return client.get('/proxies').status_code == 200
+
+        def proxies_cached() -> bool:
+            return client.get('/proxies').status_code == 200
+
+        return [
+            load_test('crawler', crawl, args.requests, args.concurrency),
+            load_test('proxies_uncached', proxies_uncached, args.requests, 1),
+            load_test('proxies_cached', proxies_cached, args.requests, args.concurrency),
+            upstream_usage(importlib.import_module('metrics')),
+            query_cache_usage(importlib.import_module('query_cache').QUERY_CACHE),
+        ]
+
+
+@contextlib.contextmanager
+def gunicorn_server(target: str, workers: int, worker_args: List[str], env: Dict[str, str]) -> Iterator[str]:
+    """Runs the app under gunicorn on a free local port and yields its URL once it answers."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--bind', f"127.0.0.1:{port}", '--workers',
+                               str(workers), '--timeout', '120', '--log-level', 'warning', *worker_args, target],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                requests.get(f"{url}/metrics", timeout=1)
+                break
+            except requests.exceptions.ConnectionError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise Exception(f"{target} didn't start")
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_serve(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Load tests /crawler served by gunicorn sync workers and by the asyncio app, with the same number of worker
+    processes, against a fake GitHub. Every request searches other keywords, so no crawl is coalesced.
+    """
+    options = {'results': args.results, 'latency': args.latency, 'page_size': args.page_size, 'seed': 0}
+    with fake_github_process(**options) as (github_url, proxy_list_url):
+        _benchmark_environment()
+        env = dict(os.environ, GITHUB_URL=github_url, PROXY_URL=proxy_list_url, PROXY_URLS=proxy_list_url)
+        counter = itertools.count()
+
+        rows = []
+        for name, target, worker_args in (('sync', 'app:app', []),
+                                          ('async', 'async_app:app', ['--worker-class', 'aiohttp.GunicornWebWorker'])):
+            with gunicorn_server(target, args.workers, worker_args, env) as url:
+                def crawl() -> bool:
+                    crawl_request = {'keywords': [f"load{next(counter)}"], 'proxies': [github_url],
+                                     'type': 'Repositories'}
+                    try:
+                        return requests.post(f"{url}/crawler", json=crawl_request, timeout=120).status_code == 200
+                    except requests.exceptions.RequestException:
+                        return False
+
+                rows.append(dict(load_test(name, crawl, args.requests, args.concurrency), workers=args.workers,
+                                 concurrency=args.concurrency))
+        return rows
+
+
+def sample_results(count: int) -> List[Dict[str, Any]]:
+    """Builds enriched Repositories results like a large batch crawl returns."""
+    languages = ['Python', 'JavaScript', 'HTML', 'CSS', 'Shell', 'Go', 'Rust', 'C', 'TypeScript', 'Dockerfile']
+    results = []
+    for i in range(count):
+        used = [languages[(i + offset) % len(languages)] for offset in range(1 + i % 5)]
+        shares = [round(100 / len(used), 1)] * len(used)
+        results.append({'url': f"https://github.com/owner{i % 500}/repository-{i}", 'extra': {
+            'owner': f"owner{i % 500}", 'stars': i * 7 % 10000, 'language': used[0],
+            'description': f"Fixture repository {i} for the serialization benchmark",
+            'language_stats': dict(zip(used, shares))}})
+    return results
+
+
+def run_serialize(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Measures the encoding time of every installed JSON encoder and the size of the records and columns
+    layouts of a large crawl result, raw and compressed as they are sent.
+    """
+    serialization = importlib.import_module('serialization')
+    results = sample_results(args.results)
+
+    rows = []
+    for layout, build in (('records', lambda: results), ('columns', lambda: serialization.results_to_columns(results))):
+        for encoder in ('json', 'orjson'):
+            if encoder == 'orjson' and serialization.orjson is None:
+                continue
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                body = serialization.dumps(build(), encoder)
+            encode_ms = (time.perf_counter() - started) / args.rounds * 1000
+
+            row = {'layout': layout, 'encoder': encoder, 'encode_ms': round(encode_ms, 2),
+                   'raw_kb': round(len(body) / 1024, 1)}
+            for encoding in ('gzip', 'br'):
+                started = time.perf_counter()
+                compressed, used = serialization.compress(body, encoding)
+                if used:
+                    row[f"{encoding}_kb"] = round(len(compressed) / 1024, 1)
+                    row[f"{encoding}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            rows.append(row)
+    return rows
+
+
+def _row_key(row: Dict[str, Any]) -> str:
+    return '/'.join(str(value) for value in row.values() if isinstance(value, str))
+
+
+def run_compare(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Reports the relative change of every numeric result between two --json outputs."""
+    with open(args.baseline) as baseline, open(args.current) as current:
+        before = {_row_key(row): row for row in json.load(baseline)['results']}
+        after = {_row_key(row): row for row in json.load(current)['results']}
+
+    rows = []
+    for key, row in after.items():
+        if key not in before:
+            continue
+        changes = {'name': key}
+        for field, value in row.items():
+            old = before[key].get(field)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                changes[field] = f"{(value - old) / old * 100:+.1f}%"
+        rows.append(changes)
+    return rows
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    engine = subparsers.add_parser('engine', help='compare the fetch engine with the multiprocessing path')
+    engine.add_argument('--results', type=int, default=30, help='repositories per search page')
+    engine.add_argument('--rounds', type=int, default=3, help='crawls per measurement')
+    engine.add_argument('--latency', type=float, default=0.05, help='fake upstream latency in seconds')
+    engine.add_argument('--page-size', type=int, default=200_000, help='approximate repository page size in bytes')
+    engine.add_argument('--workers', type=int, default=8, help='fetch engine concurrency cap')
+    engine.set_defaults(run=run_engine)
+
+    parse = subparsers.add_parser('parse', help='measure the parsing cost of every parser backend')
+    parse.add_argument('--fixtures', default='', help='directory of saved search*.html and repository pages')
+    parse.add_argument('--rounds', type=int, default=20, help='parses per measurement')
+    parse.set_defaults(run=run_parse)
+
+    suite = subparsers.add_parser('suite', help='load test the Flask app against a fake GitHub')
+    suite.add_argument('--requests', type=int, default=50, help='requests per scenario')
+    suite.add_argument('--concurrency', type=int, default=4, help='concurrent clients')
+    suite.add_argument('--results', type=int, default=10, help='repositories per search page')
+    suite.add_argument('--pages', type=int, default=1, help='search pages per crawl')
+    suite.add_argument('--latency', type=float, default=0.02, help='fake upstream latency in seconds')
+    suite.add_argument('--error-rate', type=float, default=0.0, help='share of GitHub pages answered with a 500')
+    suite.add_argument('--page-size', type=int, default=50_000, help='approximate repository page size in bytes')
+    suite.add_argument('--proxies', type=int, default=300, help='rows of the fake proxy list')
+    suite.add_argument('--fixtures', default='', help='directory of saved search.html, repo.html and proxies.html')
+    suite.add_argument('--embedded', action='store_true', help='serve search pages with the embedded JSON payload')
+    suite.add_argument('--etags', action='store_true', help='serve pages with ETags and answer revalidations with 304')
+    suite.add_argument('--compress', action='store_true', help='gzip the pages for clients accepting it')
+    suite.add_argument('--same-search', action='store_true',
+                       help='crawl one search on every request, which concurrent crawls share')
+    suite.set_defaults(run=run_suite)
+
+    serve = subparsers.add_parser('serve', help='load test /crawler on gunicorn sync workers and the asyncio app')
+    serve.add_argument('--requests', type=int, default=200, help='requests per server')
+    serve.add_argument('--concurrency', type=int, default=50, help='concurrent clients')
+    serve.add_argument('--workers', type=int, default=2, help='gunicorn worker processes of each server')
+    serve.add_argument('--results', type=int, default=10, help='repositories per search page')
+    serve.add_argument('--latency', type=float, default=0.1, help='fake upstream latency in seconds')
+    serve.add_argument('--page-size', type=int, default=50_000, help='approximate repository page size in bytes')
+    serve.set_defaults(run=run_serve)
+
+    serialize = subparsers.add_parser('serialize', help='measure response encoders, layouts and compression')
+    serialize.add_argument('--results', type=int, default=5000, help='results of the serialized crawl')
+    serialize.add_argument('--rounds', type=int, default=5, help='encodings per measurement')
+    serialize.set_defaults(run=run_serialize)
+
+    compare = subparsers.add_parser('compare', help='compare two --json outputs')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.set_defaults(run=run_compare)
+
+    for subparser in (engine, parse, suite, serve, serialize, compare):
+        subparser.add_argument('--json', default='', help='also write the results to this file')
+
+    args = parser.parse_args()
+    rows = args.run(args)
+    for row in rows:
+        print('  '.join(f"{key}={value}" for key, value in row.items()))
+
+    if args.json:
+        config = {key: value for key, value in vars(args).items() if key not in ('run', 'json')}
+        with open(args.json, 'w') as output:
+            json.dump({'commit': _commit(), 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'config': config, 'results': rows}, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class RefreshingCache(Generic[T]):
+    """
+    Class to cache the value returned by a loader for `ttl` seconds.
+    Once the value is stale it is still served while a single background thread reloads it,
+    and if the reload fails the last value that loaded successfully keeps being served.
+    """
+
+    def __init__(self, loader: Callable[[], T], ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.loader = loader
+        self.ttl = ttl
+        self.clock = clock
+        self._value: Optional[T] = None
+        self._loaded_at: Optional[float] = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def get(self) -> Tuple[T, str]:
+        """Returns the cached value and how it was served: HIT, STALE or MISS."""
+        with self._lock:
+            if self._loaded_at is not None:
+                if self.clock() - self._loaded_at < self.ttl:
+                    self._stats['hits'] += 1
+                    return self._value, 'HIT'
+
+                self._stats['stale_hits'] += 1
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, daemon=True).start()
+                return self._value, 'STALE'
+
+        # Nothing was loaded yet: concurrent first callers wait for a single load
+        with self._load_lock:
+            with self._lock:
+                if self._loaded_at is not None:
+                    self._stats['hits'] += 1
+                    return self._value, 'HIT'
+                self._stats['misses'] += 1
+            value = self.loader()
+            self._store(value)
+            return value, 'MISS'
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the hit, miss and refresh counters and the age of the cached value."""
+        with self._lock:
+            age = None if self._loaded_at is None else round(self.clock() - self._loaded_at, 3)
+            return {**self._stats, 'ttl': self.ttl, 'age': age}
+
+    def clear(self) -> None:
+        """Drops the cached value and resets the counters."""
+        with self._lock:
+            self._value = None
+            self._loaded_at = None
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def _refresh(self) -> None:
+        try:
+            value = self.loader()
+        except Exception:
+            with self._lock:
+                self._stats['refresh_errors'] += 1
+        else:
+            self._store(value)
+            with self._lock:
+                self._stats['refreshes'] += 1
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _store(self, value: T) -> None:
+        with self._lock:
+            self._value = value
+            self._loaded_at = self.clock()
@@ -0,0 +1,219 @@
+"""
+Bulk crawl of many searches from the command line, without going through the API.
+
+Usage:
+    python cli.py QUERIES --output results.jsonl --proxies PROXY [PROXY ...] [--type Repositories]
+                  [--concurrency 4] [--max-pages 1] [--max-results N] [--fields url owner ...]
+                  [--max-age SECONDS] [--no-cache]
+
+QUERIES holds one search per line, either keywords separated by spaces, searched with --type, or a JSON object
+like {"keywords": ["python", "django"], "type": "Issues"}. Every result is written to the output as one JSON line
+as soon as its search is complete, and finished searches are recorded in a checkpoint file (the output path
+followed by .checkpoint). Running the same command again skips them, and repositories enriched within
+REPOSITORY_FRESHNESS are read from the store at STORE_PATH instead of being fetched again. Search pages are read
+from the query cache, shared through QUERY_CACHE_PATH when it is set, within QUERY_CACHE_TTL or --max-age.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Set, Tuple
+
+from marshmallow.exceptions import ValidationError
+
+from process import GitHubCrawler
+from schemas import VALID_FIELDS, QuerySchema
+from serialization import dumps
+
+# Seconds between two progress reports
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 10))
+
+
+def read_queries(lines: Iterable[str], default_type: str) -> Iterator[Dict[str, Any]]:
+    """Reads searches, one per non empty line, validated like the searches of /crawler/batch."""
+    schema = QuerySchema()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        query = json.loads(line) if line.startswith('{') else {'keywords': line.split(), 'type': default_type}
+        try:
+            yield schema.load(query)
+        except ValidationError as e:
+            raise Exception(f"Invalid query on line {number}: {e.messages}")
+
+
+def query_key(query: Dict[str, Any]) -> str:
+    """Identifies a search in the checkpoint."""
+    return json.dumps([query['keywords'], query['type']])
+
+
+class Checkpoint:
+    """
+    Append-only record of the finished searches, each with the length the output had once its results were written.
+    Loading it truncates the output to the last recorded length, dropping the results of a search that was being
+    written when the previous run stopped, so that search is crawled again without duplicating lines. Without a
+    checkpoint, no search is finished and the output is emptied.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        self.offset = 0
+
+    def load(self, output_path: str) -> None:
+        if os.path.exists(self.path):
+            with open(self.path) as checkpoint:
+                for line in checkpoint:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the previous run stopping
+                        continue
+                    self.done.add(entry['query'])
+                    self.offset = entry['offset']
+
+        if os.path.exists(output_path):
+            with open(output_path, 'r+b') as output:
+                output.truncate(self.offset)
+
+    def record(self, key: str, offset: int) -> None:
+        with open(self.path, 'a') as checkpoint:
+            checkpoint.write(json.dumps({'query': key, 'offset': offset}) + "\n")
+        self.done.add(key)
+        self.offset = offset
+
+
+class Progress:
+    """Counts finished searches and results, and estimates the time left from the rate of this run."""
+
+    def __init__(self, total: int, skipped: int = 0, clock: Callable[[], float] = time.monotonic):
+        self.total = total
+        self.skipped = skipped
+        self.clock = clock
+        self.started = clock()
+        self.queries = 0
+        self.failed = 0
+        self.results = 0
+
+    def update(self, results: int = 0, failed: bool = False) -> None:
+        self.queries += 1
+        self.failed += failed
+        self.results += results
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = max(self.clock() - self.started, 1e-9)
+        rate = self.queries / elapsed
+        remaining = self.total - self.skipped - self.queries
+        return {
+            'done': self.skipped + self.queries,
+            'total': self.total,
+            'failed': self.failed,
+            'results': self.results,
+            'queries_per_s': round(rate, 2),
+            'results_per_s': round(self.results / elapsed, 2),
+            'eta_s': round(remaining / rate) if rate else (0 if not remaining else None),
+        }
+
+    def report(self) -> str:
+        progress = self.to_dict()
+        eta = '?' if progress['eta_s'] is None else f"{progress['eta_s']}s"
+        return (f"{progress['done']}/{progress['total']} queries ({progress['failed']} failed), "
+                f"{progress['results']} results, {progress['queries_per_s']} queries/s, "
+                f"{progress['results_per_s']} results/s, ETA {eta}")
+
+
+def run(queries: List[Dict[str, Any]], crawler: GitHubCrawler, output_path: str, checkpoint_path: str,
+        concurrency: int = 4, options: Optional[Dict[str, Any]] = None, log: IO = sys.stderr,
+        progress_interval: float = PROGRESS_INTERVAL) -> Dict[str, Any]:
+    """
+    Crawls the searches not finished by a previous run, at most `concurrency` at a time, and appends their results
+    to the output as they complete. A failed search is written as an error line and crawled again by the next run.
+    """
+    options = options or {}
+    checkpoint = Checkpoint(checkpoint_path)
+    checkpoint.load(output_path)
+
+    # Searches listed twice are crawled once
+    pending = list({query_key(query): query for query in queries if query_key(query) not in checkpoint.done}.items())
+    progress = Progress(len(queries), len(queries) - len(pending))
+    last_report = progress.clock()
+
+    def crawl(query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        failed_pages = {}
+        results = crawler.crawl(query['keywords'], query['type'], on_page_error=failed_pages.__setitem__, **options)
+        # A search missing some of its pages fails as a whole, so the next run crawls it again
+        if failed_pages:
+            raise Exception('; '.join(f"Page {page}: {error}" for page, error in sorted(failed_pages.items())))
+        return results
+
+    with open(output_path, 'ab') as output, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        remaining = iter(pending)
+        in_flight: Dict[Any, Tuple[str, Dict[str, Any]]] = {}
+        while True:
+            # Only `concurrency` searches are submitted at a time, so a huge query file isn't queued up front
+            while len(in_flight) < concurrency:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                in_flight[executor.submit(crawl, item[1])] = item
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, query = in_flight.pop(future)
+                search = {'keywords': query['keywords'], 'type': query['type']}
+                try:
+                    lines = [dict(search, result=result) for result in future.result()]
+                    failed = False
+                except Exception as e:
+                    lines = [dict(search, error=str(e))]
+                    failed = True
+
+                output.write(b''.join(dumps(line) + b"\n" for line in lines))
+                output.flush()
+                if not failed:
+                    checkpoint.record(key, output.tell())
+                progress.update(0 if failed else len(lines), failed)
+
+            if progress.clock() - last_report >= progress_interval:
+                last_report = progress.clock()
+                print(progress.report(), file=log, flush=True)
+
+    print(progress.report(), file=log, flush=True)
+    return progress.to_dict()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('queries', help='file of searches, one per line')
+    parser.add_argument('--output', required=True, help='JSON lines file the results are appended to')
+    parser.add_argument('--checkpoint', default='', help='checkpoint file (default: the output path + .checkpoint)')
+    parser.add_argument('--proxies', nargs='+', required=True, help='proxies the crawl goes through')
+    parser.add_argument('--type', default='Repositories', help='type of the searches given as plain keywords')
+    parser.add_argument('--concurrency', type=int, default=4, help='searches crawled at the same time')
+    parser.add_argument('--max-pages', type=int, default=1, help='search pages per search')
+    parser.add_argument('--max-results', type=int, default=None, help='results per search')
+    parser.add_argument('--fields', nargs='+', default=None, choices=VALID_FIELDS,
+                        help='fields of Repositories results')
+    parser.add_argument('--progress-interval', type=float, default=PROGRESS_INTERVAL,
+                        help='seconds between progress reports')
+    parser.add_argument('--max-age', type=float, default=None,
+                        help='most seconds since a search page read from the query cache was fetched')
+    parser.add_argument('--no-cache', action='store_true', help='fetch every search page again')
+    args = parser.parse_args()
+
+    with open(args.queries) as lines:
+        queries = list(read_queries(lines, args.type))
+    crawler = GitHubCrawler(args.proxies, max_age=args.max_age, no_cache=args.no_cache)
+    options = {'max_pages': args.max_pages, 'max_results': args.max_results, 'fields': args.fields}
+    summary = run(queries, crawler, args.output, args.checkpoint or f"{args.output}.checkpoint",
+                  args.concurrency, options, progress_interval=args.progress_interval)
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
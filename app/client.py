@@ -0,0 +1,191 @@
+import collections
+import os
+import threading
+from typing import Any, Dict, Mapping, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.request import ACCEPT_ENCODING as SUPPORTED_ENCODINGS
+
+from metrics import BYTES_SAVED, CONDITIONAL_REQUESTS, UPSTREAM_CONNECTIONS
+
+# Upper bound of concurrent upstream fetches per crawl
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 8))
+# Proxies with a keep-alive session, the least recently used one is closed past it
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 256))
+# Compressed encodings asked for, by default every one urllib3 can decode (brotli when the module is installed)
+ACCEPT_ENCODING = os.environ.get('ACCEPT_ENCODING', SUPPORTED_ENCODINGS)
+# Pages kept with their ETag or Last-Modified so fetching them again is a conditional request, 0 disables it
+CONDITIONAL_CACHE_SIZE = int(os.environ.get('CONDITIONAL_CACHE_SIZE', 10000))
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        UPSTREAM_CONNECTIONS.inc()
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        UPSTREAM_CONNECTIONS.inc()
+        return super()._new_conn()
+
+
+COUNTING_POOL_CLASSES = {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTP adapter counting the connections its pools open, to tell how often kept-alive ones are reused."""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = COUNTING_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy: str, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        # SOCKS proxies have pool classes of their own
+        if not proxy.lower().startswith('socks'):
+            manager.pool_classes_by_scheme = COUNTING_POOL_CLASSES
+        return manager
+
+
+class SessionPool:
+    """
+    Class to share keep-alive sessions between threads, one session per proxy. At most `max_sessions` are kept,
+    and the least recently used one is closed when another proxy needs a session.
+    """
+
+    def __init__(self, pool_maxsize: int = MAX_WORKERS, max_sessions: int = MAX_SESSIONS):
+        self.pool_maxsize = pool_maxsize
+        self.max_sessions = max_sessions
+        self._sessions: collections.OrderedDict[Optional[str], requests.Session] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, proxy: Optional[str] = None) -> requests.Session:
+        """Returns the session bound to the given proxy, creating it on first use."""
+        with self._lock:
+            session = self._sessions.get(proxy)
+            if session is not None:
+                self._sessions.move_to_end(proxy)
+                return session
+            session = self._sessions[proxy] = self._create_session(proxy)
+            while len(self._sessions) > max(self.max_sessions, 1):
+                # Connections still in use are closed once their response is released
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+            return session
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def close(self) -> None:
+        """Closes every pooled session and drops their connections."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _create_session(self, proxy: Optional[str]) -> requests.Session:
+        """Creates a session whose connection pool fits the configured concurrency."""
+        session = requests.Session()
+        adapter = CountingAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        if proxy:
+            session.proxies = {"http": proxy, "https": proxy}
+        return session
+
+
+class CachedPage:
+    """Validators of a fetched page, with what the crawler made of it and the bytes its download took."""
+
+    __slots__ = ('etag', 'last_modified', 'value', 'size')
+
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], value: Any, size: int):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.value = value
+        self.size = size
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Returns the headers making a request for the page conditional."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ConditionalCache:
+    """
+    Class to remember the ETag and Last-Modified of fetched pages, with what the crawler made of them, so the next
+    fetch of a page is a conditional request that GitHub answers with an empty 304 when the page didn't change.
+    The least recently used pages are evicted past `size` pages.
+    """
+
+    def __init__(self, size: int = CONDITIONAL_CACHE_SIZE):
+        self.size = size
+        self._pages: collections.OrderedDict[str, CachedPage] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            page = self._pages.get(url)
+            if page is not None:
+                self._pages.move_to_end(url)
+            return page
+
+    def put(self, url: str, headers: Mapping[str, str], value: Any, size: int) -> None:
+        """Keeps the page when the response has validators."""
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        if self.size <= 0 or not (etag or last_modified):
+            return
+        with self._lock:
+            self._pages[url] = CachedPage(etag, last_modified, value, size)
+            self._pages.move_to_end(url)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+    def revalidated(self, page: Optional[CachedPage], status_code: int) -> bool:
+        """Tells whether the response to a conditional request said the page is unchanged."""
+        if page is None:
+            return False
+        if status_code == 304:
+            CONDITIONAL_REQUESTS.inc(result='not_modified')
+            BYTES_SAVED.inc(page.size, reason='not_modified')
+            return True
+        CONDITIONAL_REQUESTS.inc(result='modified')
+        return False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+
+
+def wire_bytes(response: requests.Response, decoded: int) -> int:
+    """
+    Returns the bytes of the body read so far as they went over the wire, before decompression.
+    Responses without a readable raw stream count as uncompressed.
+    """
+    tell = getattr(response.raw, 'tell', None)
+    wire = tell() if callable(tell) else None
+    return wire if isinstance(wire, int) else decoded
+
+
+def record_transfer(response: requests.Response, decoded: int) -> int:
+    """Counts the bytes compression saved on the body read so far, and returns the bytes that went over the wire."""
+    wire = wire_bytes(response, decoded)
+    if decoded > wire:
+        BYTES_SAVED.inc(decoded - wire, reason='compression')
+    return wire
+
+
+# Sessions are shared by every crawl running in this worker process
+SESSIONS = SessionPool()
+# Validators of the pages fetched by every crawl running in this worker process
+CONDITIONAL_CACHE = ConditionalCache()
@@ -0,0 +1,250 @@
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+SEARCH_PAGE = """<html><body>
+{payload}
+<div class="Box-sc-g0xbh4-0 kXssRI">
+{items}
+</div>
+</body></html>"""
+
+EMBEDDED_DATA = '<script type="application/json" data-target="react-app.embeddedData">{data}</script>'
+
+SEARCH_ITEM = """<div class="Box-sc-g0xbh4-0 bDcVHV">
+    <a class="Link__StyledLink-sc-14289xe-0 dheQRw" href="/{owner}/{name}">{owner}/{name}</a>
+</div>"""
+
+REPO_PAGE = """<html><body>
+<a class="url fn" rel="author" href="/{owner}">
+    {owner}
+</a>
+{padding}
+<div class="BorderGrid about-margin">
+    <div class="BorderGrid-row"><h2>About</h2><p>Fixture repository {owner}/{name}</p></div>
+    <div class="BorderGrid-row">
+        <h2>Languages</h2>
+        <a class="d-inline-flex flex-items-center flex-nowrap Link--secondary no-underline text-small mr-3" href="#">
+            <span>Python</span><span>75.5%</span>
+        </a>
+        <a class="d-inline-flex flex-items-center flex-nowrap Link--secondary no-underline text-small mr-3" href="#">
+            <span>HTML</span><span>24.5%</span>
+        </a>
+    </div>
+</div>
+{padding}
+</body></html>"""
+
+PROXY_PAGE = """<html><body>
+<table class="table table-striped table-bordered">
+    <thead><tr><th>IP Address</th><th>Port</th><th>Code</th><th>Country</th><th>Anonymity</th><th>Google</th>
+    <th>Https</th><th>Last Checked</th></tr></thead>
+    <tbody>
+{rows}
+    </tbody>
+</table>
+</body></html>"""
+
+PROXY_ROW = ("<tr><td>10.{a}.{b}.{c}</td><td>{port}</td><td>{code}</td><td>{country}</td><td>{anonymity}</td>"
+             "<td>no</td><td>{https}</td><td>{minutes} mins ago</td></tr>")
+
+PADDING_BLOCK = '<div class="js-navigation-item"><span class="text-small">filler</span></div>\n'
+
+
+def render_embedded_data(repositories: List[Tuple[str, str]], page: int = 1) -> str:
+    """Renders the script tag with the JSON payload of a repository search, as GitHub embeds it."""
+    results = [{
+        'id': str(index),
+        'hl_name': f"{owner}/<em>{name}</em>",
+        'hl_trunc_description': f"Fixture repository <em>{name}</em> &amp; more",
+        'language': 'Python',
+        'followers': 1000 + index,
+        'repo': {'repository': {'id': index, 'name': name, 'owner_login': owner}},
+    } for index, (owner, name) in enumerate(repositories)]
+    data = {'payload': {'results': results, 'type': 'repositories', 'page': page, 'result_count': len(results)}}
+    # GitHub escapes '<' in the payload, so it can't close the script tag
+    return EMBEDDED_DATA.format(data=json.dumps(data).replace('<', '\\u003c'))
+
+
+def render_search_hits(repositories: List[Tuple[str, str]], embedded: bool = False, page: int = 1) -> str:
+    """Renders a search page listing the given (owner, name) repositories, with the embedded payload if asked."""
+    items = '\n'.join(SEARCH_ITEM.format(owner=owner, name=name) for owner, name in repositories)
+    payload = render_embedded_data(repositories, page) if embedded else ''
+    return SEARCH_PAGE.format(payload=payload, items=items)
+
+
+def render_search_page(query: str, results: int, page: int = 1, embedded: bool = False) -> str:
+    """Renders the given search page with the given number of repository hits."""
+    first = (page - 1) * results
+    return render_search_hits([(f"owner{i}", f"{query}-{i}") for i in range(first, first + results)], embedded, page)
+
+
+def render_proxy_page(proxies: int) -> str:
+    """Renders a free-proxy-list style table with the given number of proxies."""
+    countries = [('US', 'United States'), ('DE', 'Germany'), ('BR', 'Brazil'), ('IN', 'India')]
+    rows = []
+    for i in range(proxies):
+        code, country = countries[i % len(countries)]
+        rows.append(PROXY_ROW.format(a=i // 65536 % 256, b=i // 256 % 256, c=i % 256, port=8000 + i % 1000,
+                                     code=code, country=country, anonymity=('anonymous', 'elite proxy')[i % 2],
+                                     https=('yes', 'no')[i % 3 == 0], minutes=i % 60 + 1))
+    return PROXY_PAGE.format(rows='\n'.join(rows))
+
+
+def render_repo_page(owner: str, name: str, size: int = 0) -> str:
+    """Renders a repository page, padded with unrelated markup up to roughly `size` bytes."""
+    padding = PADDING_BLOCK * (size // (2 * len(PADDING_BLOCK)))
+    return REPO_PAGE.format(owner=owner, name=name, padding=padding)
+
+
+class FakeGitHub:
+    """
+    Local HTTP server standing in for github.com and the proxy list site, usable both directly and as an
+    HTTP proxy. GitHub pages fail with a 500 at `error_rate`, and pages saved in `fixtures` (search.html,
+    repo.html, proxies.html) are served instead of the generated ones. With `etags`, pages carry an ETag and
+    requests revalidating it are answered with a 304, and with `compress`, bodies are gzipped for the clients
+    accepting it. `bytes_sent` counts the body bytes written.
+    """
+
+    PROXY_LIST_PATH = '/free-proxy-list'
+
+    def __init__(self, results: int = 10, latency: float = 0.0, page_size: int = 0, pages: int = 100,
+                 error_rate: float = 0.0, proxies: int = 300, fixtures: str = '', seed: Optional[int] = None,
+                 embedded: bool = False, etags: bool = False, compress: bool = False):
+        self.results = results
+        self.pages = pages
+        self.latency = latency
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.proxies = proxies
+        self.fixtures = self._load_fixtures(fixtures)
+        self.embedded = embedded
+        self.etags = etags
+        self.compress = compress
+        self.requests = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def proxy_list_url(self) -> str:
+        return f"{self.url}{self.PROXY_LIST_PATH}"
+
+    def start(self) -> 'FakeGitHub':
+        """Starts serving in a background thread on a free local port."""
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the server and waits for its thread to exit."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> 'FakeGitHub':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def respond(self, path: str) -> tuple:
+        """Returns the status code and body served for the given path."""
+        with self._lock:
+            self.requests += 1
+            failed = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = urlsplit(path)
+        segments = [segment for segment in parts.path.split('/') if segment]
+        if parts.path == self.PROXY_LIST_PATH:
+            return 200, self.fixtures.get('proxies.html') or render_proxy_page(self.proxies)
+        if not segments:
+            return 200, '<html><body>GitHub</body></html>'
+        if failed:
+            return 500, 'Internal Server Error'
+
+        if parts.path == '/search':
+            params = parse_qs(parts.query)
+            query = params.get('q', ['repo'])[0].replace(' ', '-')
+            page = int(params.get('p', ['1'])[0])
+            return 200, self.fixtures.get('search.html') or render_search_page(
+                query, self.results if page <= self.pages else 0, page, self.embedded)
+        if len(segments) == 2:
+            return 200, self.fixtures.get('repo.html') or render_repo_page(segments[0], segments[1], self.page_size)
+        return 404, 'Not Found'
+
+    @staticmethod
+    def _load_fixtures(directory: str) -> Dict[str, str]:
+        fixtures = {}
+        for name in ('search.html', 'repo.html', 'proxies.html'):
+            path = os.path.join(directory, name)
+            if directory and os.path.exists(path):
+                with open(path, encoding='utf-8') as page:
+                    fixtures[name] = page.read()
+        return fixtures
+
+    def _handler(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._reply(write_body=True)
+
+            def do_HEAD(self):
+                self._reply(write_body=False)
+
+            def _reply(self, write_body):
+                # Requests sent through the server as a proxy carry the absolute URL in the path
+                status, body = fake.respond(self.path)
+                payload = body.encode('utf-8')
+                headers = {'Content-Type': 'text/html; charset=utf-8'}
+                if fake.etags and status == 200:
+                    headers['ETag'] = f'"{hashlib.sha1(payload).hexdigest()}"'
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        status, payload = 304, b''
+                if fake.compress and payload and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    headers['Content-Encoding'] = 'gzip'
+                    payload = gzip.compress(payload, compresslevel=6)
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if status != 304:
+                    self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                if write_body:
+                    self.wfile.write(payload)
+                    with fake._lock:
+                        fake.bytes_sent += len(payload)
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    # Streaming clients close the connection once they have parsed what they need
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from serialization import ResultRecord
+
+# Crawl jobs running at the same time in this worker process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+# Jobs waiting or running before new ones are rejected
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 100))
+# Seconds a finished job and its results are kept
+JOB_TTL = float(os.environ.get('JOB_TTL', 600))
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is full."""
+
+
+class Job:
+    """Class to hold the state and the results collected so far of a background crawl."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        # Results are kept as compact records until they are polled
+        self.results: List[ResultRecord] = []
+        self.found = 0
+        self.error: Optional[str] = None
+        # Search pages that failed while the results of the other pages were still collected
+        self.failed_pages: Dict[int, str] = {}
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_found(self, count: int) -> None:
+        """Adds results discovered on the search pages, before they are complete."""
+        with self._lock:
+            self.found += count
+
+    def add_result(self, result: Dict[str, Any]) -> None:
+        """Adds a complete result."""
+        record = ResultRecord.from_dict(result)
+        with self._lock:
+            self.results.append(record)
+
+    def add_page_error(self, page: int, error: str) -> None:
+        """Records a search page that failed."""
+        with self._lock:
+            self.failed_pages[page] = error
+
+    def to_dict(self, offset: int = 0) -> Dict[str, Any]:
+        """Returns the job state with the results from `offset` on."""
+        with self._lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'progress': {'completed': len(self.results), 'found': self.found},
+                'offset': offset,
+                'results': [record.to_dict() for record in self.results[offset:]],
+                'error': self.error,
+                'failed_pages': [{'page': page, 'error': error} for page, error in sorted(self.failed_pages.items())],
+            }
+
+
+class JobManager:
+    """Class to run crawl jobs on a bounded pool of threads and expire them after they finish."""
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE, ttl: float = JOB_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crawl-job')
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, target: Callable[[Job], None]) -> Job:
+        """Queues `target`, which runs the crawl and adds its results to the job it is given."""
+        with self._lock:
+            self._expire()
+            active = sum(1 for job in self._jobs.values() if job.finished_at is None)
+            if active >= self.queue_size:
+                raise JobQueueFull(f"{active} crawl jobs are already queued or running")
+            job = Job()
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, target)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Returns the job with the given id, or None when it is unknown or expired."""
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, target: Callable[[Job], None]) -> None:
+        job.status = 'running'
+        try:
+            target(job)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = self.clock()
+
+    def _expire(self) -> None:
+        now = self.clock()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at >= self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# Jobs live in the worker process that accepted them
+JOBS = JobManager()
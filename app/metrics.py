@@ -0,0 +1,263 @@
+import collections
+import contextlib
+import math
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels) + '}'
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Returns the nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class LatencyWindow:
+    """Keeps the latest observed latencies to tell what a slow request is."""
+
+    def __init__(self, size: int = 500):
+        self._values = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def percentile(self, percent: float, min_samples: int = 1) -> Optional[float]:
+        """Returns the percentile of the window, or None while it holds fewer than `min_samples` values."""
+        with self._lock:
+            values = list(self._values)
+        if len(values) < max(min_samples, 1):
+            return None
+        return percentile(values, percent)
+
+
+class Metric:
+    """Base class of the metrics exposed in the Prometheus text format."""
+
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing count, per label values."""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        """Returns the sum over every label value."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {value}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """Value that can go up and down, per label values."""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {value}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets, per label values."""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: the count of every bucket, the sum and the count of observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def get_count(self, **labels: str) -> int:
+        with self._lock:
+            values = self._values.get(self._key(labels))
+            return values[2] if values else 0
+
+    def _samples(self) -> List[str]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                labels = list(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(f"{self.name}_bucket{_format_labels(labels + [('le', str(bound))])} {cumulative}")
+                samples.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+                samples.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                samples.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return samples
+
+
+class Registry:
+    """Class to collect metrics and render them for the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    'crawler_upstream_requests_total', 'Upstream requests by response status or error, and proxy.',
+    ['status', 'proxy']))
+PARSE_FAILURES = REGISTRY.register(Counter(
+    'crawler_parse_failures_total', 'Pages that could not be parsed, by page kind.', ['page']))
+SEARCH_PAGES = REGISTRY.register(Counter(
+    'crawler_search_pages_total', 'Parsed search pages, by source of the hits: embedded payload or DOM.',
+    ['source']))
+REPO_PAGE_BYTES = REGISTRY.register(Counter(
+    'crawler_repo_page_bytes_total', 'Bytes of repository pages read from upstream.'))
+REPO_PAGES_STOPPED_EARLY = REGISTRY.register(Counter(
+    'crawler_repo_pages_stopped_early_total', 'Repository pages whose download stopped once they were parsed.'))
+RESULTS = REGISTRY.register(Counter(
+    'crawler_results_total', 'Results returned by crawls, by search type.', ['type']))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'crawler_stage_seconds', 'Time spent in each stage of the crawl pipeline.', ['stage']))
+THROTTLED_RESPONSES = REGISTRY.register(Counter(
+    'crawler_throttled_responses_total', 'Upstream responses asking the crawler to slow down, by proxy.', ['proxy']))
+RETRIED_REQUESTS = REGISTRY.register(Counter(
+    'crawler_fetch_retries_total', 'Upstream requests sent again after a failure, by stage.', ['stage']))
+HEDGED_REQUESTS = REGISTRY.register(Counter(
+    'crawler_hedged_requests_total', 'Duplicate requests sent through a second proxy, by stage and winner.',
+    ['stage', 'winner']))
+STORE_LOOKUPS = REGISTRY.register(Counter(
+    'crawler_store_lookups_total', 'Repositories looked up in the store, by hit or miss.', ['result']))
+COALESCED_CALLS = REGISTRY.register(Counter(
+    'crawler_coalesced_total', 'Crawls and enrichments served by an identical one already in flight, by kind.',
+    ['kind']))
+UPSTREAM_CONNECTIONS = REGISTRY.register(Counter(
+    'crawler_upstream_connections_total', 'Connections opened to GitHub or to proxies. Compared with the upstream '
+    'requests, tells how often kept-alive connections are reused.'))
+CONDITIONAL_REQUESTS = REGISTRY.register(Counter(
+    'crawler_conditional_requests_total', 'Upstream requests revalidating a known page, by whether it was modified.',
+    ['result']))
+BYTES_SAVED = REGISTRY.register(Counter(
+    'crawler_upstream_bytes_saved_total', 'Upstream bytes not transferred, by reason: compression or not_modified.',
+    ['reason']))
+QUERY_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'crawler_query_cache_lookups_total', 'Search pages looked up in the query cache, by result: memory, disk, miss '
+    'or bypass.', ['result']))
+QUERY_CACHE_EVICTIONS = REGISTRY.register(Counter(
+    'crawler_query_cache_evictions_total', 'Search pages evicted from the memory tier of the query cache.'))
+QUERY_CACHE_ENTRIES = REGISTRY.register(Gauge(
+    'crawler_query_cache_entries', 'Search pages held in the memory tier of the query cache.'))
+QUERY_CACHE_BYTES = REGISTRY.register(Gauge(
+    'crawler_query_cache_bytes', 'Bytes of serialized hits held in the memory tier of the query cache.'))
+SCHEDULER_CONCURRENCY = REGISTRY.register(Gauge(
+    'crawler_scheduler_concurrency', 'Upstream requests currently allowed in flight.'))
+
+
+class Timings:
+    """Class to time the stages of one crawl, feeding the stage histogram as well."""
+
+    def __init__(self):
+        self._totals: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """Times the enclosed block as one occurrence of the stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage: str, seconds: float) -> None:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def server_timing(self) -> str:
+        """
+        Returns the stages as a Server-Timing header value. Durations are summed over all occurrences,
+        so stages running concurrently can add up to more than the wall time of the request.
+        """
+        with self._lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f};desc="{self._counts[stage]}x"'
+                             for stage, seconds in self._totals.items())
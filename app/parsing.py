@@ -0,0 +1,128 @@
+import os
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+# BeautifulSoup tree builder: 'auto' uses lxml when it is installed and falls back to html.parser
+HTML_PARSER = os.environ.get('HTML_PARSER', 'auto')
+
+# Only the elements the crawler reads are built into the tree
+SEARCH_RESULTS = SoupStrainer('div', class_="Box-sc-g0xbh4-0 kXssRI")
+PROXY_TABLE = SoupStrainer('table', class_='table table-striped table-bordered')
+
+
+def _is_repo_target(name: str, attrs: Dict[str, Any]) -> bool:
+    """Matches the owner link and the about sidebar of a repository page."""
+    classes = attrs.get('class') or ''
+    if isinstance(classes, list):
+        classes = ' '.join(classes)
+    return (name == 'a' and classes == 'url fn') or (name == 'div' and classes == 'BorderGrid about-margin')
+
+
+REPO_PAGE = SoupStrainer(_is_repo_target)
+
+
+def available_parsers() -> Dict[str, bool]:
+    """Tells which tree builders are installed."""
+    parsers = {}
+    for features in ('html.parser', 'lxml', 'html5lib'):
+        try:
+            BeautifulSoup('', features)
+            parsers[features] = True
+        except FeatureNotFound:
+            parsers[features] = False
+    return parsers
+
+
+def resolve_parser(features: str = HTML_PARSER) -> str:
+    """Returns the tree builder to use for the configured backend."""
+    if features != 'auto':
+        return features
+    return 'lxml' if available_parsers()['lxml'] else 'html.parser'
+
+
+PARSER = resolve_parser()
+
+
+def make_soup(markup: Union[str, bytes], parse_only: Optional[SoupStrainer] = None,
+              features: Optional[str] = None) -> BeautifulSoup:
+    """Parses the markup with the configured backend, restricted to `parse_only` when given."""
+    return BeautifulSoup(markup, features or PARSER, parse_only=parse_only)
+
+
+class RepoPageParser(HTMLParser):
+    """
+    Incremental parser of a repository page, fed chunk by chunk while it downloads. It picks up the owner link
+    and the language statistics of the about sidebar, and tells when both are complete so the download can stop.
+    """
+
+    LANGUAGE_CLASS = "d-inline-flex flex-items-center flex-nowrap Link--secondary no-underline text-small mr-3"
+
+    def __init__(self):
+        super().__init__()
+        self.owner: Optional[str] = None
+        self.language_stats: Optional[Dict[str, float]] = None
+        self._owner_text: Optional[List[str]] = None
+        # Depth of nested divs inside the sidebar, None outside of it
+        self._sidebar_depth: Optional[int] = None
+        # Language links of every sidebar row, and the spans of the link being read
+        self._rows: List[List[List[str]]] = []
+        self._spans: Optional[List[str]] = None
+        self._in_span = False
+
+    @property
+    def done(self) -> bool:
+        return self.owner is not None and self.language_stats is not None
+
+    def feed_chunk(self, chunk: str) -> bool:
+        """Feeds the next chunk of the page and tells whether everything needed was found."""
+        self.feed(chunk)
+        return self.done
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        classes = dict(attrs).get('class') or ''
+        if tag == 'a' and classes == 'url fn' and self.owner is None:
+            self._owner_text = []
+        elif tag == 'div' and self._sidebar_depth is not None:
+            self._sidebar_depth += 1
+            if self._sidebar_depth == 1 and 'BorderGrid-row' in classes.split():
+                self._rows.append([])
+        elif tag == 'div' and classes == 'BorderGrid about-margin' and self.language_stats is None:
+            self._sidebar_depth = 0
+        elif tag == 'a' and classes == self.LANGUAGE_CLASS and self._sidebar_depth is not None and self._rows:
+            self._spans = []
+        elif tag == 'span' and self._spans is not None:
+            self._spans.append('')
+            self._in_span = True
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'a' and self._owner_text is not None:
+            self.owner = ''.join(self._owner_text).strip().replace('\n', '')
+            self._owner_text = None
+        elif tag == 'a' and self._spans is not None:
+            self._rows[-1].append(self._spans)
+            self._spans = None
+        elif tag == 'span':
+            self._in_span = False
+        elif tag == 'div' and self._sidebar_depth is not None:
+            if self._sidebar_depth == 0:
+                self._sidebar_depth = None
+                self._finish_languages()
+            else:
+                self._sidebar_depth -= 1
+
+    def handle_data(self, data: str) -> None:
+        if self._owner_text is not None:
+            self._owner_text.append(data)
+        elif self._in_span and self._spans:
+            self._spans[-1] += data
+
+    def _finish_languages(self) -> None:
+        # Languages are listed in the last row of the sidebar
+        if not self._rows:
+            raise ValueError("The about sidebar has no rows")
+        stats = {}
+        for spans in self._rows[-1]:
+            stats[spans[0]] = float(spans[1].replace('%', ''))
+        self.language_stats = stats
@@ -1,17 +1,50 @@
+import codecs
+import html
 import json
+import math
 import os
 import random
-import uuid
-from typing import List, Any, Dict
+import re
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, as_completed, wait
+from typing import List, Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple, Union
 
-import multiprocessing as mp
 import requests
-from bs4 import BeautifulSoup
+
+from client import CONDITIONAL_CACHE, MAX_WORKERS, SESSIONS, ConditionalCache, record_transfer, wire_bytes
+from metrics import (COALESCED_CALLS, HEDGED_REQUESTS, PARSE_FAILURES, REPO_PAGE_BYTES, REPO_PAGES_STOPPED_EARLY,
+                     RESULTS, RETRIED_REQUESTS, SEARCH_PAGES, UPSTREAM_REQUESTS, LatencyWindow, Timings)
+from parsing import PROXY_TABLE, REPO_PAGE, SEARCH_RESULTS, RepoPageParser, make_soup
+from proxy_pool import PROXY_POOL, ProxyPool, is_proxy_failure
+from query_cache import QUERY_CACHE, QueryCache, search_page_key
+from scheduler import SCHEDULER, RequestScheduler, is_throttled
+from singleflight import SingleFlight
+from store import STORE, RepositoryStore
 
 # Constants for environment variables
 PROXY_URL = os.environ.get('PROXY_URL', 'https://free-proxy-list.net/')
+# Comma separated proxy list pages, fetched concurrently and merged, HTML tables or plain `ip:port` lines
+PROXY_URLS = [url.strip() for url in os.environ.get('PROXY_URLS', PROXY_URL).split(',') if url.strip()]
 GITHUB_URL = os.environ.get('GITHUB_URL', 'https://github.com')
 
+# Seconds to wait for an upstream response before the proxy is considered stuck
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', 30))
+
+# Times a request that failed through its proxy or was throttled is sent again through another proxy
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 2))
+# Base and cap in seconds of the jittered exponential backoff between attempts
+RETRY_BACKOFF = float(os.environ.get('RETRY_BACKOFF', 0.5))
+RETRY_BACKOFF_MAX = float(os.environ.get('RETRY_BACKOFF_MAX', 8))
+
+# Latency percentile after which a duplicate request is sent through a second proxy, 0 disables hedging
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 0))
+# Successful requests observed before hedging starts
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', 20))
+
+# Number of results GitHub shows on one search page
+RESULTS_PER_PAGE = int(os.environ.get('RESULTS_PER_PAGE', 10))
+
 # Setting up headers for requests
 try:
     HEADERS = json.loads(os.environ.get('HEADERS'))
@@ -23,112 +56,932 @@ except:
     }
 
 
+# Seconds another process sharing the store is waited for while it fetches a repository
+ENRICHMENT_LEASE_TTL = float(os.environ.get('ENRICHMENT_LEASE_TTL', 60))
+ENRICHMENT_LEASE_POLL = float(os.environ.get('ENRICHMENT_LEASE_POLL', 0.1))
+
+# Identical crawls and repository enrichments in flight in this worker process share one upstream fetch
+CRAWLS = SingleFlight('crawl')
+ENRICHMENTS = SingleFlight('enrichment')
+
+# Read repository pages in chunks and close the connection once the owner and languages are parsed
+STREAM_REPO_PAGES = os.environ.get('STREAM_REPO_PAGES', 'true').lower() == 'true'
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 16384))
+
+# Script tag holding the JSON payload of GitHub's search page
+EMBEDDED_DATA_MARKER = b'data-target="react-app.embeddedData"'
+# Fields of a Repositories result that the embedded search payload provides
+SUMMARY_FIELDS = ('stars', 'language', 'description')
+
+# Recent latencies of successful requests, per fetch stage
+FETCH_LATENCY = {stage: LatencyWindow() for stage in ('search_fetch', 'repo_fetch')}
+
+# Threads running hedged requests, shared by every crawl in this worker process
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=4 * MAX_WORKERS, thread_name_prefix='hedged-fetch')
+
+
+# Proxy table columns kept in the proxy records, by header
+PROXY_COLUMNS = {
+    'ip address': 'ip', 'ip': 'ip', 'port': 'port', 'code': 'country_code', 'country': 'country',
+    'anonymity': 'anonymity', 'https': 'https', 'last checked': 'last_checked',
+}
+# Plain text proxy lists, one `ip:port` per line
+PROXY_LINE = re.compile(r'^\s*(\d{1,3}(?:\.\d{1,3}){3}):(\d{1,5})\b', re.MULTILINE)
+# Parts of a "1 hour 5 mins ago" last checked time
+AGE_PART = re.compile(r'(\d+)\s*(sec|min|hour|day)')
+AGE_UNITS = {'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400}
+
+
+class ProxyRecord:
+    """Proxy listed by a source, with what the source tells about it."""
+
+    __slots__ = ('ip', 'port', 'country_code', 'country', 'anonymity', 'https', 'checked_at')
+
+    def __init__(self, ip: str, port: Optional[str] = None, country_code: Optional[str] = None,
+                 country: Optional[str] = None, anonymity: Optional[str] = None, https: Optional[bool] = None,
+                 checked_at: Optional[float] = None):
+        self.ip = ip
+        self.port = port
+        self.country_code = country_code
+        self.country = country
+        self.anonymity = anonymity
+        self.https = https
+        self.checked_at = checked_at
+
+    @property
+    def address(self) -> str:
+        return f"{self.ip}:{self.port}" if self.port else self.ip
+
+    def matches(self, https: Optional[bool] = None, country: Optional[str] = None, max_age: Optional[float] = None,
+                now: Optional[float] = None) -> bool:
+        """Tells whether the proxy passes the given filters, proxies lacking a filtered attribute don't."""
+        if https is not None and self.https is not https:
+            return False
+        if country is not None and country.lower() not in ((self.country_code or '').lower(),
+                                                           (self.country or '').lower()):
+            return False
+        if max_age is not None:
+            if self.checked_at is None or (now or time.time()) - self.checked_at > max_age:
+                return False
+        return True
+
+    def to_dict(self, now: Optional[float] = None) -> Dict[str, Any]:
+        age = None if self.checked_at is None else round(max((now or time.time()) - self.checked_at, 0))
+        return {
+            'address': self.address,
+            'ip': self.ip,
+            'port': self.port,
+            'country_code': self.country_code,
+            'country': self.country,
+            'anonymity': self.anonymity,
+            'https': self.https,
+            'age': age,
+        }
+
+
 class ProxyParser:
-    """Class to fetch and parse proxy addresses."""
+    """
+    Class to fetch and parse proxy addresses from several proxy list pages, fetched concurrently.
+    Proxies listed by more than one page are kept once, with the details of the most recent check.
+    """
 
-    def __init__(self):
+    def __init__(self, urls: Optional[List[str]] = None):
+        self.urls = urls or PROXY_URLS
         self.proxies = []
+        self.records: List[ProxyRecord] = []
+        # Error of each page that couldn't be fetched, while the others could
+        self.errors: Dict[str, str] = {}
 
     def fetch_proxies(self) -> None:
-        """Fetches proxy addresses from the proxy URL."""
+        """Fetches proxy addresses from the proxy URLs. Without any URL, there are no proxies."""
+        if not self.urls:
+            return
+        with ThreadPoolExecutor(max_workers=len(self.urls)) as executor:
+            futures = {url: executor.submit(self._fetch_source, url) for url in self.urls}
+
+        records, error = [], None
+        for url, future in futures.items():
+            try:
+                records.extend(future.result())
+            except Exception as e:
+                # A page that can't be fetched or parsed doesn't drop the proxies of the others
+                self.errors[url] = str(e)
+                error = e
+        if len(self.errors) == len(self.urls):
+            raise Exception(f"Error fetching proxies: {error}")
+
+        self.records = merge_proxy_records(records)
+        self.proxies = [record.address for record in self.records]
+
+    @staticmethod
+    def _fetch_source(url: str) -> List[ProxyRecord]:
+        response = SESSIONS.get().get(url=url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return parse_proxy_list(response.text)
+
+    def get_proxies(self, https: Optional[bool] = None, country: Optional[str] = None,
+                    max_age: Optional[float] = None) -> List[str]:
+        """Returns the list of fetched proxy addresses, limited to the proxies passing the given filters."""
+        if https is None and country is None and max_age is None:
+            return self.proxies
+        return [record['address'] for record in self.get_records(https, country, max_age)]
+
+    def get_records(self, https: Optional[bool] = None, country: Optional[str] = None,
+                    max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Returns the details of the fetched proxies passing the given filters."""
+        now = time.time()
+        return [record.to_dict(now) for record in self.records if record.matches(https, country, max_age, now)]
+
+
+class SearchOrder:
+    """
+    Class to admit the hits of the search pages of one crawl, each URL once. With `max_results`, hits are admitted
+    in search order once every earlier page is parsed, so the first `max_results` hits are kept whatever order the
+    pages finish in. Without it, the hits of a page are admitted as soon as it is parsed.
+    """
+
+    def __init__(self, max_results: Optional[int] = None):
+        self.max_results = max_results
+        self.admitted = 0
+        self._seen: Set[str] = set()
+        self._parsed: Dict[int, List[Dict[str, Any]]] = {}
+        self._next_page = 1
+
+    @property
+    def full(self) -> bool:
+        """Tells whether `max_results` hits were admitted, so the remaining pages aren't needed."""
+        return self.max_results is not None and self.admitted >= self.max_results
+
+    def add_page(self, page: int, hits: List[Dict[str, Any]]) -> List[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """Returns the hits the parsed page lets in, with their (page, index on page) position."""
+        if self.max_results is None:
+            return self._admit(page, hits)
+        self._parsed[page] = hits
+        admitted = []
+        while self._next_page in self._parsed and not self.full:
+            admitted.extend(self._admit(self._next_page, self._parsed.pop(self._next_page)))
+            self._next_page += 1
+        return admitted
+
+    def _admit(self, page: int, hits: List[Dict[str, Any]]) -> List[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        admitted = []
+        for index, hit in enumerate(hits):
+            if self.full:
+                break
+            if hit['url'] not in self._seen:
+                self._seen.add(hit['url'])
+                admitted.append(((page, index), hit))
+                self.admitted += 1
+        return admitted
+
+
+class ResultAssembler:
+    """
+    Class to turn the search pages of one crawl into results. The threaded and asyncio crawlers share it, and only
+    differ in how they wait for the pages, the store and the repository enrichments.
+    """
+
+    def __init__(self, search_type: str, max_results: Optional[int] = None, fields: Optional[List[str]] = None,
+                 on_page_error: Optional[Callable[[int, str], None]] = None):
+        self.search_type = search_type
+        self.fields = fields
+        self.on_page_error = on_page_error
+        self.order = SearchOrder(max_results)
+        self.fetch_repo_pages = needs_repo_page(search_type, fields)
+        self._hits: Dict[Tuple[int, int], Dict[str, Any]] = {}
+
+    def add_page(self, page: int, hits: List[Dict[str, Any]]) -> List[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """Returns the hits the parsed page lets in, with their position."""
+        return self.order.add_page(page, hits)
+
+    def page_failed(self, page: int, error: Exception) -> List[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """
+        Fails the crawl when its first page couldn't be fetched. A later page is reported to `on_page_error` and
+        counted as empty, so the results of the other pages are still returned.
+        """
+        if page == 1:
+            raise error
+        if self.on_page_error is not None:
+            self.on_page_error(page, str(error))
+        return self.order.add_page(page, [])
+
+    def place(self, found: List[Tuple[Tuple[int, int], Dict[str, Any]]], stored: Dict[str, Dict[str, Any]]
+              ) -> Tuple[List[Tuple[Tuple[int, int], str]], List[Tuple[Tuple[int, int], Dict[str, Any]]]]:
+        """
+        Splits the hits let in into the repositories to enrich and the results that are already complete,
+        from the search page or from the `stored` repositories.
+        """
+        to_enrich, complete = [], []
+        for position, hit in found:
+            repo_url = hit['url']
+            if self.fetch_repo_pages and repo_url not in stored:
+                self._hits[position] = hit
+                to_enrich.append((position, repo_url))
+            else:
+                RESULTS.inc(type=self.search_type)
+                result = add_summary(stored.get(repo_url, {'url': repo_url}), hit)
+                complete.append((position, select_fields(self.search_type, result, self.fields)))
+        return to_enrich, complete
+
+    def enriched(self, position: Tuple[int, int], get_result: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Returns the result of an enriched repository, from the callable returning or raising its enrichment."""
+        hit = self._hits.pop(position)
         try:
-            response = requests.get(url=PROXY_URL)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Error fetching proxies: {e}")
+            result = select_fields(self.search_type, add_summary(get_result(), hit), self.fields)
+            RESULTS.inc(type=self.search_type)
+        except Exception as e:
+            # A repository whose page can't be fetched or parsed is returned with the error
+            result = {'url': hit['url'], 'error': str(e)}
+        return result
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-        table = soup.find('table', class_='table table-striped table-bordered')
-        ip_addresses = table.find_all('tr')[1:]
 
-        for ip_address in ip_addresses:
-            proxy = ip_address.find_all('td')[0].text
-            self.proxies.append(proxy)
+class RepoPageReader:
+    """
+    Class to feed the chunks of a repository page to the incremental parser, keeping them for a full parse
+    when the incremental parser can't make sense of the page.
+    """
 
-    def get_proxies(self) -> List[str]:
-        """Returns the list of fetched proxy addresses."""
-        return self.proxies
+    def __init__(self, encoding: Optional[str] = None):
+        self.parser: Optional[RepoPageParser] = RepoPageParser()
+        self.decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+        self.chunks: List[bytes] = []
+        self.received = 0
+
+    def feed(self, chunk: bytes) -> Optional[Dict[str, Any]]:
+        """Returns the owner and languages once the chunks read so far hold them."""
+        self.chunks.append(chunk)
+        self.received += len(chunk)
+        if self.parser is None:
+            return None
+        try:
+            if self.parser.feed_chunk(self.decoder.decode(chunk)):
+                REPO_PAGES_STOPPED_EARLY.inc()
+                return {'language_stats': self.parser.language_stats, 'owner': self.parser.owner}
+        except (ValueError, IndexError):
+            # Keep downloading for the full parse
+            self.parser = None
+        return None
+
+    def parse_whole(self) -> Dict[str, Any]:
+        return parse_repo_page(b''.join(self.chunks))
 
 
 class GitHubCrawler:
-    """Class to crawl GitHub using provided proxies."""
+    """
+    Class to crawl GitHub using provided proxies. Search pages are read from the query cache while they are
+    fresh, or younger than `max_age` seconds when given, and always fetched with `no_cache`.
+    """
 
-    def __init__(self, proxies: List[str]):
+    def __init__(self, proxies: List[str], max_workers: int = MAX_WORKERS, pool: ProxyPool = PROXY_POOL,
+                 scheduler: RequestScheduler = SCHEDULER, store: RepositoryStore = STORE,
+                 conditional: ConditionalCache = CONDITIONAL_CACHE, cache: QueryCache = QUERY_CACHE,
+                 max_age: Optional[float] = None, no_cache: bool = False):
         self.proxies = proxies
+        self.max_workers = max_workers
+        self.pool = pool
+        self.scheduler = scheduler
+        self.store = store
+        self.conditional = conditional
+        self.cache = cache
+        self.max_age = max_age
+        self.no_cache = no_cache
+        self.timings = Timings()
 
-    def crawl(self, keywords: List[str], search_type: str) -> List[Dict[str, Any]]:
-        """Crawls GitHub for the given keywords and search type, and returns a list of results."""
-        url = f"{GITHUB_URL}/search?q={'+'.join(keywords)}&type={search_type}"
-        proxy = self._get_valid_proxy()
+    def crawl(self, keywords: List[str], search_type: str, max_pages: int = 1,
+              max_results: Optional[int] = None, fields: Optional[List[str]] = None,
+              on_page_error: Optional[Callable[[int, str], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Crawls GitHub for the given keywords and search type, and returns a list of results.
+        Repositories are limited to `fields` when given, and their pages are only fetched for `language_stats`.
+        An identical crawl already in flight is waited for instead of crawling again.
+        A failed first page fails the crawl, while a later one is passed to `on_page_error` with its error.
+        """
+        def run() -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+            errors = {}
+            results = sorted(self._iter_results(keywords, search_type, max_pages, max_results, fields=fields,
+                                                on_page_error=errors.__setitem__),
+                             key=lambda item: item[0])
+            return [result for _, result in results], errors
+
+        # A crawl through other proxies or reading the cache differently doesn't get the results of this one
+        key = (tuple(keywords), search_type, max_pages, max_results, None if fields is None else tuple(sorted(fields)),
+               tuple(sorted(set(self.proxies))), self.max_age, self.no_cache)
+        (results, errors), _ = CRAWLS.do(key, run)
+        if on_page_error is not None:
+            for page, error in sorted(errors.items()):
+                on_page_error(page, error)
+        return results
+
+    def iter_crawl(self, keywords: List[str], search_type: str, max_pages: int = 1,
+                   max_results: Optional[int] = None, fields: Optional[List[str]] = None,
+                   on_found: Optional[Callable[[int], None]] = None,
+                   on_page_error: Optional[Callable[[int, str], None]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Crawls GitHub like `crawl`, but yields every result as soon as it is complete.
+        `on_found` is called with the number of new results found on every parsed search page.
+        """
+        for _, result in self._iter_results(keywords, search_type, max_pages, max_results, on_found, fields,
+                                            on_page_error):
+            yield result
+
+    def crawl_batch(self, queries: List[Dict[str, Any]], max_pages: int = 1,
+                    max_results: Optional[int] = None, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Crawls several searches at once. Search pages of every query are fetched concurrently and a repository
+        found by several queries is enriched only once. With `max_results`, only the repositories of the first
+        `max_results` hits of each query are enriched. Returns the results of each query, in query order.
+        """
+        if max_results is not None:
+            max_pages = min(max_pages, math.ceil(max_results / RESULTS_PER_PAGE))
+        with self.timings.span('proxy_validation'):
+            self.pool.validate(self.proxies)
+        # Fail before any page is queued when no proxy is usable
+        self._get_valid_proxy()
+
+        # Identical queries share their search pages
+        unique = {}
+        for query in queries:
+            unique.setdefault((tuple(query['keywords']), query['type']),
+                              {'order': SearchOrder(max_results), 'hits': [], 'error': None})
 
-        manager = mp.Manager()
-        return_dict = manager.dict()
-        jobs = []
+        enriched: Dict[str, Future] = {}
+        summaries: Dict[str, Dict[str, Any]] = {}
+        hits = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = {}
+            for keywords, search_type in unique:
+                for page in range(1, max_pages + 1):
+                    future = executor.submit(self._get_search_page, list(keywords), search_type, page)
+                    pages[future] = (keywords, search_type, page)
 
+            for future in as_completed(pages):
+                keywords, search_type, page = pages[future]
+                search = unique[(keywords, search_type)]
+                try:
+                    page_hits = future.result()
+                except Exception as e:
+                    # The pages after a failed one are still admitted
+                    search['error'] = str(e)
+                    page_hits = []
+                hits += len(page_hits)
+
+                repo_urls = []
+                for position, hit in search['order'].add_page(page, page_hits):
+                    search['hits'].append((position, hit['url']))
+                    summaries[hit['url']] = hit
+                    repo_urls.append(hit['url'])
+
+                if needs_repo_page(search_type, fields):
+                    # Only repositories that are missing from the store or stale are fetched
+                    new_urls = list(dict.fromkeys(repo_url for repo_url in repo_urls if repo_url not in enriched))
+                    stored = self.store.get_fresh(new_urls)
+                    for repo_url in new_urls:
+                        if repo_url in stored:
+                            enriched[repo_url] = Future()
+                            enriched[repo_url].set_result(stored[repo_url])
+                        else:
+                            enriched[repo_url] = executor.submit(self._get_extra_info, repo_url)
+
+            searches = {key: self._collect_batch_results(key[1], search, enriched, summaries, fields)
+                        for key, search in unique.items()}
+
+        results = []
+        for query in queries:
+            search = searches[(tuple(query['keywords']), query['type'])]
+            results.append({'keywords': query['keywords'], 'type': query['type'], **search})
+            RESULTS.inc(sum(1 for result in search['results'] if 'error' not in result), type=query['type'])
+        return {'queries': results, 'hits': hits, 'unique_repositories': len(enriched)}
+
+    @staticmethod
+    def _collect_batch_results(search_type: str, search: Dict[str, Any], enriched: Dict[str, Future],
+                               summaries: Dict[str, Dict[str, Any]],
+                               fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Puts the results of one batch query in search order, waiting for their enrichment."""
+        results = []
+        for _, repo_url in sorted(search['hits']):
+            if needs_repo_page(search_type, fields):
+                try:
+                    result = enriched[repo_url].result()
+                except Exception as e:
+                    # A repository whose page can't be fetched or parsed is returned with the error
+                    results.append({'url': repo_url, 'error': str(e)})
+                    continue
+            else:
+                result = {'url': repo_url}
+            results.append(select_fields(search_type, add_summary(result, summaries[repo_url]), fields))
+
+        search_results = {'results': results}
+        if search['error'] is not None:
+            search_results['error'] = search['error']
+        return search_results
+
+    def _iter_results(self, keywords: List[str], search_type: str, max_pages: int, max_results: Optional[int],
+                      on_found: Optional[Callable[[int], None]] = None, fields: Optional[List[str]] = None,
+                      on_page_error: Optional[Callable[[int, str], None]] = None
+                      ) -> Iterator[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """
+        Fetches the search pages concurrently and enriches repositories as soon as their page is parsed.
+        Yields (position, result) pairs in completion order, where position is (page, index on page).
+        With `max_results`, the results are those of the first `max_results` hits in search order.
+        """
+        if max_results is not None:
+            max_pages = min(max_pages, math.ceil(max_results / RESULTS_PER_PAGE))
+        with self.timings.span('proxy_validation'):
+            self.pool.validate(self.proxies)
+        # Fail before any page is queued when no proxy is usable
+        self._get_valid_proxy()
+
+        assembler = ResultAssembler(search_type, max_results, fields, on_page_error)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
         try:
-            response = requests.get(url=url, headers=HEADERS, proxies={"http": proxy, "https": proxy})
-            response.raise_for_status()
+            pending = {executor.submit(self._get_search_page, keywords, search_type, page): page
+                       for page in range(1, max_pages + 1)}
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position = pending.pop(future, None)
+                    if position is None:
+                        # A search page that was no longer needed
+                        continue
+
+                    if isinstance(position, int):
+                        # A search page finished: queue the repositories it lets in
+                        try:
+                            found = assembler.add_page(position, future.result())
+                        except Exception as e:
+                            found = assembler.page_failed(position, e)
+                        if on_found is not None:
+                            on_found(len(found))
+                        if assembler.order.full:
+                            for page_future in [f for f, p in pending.items() if isinstance(p, int)]:
+                                page_future.cancel()
+                                del pending[page_future]
+
+                        # Only repositories that are missing from the store or stale are fetched
+                        stored = {}
+                        if assembler.fetch_repo_pages:
+                            stored = self.store.get_fresh(hit['url'] for _, hit in found)
+
+                        to_enrich, complete = assembler.place(found, stored)
+                        for hit_position, repo_url in to_enrich:
+                            pending[executor.submit(self._get_extra_info, repo_url)] = hit_position
+                        yield from complete
+                        continue
+
+                    yield position, assembler.enriched(position, future.result)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def enrich(self, urls: List[str], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the result entries of the given repositories, in order, limited to `fields` when given.
+        Only the pages needed for the fields that are missing from the store or stale are fetched.
+        """
+        results = {url: {'url': url, 'error': "Not a GitHub repository URL"}
+                   for url in urls if not url.startswith(f"{GITHUB_URL}/")}
+        valid = [url for url in dict.fromkeys(urls) if url not in results]
+
+        if needs_repo_page('Repositories', fields):
+            results.update(self.store.get_fresh(valid))
+            missing = [url for url in valid if url not in results]
+            if missing:
+                with self.timings.span('proxy_validation'):
+                    self.pool.validate(self.proxies)
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = {url: executor.submit(self._get_extra_info, url) for url in missing}
+                    for url, future in futures.items():
+                        try:
+                            results[url] = future.result()
+                        except Exception as e:
+                            results[url] = {'url': url, 'error': str(e)}
+        else:
+            results.update({url: {'url': url} for url in valid})
+
+        return [select_fields('Repositories', results[url], fields) for url in urls]
+
+    def _get_search_page(self, keywords: List[str], search_type: str, page: int) -> List[Dict[str, Any]]:
+        """Returns the hits of one page of search results, from the query cache when they are fresh enough."""
+        key = search_page_key(keywords, search_type, page)
+        hits = self.cache.get(key, self.max_age, self.no_cache)
+        if hits is None:
+            hits = self._fetch_search_page(keywords, search_type, page)
+            self.cache.put(key, hits)
+        return hits
+
+    def _fetch_search_page(self, keywords: List[str], search_type: str, page: int) -> List[Dict[str, Any]]:
+        """Fetches one page of search results and returns the hits found on it."""
+        url = f"{GITHUB_URL}/search?q={'+'.join(keywords)}&type={search_type}"
+        if page > 1:
+            url = f"{url}&p={page}"
+
+        # A page fetched before is revalidated, and its hits are reused when GitHub answers 304
+        cached = self.conditional.get(url)
+        try:
+            response = self._fetch(url, 'search_fetch', headers=cached.headers if cached else None)
         except (requests.exceptions.ProxyError, requests.exceptions.RequestException) as e:
             raise Exception(f"Error fetching data from GitHub: {e}")
+        if self.conditional.revalidated(cached, response.status_code):
+            return cached.value
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        div = soup.find('div', class_="Box-sc-g0xbh4-0 kXssRI")
-        divs = div.find_all('div', class_="Box-sc-g0xbh4-0 bDcVHV")
+        with self.timings.span('search_parse'):
+            try:
+                hits = parse_search_hits(response.content)
+            except Exception as e:
+                PARSE_FAILURES.inc(page='search')
+                raise Exception(f"Error parsing search page: {e}")
+        self.conditional.put(url, response.headers, hits, record_transfer(response, len(response.content)))
+        return hits
 
-        results = []
-        for div in divs:
-            a = div.find('a', class_="Link__StyledLink-sc-14289xe-0 dheQRw")
-            repo_url = f"{GITHUB_URL}{a['href']}"
-            final_data = {'url': repo_url}
-            if search_type == 'Repositories':
-                process = mp.Process(target=self._get_extra_info,
-                                     args=(repo_url, {"http": proxy, "https": proxy}, final_data, return_dict,))
-                jobs.append(process)
-                process.start()
-            else:
-                results.append(final_data)
+    def _fetch(self, url: str, stage: str, stream: bool = False,
+               headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        Fetches the URL through the healthiest proxy. A request that fails through its proxy or is throttled
+        is sent again through another proxy after a jittered backoff, and a slow one is hedged when enabled.
+        """
+        tried: Set[str] = set()
+        for attempt in range(FETCH_RETRIES + 1):
+            proxy = self._get_ready_proxy(exclude=tried)
+            tried.add(proxy)
+            try:
+                return self._fetch_hedged(url, stage, proxy, tried, stream, headers)
+            except requests.exceptions.RequestException as e:
+                if attempt == FETCH_RETRIES or not is_retryable(e):
+                    raise
+            RETRIED_REQUESTS.inc(stage=stage)
+            time.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt)))
 
-        for job in jobs:
-            job.join()
+    def _fetch_hedged(self, url: str, stage: str, proxy: str, tried: Set[str], stream: bool = False,
+                      headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        Fetches the URL through the proxy. When it takes longer than the hedging percentile of recent requests,
+        a duplicate is sent through a second proxy and the first successful response wins.
+        """
+        threshold = None
+        if HEDGE_PERCENTILE > 0 and len(self.proxies) > 1:
+            threshold = FETCH_LATENCY[stage].percentile(HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        if threshold is None:
+            return self._send(url, stage, proxy, stream, headers)
 
-        if search_type == 'Repositories':
-            return list(return_dict.values())
-        return results
+        primary = HEDGE_EXECUTOR.submit(self._send, url, stage, proxy, stream, headers)
+        try:
+            return primary.result(timeout=threshold)
+        except TimeoutError:
+            pass
+
+        hedge_proxy = self._get_ready_proxy(exclude=tried)
+        if hedge_proxy in tried:
+            return primary.result()
+        tried.add(hedge_proxy)
+        hedge = HEDGE_EXECUTOR.submit(self._send, url, stage, hedge_proxy, stream, headers)
+
+        pending = {primary, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                # The loser keeps running and still updates the health of its proxy
+                if future.exception() is None:
+                    HEDGED_REQUESTS.inc(stage=stage, winner='hedge' if future is hedge else 'primary')
+                    # The loser's connection is released as soon as it answers
+                    (primary if future is hedge else hedge).add_done_callback(_close_response)
+                    return future.result()
+            if not pending:
+                return done.pop().result()
+
+    def _send(self, url: str, stage: str, proxy: str, stream: bool = False,
+              headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        Sends one request through the proxy, paced by the scheduler, and records how the proxy performed.
+        With `stream`, only the headers are read and the caller reads and closes the body. `headers` are sent
+        on top of the configured ones.
+        """
+        try:
+            with self.scheduler.slot(proxy):
+                started = time.monotonic()
+                with self.timings.span(stage):
+                    response = SESSIONS.get(proxy).get(url=url, headers={**HEADERS, **(headers or {})},
+                                                       timeout=REQUEST_TIMEOUT, stream=stream)
+            UPSTREAM_REQUESTS.inc(status=response.status_code, proxy=proxy)
+            if self.scheduler.record(proxy, response) and response.status_code != 429:
+                # GitHub's abuse detection answers 403, which raise_for_status doesn't tell from a real 403
+                self.pool.record_failure(proxy)
+                raise requests.exceptions.HTTPError(f"{response.status_code} Throttled for url: {url}",
+                                                    response=response)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if e.response is None:
+                UPSTREAM_REQUESTS.inc(status=type(e).__name__, proxy=proxy)
+            else:
+                # Nobody reads the body of a failed response, so a streamed one would keep its connection
+                e.response.close()
+            if is_proxy_failure(e):
+                self.pool.record_failure(proxy)
+            raise
+        latency = time.monotonic() - started
+        FETCH_LATENCY[stage].observe(latency)
+        self.pool.record_success(proxy, latency)
+        return response
+
+    def _get_ready_proxy(self, exclude: Iterable[str] = ()) -> str:
+        return choose_ready_proxy(self.proxies, self.pool, self.scheduler, exclude)
 
     def _get_valid_proxy(self) -> str:
         """Returns a valid proxy from the list of proxies."""
         if not self.proxies:
             raise Exception("No valid proxies available")
-        return random.choice(self.proxies)
+        return self.pool.choose(self.proxies)
 
-    @staticmethod
-    def _get_extra_info(url: str, proxies: Dict[str, str], final_data: Dict[str, Any],
-                        return_dict: Dict[str, Any]) -> None:
-        """Fetches additional information about the repository and updates the shared dictionary."""
-        result = {"language_stats": {}}
+    def _get_extra_info(self, url: str) -> Dict[str, Any]:
+        """
+        Returns the result entry of the repository with its additional information. Concurrent enrichments
+        of the same repository share one fetch, within this process and with the processes sharing the store.
+        """
+        result, _ = ENRICHMENTS.do(url, lambda: self._enrich(url))
+        return result
+
+    def _enrich(self, url: str) -> Dict[str, Any]:
+        """Fetches the repository under a lease, or waits for the process holding it to store the repository."""
+        if self.store.acquire_lease(url, ENRICHMENT_LEASE_TTL):
+            try:
+                return self._fetch_extra_info(url)
+            finally:
+                self.store.release_lease(url)
 
+        deadline = time.monotonic() + ENRICHMENT_LEASE_TTL
+        while self.store.is_leased(url) and time.monotonic() < deadline:
+            time.sleep(ENRICHMENT_LEASE_POLL)
+        stored = self.store.get_fresh([url])
+        if url in stored:
+            COALESCED_CALLS.inc(kind='store')
+            return stored[url]
+        # The other process failed, or the store doesn't keep repositories: fetch them here
+        return self._fetch_extra_info(url)
+
+    def _fetch_extra_info(self, url: str) -> Dict[str, Any]:
+        """Fetches additional information about the repository, stores it and returns its result entry."""
+        # A page fetched before is revalidated, and its parsed information is reused when GitHub answers 304
+        cached = self.conditional.get(url)
         try:
-            response = requests.get(url=url, headers=HEADERS, proxies=proxies)
-            response.raise_for_status()
+            response = self._fetch(url, 'repo_fetch', stream=STREAM_REPO_PAGES,
+                                   headers=cached.headers if cached else None)
         except (requests.exceptions.ProxyError, requests.exceptions.RequestException) as e:
             raise Exception(f"Error fetching extra info from GitHub: {e}")
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        name_a = soup.find('a', class_="url fn")
-        name = name_a.text.strip().replace('\n', '')
-        result["owner"] = name
+        if self.conditional.revalidated(cached, response.status_code):
+            response.close()
+            extra = cached.value
+        else:
+            # A streamed page downloads while it is parsed
+            with self.timings.span('repo_parse'):
+                try:
+                    if STREAM_REPO_PAGES:
+                        extra = read_repo_page(response)
+                        size = wire_bytes(response, 0)
+                    else:
+                        extra = parse_repo_page(response.content)
+                        size = record_transfer(response, len(response.content))
+                except requests.exceptions.RequestException as e:
+                    raise Exception(f"Error fetching extra info from GitHub: {e}")
+                except Exception as e:
+                    PARSE_FAILURES.inc(page='repository')
+                    raise Exception(f"Error parsing repository page: {e}")
+            self.conditional.put(url, response.headers, extra, size)
+
+        self.store.put(url, extra)
+        return {'url': url, 'extra': extra}
+
+
+def choose_ready_proxy(proxies: List[str], pool: ProxyPool, scheduler: RequestScheduler,
+                       exclude: Iterable[str] = ()) -> str:
+    """
+    Returns a valid proxy, preferring one not tried yet for the request and not paused by the scheduler.
+    When every proxy was tried, they are used again.
+    """
+    if not proxies:
+        raise Exception("No valid proxies available")
+    exclude = set(exclude)
+    for skipped in (exclude | scheduler.paused(proxies), exclude):
+        try:
+            return pool.choose(proxies, exclude=skipped)
+        except Exception:
+            continue
+    return pool.choose(proxies)
+
+
+def needs_repo_page(search_type: str, fields: Optional[List[str]] = None) -> bool:
+    """Tells whether the results need the repository page, which only language statistics do."""
+    return search_type == 'Repositories' and (fields is None or 'language_stats' in fields)
+
+
+def owner_from_url(url: str) -> str:
+    """Returns the owner of a repository from the first segment of its URL path."""
+    return urllib.parse.urlsplit(url).path.strip('/').split('/')[0]
+
+
+def add_summary(result: Dict[str, Any], hit: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds what the search page told about a repository, such as its stars, to its result entry."""
+    summary = {field: value for field, value in hit.items() if field != 'url'}
+    if not summary or 'error' in result:
+        return result
+    return {**result, 'extra': {**summary, **result.get('extra', {})}}
+
+
+def select_fields(search_type: str, result: Dict[str, Any], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Limits a result entry to the requested fields, taking the owner from the URL when the page wasn't fetched."""
+    if search_type != 'Repositories' or fields is None or 'error' in result:
+        return result
+
+    extra = {}
+    if 'owner' in fields:
+        extra['owner'] = result.get('extra', {}).get('owner') or owner_from_url(result['url'])
+    for field in SUMMARY_FIELDS:
+        # Only search pages with the embedded payload provide them
+        if field in fields and field in result.get('extra', {}):
+            extra[field] = result['extra'][field]
+    if 'language_stats' in fields:
+        extra['language_stats'] = result['extra']['language_stats']
+    return {'url': result['url'], 'extra': extra} if extra else {'url': result['url']}
+
+
+def is_retryable(e: requests.exceptions.RequestException) -> bool:
+    """Tells whether a failed request may succeed through another proxy."""
+    return is_proxy_failure(e) or (e.response is not None and is_throttled(e.response))
+
+
+def parse_proxy_list(content: str, now: Optional[float] = None) -> List[ProxyRecord]:
+    """
+    Parses a proxy list page. Table columns are recognized by their header, a table without known headers gives
+    the addresses of its first column, and a page without a table is read as plain `ip:port` lines.
+    """
+    now = now or time.time()
+    table = make_soup(content, PROXY_TABLE).find('table', class_='table table-striped table-bordered')
+    if table is None:
+        return [ProxyRecord(ip, port) for ip, port in PROXY_LINE.findall(content)]
+
+    rows = table.find_all('tr')
+    headers = [PROXY_COLUMNS.get(cell.get_text(strip=True).lower()) for cell in rows[0].find_all(['th', 'td'])]
+    if 'ip' not in headers:
+        headers = ['ip']
+
+    records = []
+    for row in rows[1:]:
+        cells = row.find_all('td')
+        values = {name: cell.get_text(strip=True) for name, cell in zip(headers, cells) if name}
+        if not values.get('ip'):
+            continue
+        https = values.get('https')
+        age = parse_proxy_age(values['last_checked']) if 'last_checked' in values else None
+        records.append(ProxyRecord(
+            values['ip'], values.get('port') or None, values.get('country_code') or None,
+            values.get('country') or None, values.get('anonymity') or None,
+            None if https is None else https.lower() == 'yes', None if age is None else now - age))
+    return records
+
+
+def parse_proxy_age(text: str) -> Optional[float]:
+    """Converts a "1 hour 5 mins ago" last checked time to seconds."""
+    parts = AGE_PART.findall(text.lower())
+    if not parts:
+        return None
+    return float(sum(int(value) * AGE_UNITS[unit] for value, unit in parts))
+
+
+def merge_proxy_records(records: Iterable[ProxyRecord]) -> List[ProxyRecord]:
+    """Keeps one record per address, the most recently checked one, in the order the addresses were first listed."""
+    merged: Dict[str, ProxyRecord] = {}
+    for record in records:
+        known = merged.get(record.address)
+        if known is None or (record.checked_at or 0) > (known.checked_at or 0):
+            merged[record.address] = record
+    return list(merged.values())
+
+
+def parse_search_page(content: Union[str, bytes], features: Optional[str] = None) -> List[str]:
+    """Parses the result URLs out of a search page."""
+    return [hit['url'] for hit in parse_search_hits(content, features)]
+
+
+def parse_search_hits(content: Union[str, bytes], features: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Parses the hits out of a search page, from its embedded JSON payload when it has a usable one,
+    otherwise from the DOM. Every hit has a `url`, and repositories from the payload their stars,
+    language and description.
+    """
+    hits = parse_embedded_search(content)
+    if hits is not None:
+        SEARCH_PAGES.inc(source='embedded')
+        return hits
+    SEARCH_PAGES.inc(source='dom')
+    return [{'url': url} for url in _parse_search_dom(content, features)]
+
+
+def parse_embedded_search(content: Union[str, bytes]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Parses the hits out of the JSON payload GitHub embeds in its search page, without building a DOM.
+    Returns None when the page has no payload or one in an unknown shape.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    marker = content.find(EMBEDDED_DATA_MARKER)
+    if marker < 0:
+        return None
+    start = content.find(b'>', marker) + 1
+    end = content.find(b'</script>', start)
+    if start == 0 or end < 0:
+        return None
+
+    try:
+        payload = json.loads(content[start:end])['payload']
+        items = payload['results']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    hits = []
+    for item in items:
+        hit = _embedded_hit(item, payload.get('type'))
+        if hit is None:
+            return None
+        hits.append(hit)
+    return hits
+
+
+def _embedded_hit(item: Dict[str, Any], result_type: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Returns the hit of one result of the embedded payload, or None when its shape is unknown."""
+    try:
+        repository = item['repo']['repository']
+        path = f"/{repository['owner_login']}/{repository['name']}"
+    except (KeyError, TypeError):
+        return None
+
+    if result_type == 'repositories':
+        description = item.get('hl_trunc_description')
+        if description is not None:
+            # Matched keywords are highlighted with <em> tags
+            description = html.unescape(re.sub(r'<[^>]+>', '', description))
+        return {'url': f"{GITHUB_URL}{path}", 'stars': item.get('followers'), 'language': item.get('language'),
+                'description': description}
+    if result_type == 'issues' and 'number' in item:
+        return {'url': f"{GITHUB_URL}{path}/issues/{item['number']}"}
+    return None
+
+
+def _parse_search_dom(content: Union[str, bytes], features: Optional[str] = None) -> List[str]:
+    """Parses the result URLs out of the results container of a search page."""
+    soup = make_soup(content, SEARCH_RESULTS, features)
+    div = soup.find('div', class_="Box-sc-g0xbh4-0 kXssRI")
+    if div is None:
+        # Pages past the last one have no results container
+        return []
+
+    urls = []
+    for item in div.find_all('div', class_="Box-sc-g0xbh4-0 bDcVHV"):
+        a = item.find('a', class_="Link__StyledLink-sc-14289xe-0 dheQRw")
+        urls.append(f"{GITHUB_URL}{a['href']}")
+    return urls
+
+
+def read_repo_page(response: requests.Response) -> Dict[str, Any]:
+    """
+    Reads a streamed repository page chunk by chunk into the incremental parser and closes the connection as soon
+    as the owner and languages are found. A page the incremental parser can't make sense of is parsed whole.
+    """
+    reader = RepoPageReader(response.encoding)
+    try:
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            extra = reader.feed(chunk)
+            if extra is not None:
+                return extra
+    finally:
+        REPO_PAGE_BYTES.inc(reader.received)
+        record_transfer(response, reader.received)
+        response.close()
+    return reader.parse_whole()
+
+
+def _close_response(future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def parse_repo_page(content: Union[str, bytes], features: Optional[str] = None) -> Dict[str, Any]:
+    """Parses the owner and language statistics out of a repository page."""
+    result = {"language_stats": {}}
+
+    soup = make_soup(content, REPO_PAGE, features)
+    name_a = soup.find('a', class_="url fn")
+    name = name_a.text.strip().replace('\n', '')
+    result["owner"] = name
 
-        divs = soup.find('div', class_="BorderGrid about-margin")
-        languages_div = divs.find_all('div', class_="BorderGrid-row")[-1]
+    divs = soup.find('div', class_="BorderGrid about-margin")
+    languages_div = divs.find_all('div', class_="BorderGrid-row")[-1]
 
-        languages_a = languages_div.find_all('a',
-                                             class_="d-inline-flex flex-items-center flex-nowrap Link--secondary no-underline text-small mr-3")
+    languages_a = languages_div.find_all('a',
+                                         class_="d-inline-flex flex-items-center flex-nowrap Link--secondary no-underline text-small mr-3")
 
-        for language_a in languages_a:
-            languages_span = language_a.find_all('span')
-            language = languages_span[0].text
-            stat = float(languages_span[1].text.replace('%', ''))
-            result["language_stats"][language] = stat
+    for language_a in languages_a:
+        languages_span = language_a.find_all('span')
+        language = languages_span[0].text
+        stat = float(languages_span[1].text.replace('%', ''))
+        result["language_stats"][language] = stat
 
-        final_data["extra"] = result
-        return_dict[uuid.uuid4().hex] = final_data
+    return result
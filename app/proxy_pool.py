@@ -0,0 +1,204 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import requests
+
+from client import MAX_WORKERS, SESSIONS
+
+# URL requested through a proxy to check that it works before it is used
+PROXY_CHECK_URL = os.environ.get('PROXY_CHECK_URL', os.environ.get('GITHUB_URL', 'https://github.com'))
+PROXY_CHECK_TIMEOUT = float(os.environ.get('PROXY_CHECK_TIMEOUT', 5))
+# Consecutive failures after which a proxy is taken out of rotation
+PROXY_FAILURE_THRESHOLD = int(os.environ.get('PROXY_FAILURE_THRESHOLD', 3))
+# Seconds a tripped proxy stays out of rotation before it gets a trial request
+PROXY_COOLDOWN = float(os.environ.get('PROXY_COOLDOWN', 60))
+# Weight of the latest observation in the moving averages
+PROXY_EWMA_ALPHA = float(os.environ.get('PROXY_EWMA_ALPHA', 0.3))
+# Seconds the health record of a proxy no crawl uses is kept, since clients send ever changing free proxies
+PROXY_STATS_TTL = float(os.environ.get('PROXY_STATS_TTL', 3600))
+
+
+class ProxyStats:
+    """Health record of a single proxy."""
+
+    __slots__ = ('latency', 'success_rate', 'consecutive_failures', 'opened_at', 'validated', 'used_at')
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.success_rate = 1.0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.validated = False
+        self.used_at = 0.0
+
+    def score(self, default_latency: float) -> float:
+        """Returns the expected cost of a request through the proxy, lower is better."""
+        latency = default_latency if self.latency is None else self.latency
+        return latency / max(self.success_rate, 0.01)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'latency': self.latency,
+            'success_rate': round(self.success_rate, 3),
+            'consecutive_failures': self.consecutive_failures,
+            'circuit_open': self.opened_at is not None,
+        }
+
+
+class ProxyPool:
+    """
+    Class to track proxy health across crawls and pick a proxy for each request.
+    Latency and success rate are exponentially weighted moving averages. A proxy failing
+    `failure_threshold` times in a row has its circuit opened and is skipped until `cooldown`
+    seconds have passed, after which a single successful request closes the circuit again.
+    New proxies are checked in the background, and one failing its check has its circuit opened right away.
+    Records of proxies unused for `stats_ttl` seconds are dropped, and those proxies are checked again if they return.
+    """
+
+    def __init__(self, alpha: float = PROXY_EWMA_ALPHA, failure_threshold: int = PROXY_FAILURE_THRESHOLD,
+                 cooldown: float = PROXY_COOLDOWN, check_url: str = PROXY_CHECK_URL,
+                 check_timeout: float = PROXY_CHECK_TIMEOUT, stats_ttl: float = PROXY_STATS_TTL,
+                 check_workers: int = MAX_WORKERS, clock: Callable[[], float] = time.monotonic):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.check_url = check_url
+        self.check_timeout = check_timeout
+        self.stats_ttl = stats_ttl
+        self.clock = clock
+        self._stats: Dict[str, ProxyStats] = {}
+        self._pruned_at = clock()
+        # Checks in progress, shared by the crawls using the same new proxies
+        self._checks: Dict[str, Future] = {}
+        self._check_executor = ThreadPoolExecutor(max_workers=check_workers, thread_name_prefix='proxy-check')
+        self._lock = threading.Lock()
+
+    def validate(self, proxies: Iterable[str]) -> None:
+        """
+        Starts checking the proxies that were never used before, and returns as soon as one of `proxies`
+        is known to work or every check is over, so a crawl doesn't wait for a long list of proxies.
+        """
+        proxies = set(proxies)
+        with self._lock:
+            for proxy in proxies:
+                if not self._get(proxy).validated and proxy not in self._checks:
+                    self._checks[proxy] = self._check_executor.submit(self._check, proxy)
+            pending = {self._checks[proxy] for proxy in proxies if proxy in self._checks}
+
+        while pending and not self._has_healthy(proxies):
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def choose(self, proxies: List[str], exclude: Iterable[str] = ()) -> str:
+        """
+        Returns the proxy to use for the next request. Two random candidates with a closed circuit
+        are compared and the healthier one wins, which prefers fast proxies while spreading the load.
+        Proxies still being checked are only used when no other is available.
+        """
+        excluded = set(exclude)
+        with self._lock:
+            now = self.clock()
+            candidates = [proxy for proxy in proxies
+                          if proxy not in excluded and self._is_available(self._get(proxy), now)]
+            if not candidates:
+                raise Exception("No valid proxies available")
+            candidates = [proxy for proxy in candidates if proxy not in self._checks] or candidates
+
+            default_latency = self._default_latency()
+            sample = random.sample(candidates, min(2, len(candidates)))
+            return min(sample, key=lambda proxy: self._stats[proxy].score(default_latency))
+
+    def record_success(self, proxy: str, latency: float) -> None:
+        """Records a request that went through the proxy and how long it took."""
+        with self._lock:
+            stats = self._get(proxy)
+            stats.latency = latency if stats.latency is None else self._average(stats.latency, latency)
+            stats.success_rate = self._average(stats.success_rate, 1.0)
+            stats.consecutive_failures = 0
+            stats.opened_at = None
+            stats.validated = True
+
+    def record_failure(self, proxy: str, open_circuit: bool = False) -> None:
+        """Records a request that failed because of the proxy, opening its circuit right away with `open_circuit`."""
+        with self._lock:
+            stats = self._get(proxy)
+            stats.success_rate = self._average(stats.success_rate, 0.0)
+            stats.consecutive_failures += 1
+            stats.validated = True
+            if open_circuit or stats.opened_at is not None or stats.consecutive_failures >= self.failure_threshold:
+                # A failed trial request after the cooldown opens the circuit again
+                stats.opened_at = self.clock()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns the health record of every known proxy."""
+        with self._lock:
+            return {proxy: stats.to_dict() for proxy, stats in self._stats.items()}
+
+    def _check(self, proxy: str) -> None:
+        started = self.clock()
+        try:
+            response = SESSIONS.get(proxy).head(url=self.check_url, timeout=self.check_timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            # A proxy that can't even reach GitHub isn't used until its cooldown is over
+            self.record_failure(proxy, open_circuit=True)
+        else:
+            self.record_success(proxy, self.clock() - started)
+        finally:
+            with self._lock:
+                self._checks.pop(proxy, None)
+
+    def _has_healthy(self, proxies: Iterable[str]) -> bool:
+        """Tells whether one of the proxies passed its check or was used, and has a closed circuit."""
+        with self._lock:
+            now = self.clock()
+            for proxy in proxies:
+                stats = self._stats.get(proxy)
+                if stats is not None and stats.validated and proxy not in self._checks and \
+                        self._is_available(stats, now):
+                    return True
+            return False
+
+    def _get(self, proxy: str) -> ProxyStats:
+        now = self.clock()
+        stats = self._stats.get(proxy)
+        if stats is None:
+            self._prune(now)
+            stats = self._stats[proxy] = ProxyStats()
+        stats.used_at = now
+        return stats
+
+    def _prune(self, now: float) -> None:
+        """Drops the records of proxies unused for `stats_ttl` seconds, at most once per tenth of it."""
+        if self.stats_ttl <= 0 or now - self._pruned_at < self.stats_ttl / 10:
+            return
+        self._pruned_at = now
+        for proxy in [proxy for proxy, stats in self._stats.items() if now - stats.used_at >= self.stats_ttl]:
+            del self._stats[proxy]
+
+    def _is_available(self, stats: ProxyStats, now: float) -> bool:
+        return stats.opened_at is None or now - stats.opened_at >= self.cooldown
+
+    def _default_latency(self) -> float:
+        """Latency assumed for proxies without measurements: the mean of the measured ones."""
+        latencies = [stats.latency for stats in self._stats.values() if stats.latency is not None]
+        return sum(latencies) / len(latencies) if latencies else 1.0
+
+    def _average(self, current: float, observation: float) -> float:
+        return (1 - self.alpha) * current + self.alpha * observation
+
+
+def is_proxy_failure(error: requests.exceptions.RequestException) -> bool:
+    """Tells whether a failed request should count against the proxy it went through."""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        # GitHub answered: only proxy authentication, throttling and server errors blame the proxy
+        status = error.response.status_code
+        return status in (407, 429) or status >= 500
+    return True
+
+
+# Proxy health is shared by every crawl running in this worker process
+PROXY_POOL = ProxyPool()
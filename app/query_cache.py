@@ -0,0 +1,217 @@
+import collections
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import QUERY_CACHE_BYTES, QUERY_CACHE_ENTRIES, QUERY_CACHE_EVICTIONS, QUERY_CACHE_LOOKUPS
+from serialization import dumps, loads
+
+# Seconds the hits of a search page are served without fetching it again, 0 disables the cache
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))
+# Bytes of serialized hits kept in memory per worker process before the least recently used are evicted
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# SQLite database shared by the worker processes as a second tier, empty keeps the cache in memory only
+QUERY_CACHE_PATH = os.environ.get('QUERY_CACHE_PATH', '')
+# Writes to the shared tier between two purges of its expired entries
+PURGE_INTERVAL = 100
+
+# Search terms: quoted phrases, or runs of non-space characters
+SEARCH_TERM = re.compile(r'"[^"]*"?|\S+')
+# Boolean operators of GitHub's search syntax, which only work in upper case
+SEARCH_OPERATORS = {'AND', 'OR', 'NOT'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_pages (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_pages_expires_at ON search_pages (expires_at);
+"""
+
+
+def normalize_keywords(keywords: List[str]) -> List[str]:
+    """
+    Returns the search terms in a canonical form: Unicode compatibility normalized and case folded, except for
+    operators. Plain terms are deduplicated and sorted, since GitHub matches every one whatever their order, but a
+    search with operators, quoted phrases, exclusions or parentheses keeps its terms in order.
+    """
+    terms = [term if term in SEARCH_OPERATORS else term.casefold()
+             for term in SEARCH_TERM.findall(unicodedata.normalize('NFKC', ' '.join(keywords)))]
+    if any(term in SEARCH_OPERATORS or term[0] in '"-' or '(' in term or ')' in term for term in terms):
+        return terms
+    return sorted(set(terms))
+
+
+def search_page_key(keywords: List[str], search_type: str, page: int) -> str:
+    """Identifies a search page in the cache."""
+    return json.dumps([normalize_keywords(keywords), search_type, page], ensure_ascii=False)
+
+
+class CachedQuery:
+    """Serialized hits of a search page, with the time they were stored and the time they expire."""
+
+    __slots__ = ('value', 'stored_at', 'expires_at')
+
+    def __init__(self, value: bytes, stored_at: float, expires_at: float):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+    def is_fresh(self, now: float, max_age: Optional[float] = None) -> bool:
+        return now < self.expires_at and (max_age is None or now - self.stored_at <= max_age)
+
+
+class QueryCache:
+    """
+    Class to keep the hits of search pages for `ttl` seconds, so identical searches don't fetch them again.
+    The memory tier holds at most `max_bytes` of serialized hits and evicts the least recently used first.
+    The optional SQLite tier at `path` is shared by the worker processes, and its hits are copied into memory.
+    Its database is opened on first use, so importing the module doesn't touch it.
+    """
+
+    def __init__(self, ttl: float = QUERY_CACHE_TTL, max_bytes: int = QUERY_CACHE_MAX_BYTES,
+                 path: str = QUERY_CACHE_PATH, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path
+        self.clock = clock
+        self._entries: collections.OrderedDict[str, CachedQuery] = collections.OrderedDict()
+        self._bytes = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'bypasses': 0, 'evictions': 0}
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def get(self, key: str, max_age: Optional[float] = None, no_cache: bool = False) -> Optional[Any]:
+        """
+        Returns the cached hits of the key, unless they expired or are older than `max_age` seconds.
+        With `no_cache`, nothing is read and the page is fetched again.
+        """
+        if no_cache or self.ttl <= 0:
+            self._count('bypasses', 'bypass')
+            return None
+
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = entry is not None and entry.is_fresh(now, max_age)
+            if fresh:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+        if fresh:
+            QUERY_CACHE_LOOKUPS.inc(result='memory')
+            return loads(entry.value)
+
+        entry = self._read(key)
+        if entry is not None and entry.is_fresh(now, max_age):
+            self._remember(key, entry)
+            self._count('disk_hits', 'disk')
+            return loads(entry.value)
+
+        self._count('misses', 'miss')
+        return None
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Caches the hits of the key for `ttl` seconds, the cache TTL by default."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        now = self.clock()
+        entry = CachedQuery(dumps(value), now, now + ttl)
+        self._remember(key, entry)
+        self._write(key, entry)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the hit, miss and eviction counters, the hit ratio and the memory held by the cached hits."""
+        with self._lock:
+            hits = self._stats['memory_hits'] + self._stats['disk_hits']
+            lookups = hits + self._stats['misses']
+            return {**self._stats, 'hit_ratio': round(hits / lookups, 3) if lookups else None,
+                    'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'ttl': self.ttl, 'shared': bool(self.path)}
+
+    def clear(self) -> None:
+        """Drops the cached hits of both tiers and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._stats = dict.fromkeys(self._stats, 0)
+            self._report()
+            if self.path:
+                with self._connect():
+                    self._connection.execute("DELETE FROM search_pages")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the connection, opening the database and creating its table on first use. Needs the lock."""
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            with connection:
+                if self.path != ':memory:':
+                    connection.execute('PRAGMA journal_mode=WAL')
+                    connection.execute('PRAGMA synchronous=NORMAL')
+                connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _count(self, stat: str, result: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+        QUERY_CACHE_LOOKUPS.inc(result=result)
+
+    def _remember(self, key: str, entry: CachedQuery) -> None:
+        """Puts the entry in the memory tier and evicts the least recently used ones past `max_bytes`."""
+        size = len(key) + len(entry.value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(key) + len(previous.value)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, evicted_entry = self._entries.popitem(last=False)
+                self._bytes -= len(evicted) + len(evicted_entry.value)
+                self._stats['evictions'] += 1
+                QUERY_CACHE_EVICTIONS.inc()
+            self._report()
+
+    def _report(self) -> None:
+        QUERY_CACHE_ENTRIES.set(len(self._entries))
+        QUERY_CACHE_BYTES.set(self._bytes)
+
+    def _read(self, key: str) -> Optional[CachedQuery]:
+        if not self.path:
+            return None
+        with self._lock:
+            row = self._connect().execute("SELECT value, stored_at, expires_at FROM search_pages WHERE key = ?",
+                                           (key,)).fetchone()
+        return None if row is None else CachedQuery(bytes(row[0]), row[1], row[2])
+
+    def _write(self, key: str, entry: CachedQuery) -> None:
+        if not self.path:
+            return
+        with self._lock, self._connect():
+            self._connection.execute(
+                "INSERT OR REPLACE INTO search_pages (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, entry.value, entry.stored_at, entry.expires_at))
+            self._writes += 1
+            if self._writes % PURGE_INTERVAL == 0:
+                self._connection.execute("DELETE FROM search_pages WHERE expires_at < ?", (entry.stored_at,))
+
+
+# Hits of the search pages fetched by every crawl running in this worker process
+QUERY_CACHE = QueryCache()
@@ -0,0 +1,224 @@
+import contextlib
+import email.utils
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set
+
+import requests
+
+from client import MAX_WORKERS
+from metrics import SCHEDULER_CONCURRENCY, THROTTLED_RESPONSES
+
+# Upstream requests per second and burst size, for the whole worker process and for each proxy
+RATE_LIMIT = float(os.environ.get('RATE_LIMIT', 20))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 40))
+PROXY_RATE_LIMIT = float(os.environ.get('PROXY_RATE_LIMIT', 5))
+PROXY_RATE_LIMIT_BURST = int(os.environ.get('PROXY_RATE_LIMIT_BURST', 10))
+# Bounds of the adaptive number of upstream requests in flight
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', 4 * MAX_WORKERS))
+MIN_CONCURRENCY = int(os.environ.get('MIN_CONCURRENCY', 1))
+# Seconds to pause a proxy after a throttled response without Retry-After, and the longest pause honored
+DEFAULT_RETRY_AFTER = float(os.environ.get('DEFAULT_RETRY_AFTER', 5))
+MAX_RETRY_AFTER = float(os.environ.get('MAX_RETRY_AFTER', 60))
+# Seconds between two purges of the refilled buckets and expired pauses of proxies no longer in use
+PRUNE_INTERVAL = 60
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens."""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds to wait before it may be used."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def is_full(self) -> bool:
+        """Tells whether the bucket refilled to `burst`, so it behaves like a new one."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            return self._tokens + (self.clock() - self._updated) * self.rate >= self.burst
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase and multiplicative decrease: every success raises
+    the limit by 1/limit, so about one per round of requests, and a backoff halves it.
+    """
+
+    def __init__(self, limit: float = MAX_CONCURRENCY, minimum: int = MIN_CONCURRENCY,
+                 maximum: int = MAX_CONCURRENCY, decrease: float = 0.5, backoff_interval: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.backoff_interval = backoff_interval
+        self.clock = clock
+        self._active = 0
+        self._last_backoff: Optional[float] = None
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._active >= int(self.limit):
+                self._condition.wait()
+            self._active += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_backoff(self) -> None:
+        with self._condition:
+            now = self.clock()
+            # Responses to requests sent before the last backoff don't shrink the limit again
+            if self._last_backoff is not None and now - self._last_backoff < self.backoff_interval:
+                return
+            self._last_backoff = now
+            self.limit = max(self.minimum, self.limit * self.decrease)
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Returns the seconds to wait from a Retry-After header, given as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - (time.time() if now is None else now), 0.0)
+
+
+def is_throttled(response: requests.Response) -> bool:
+    """Tells whether GitHub throttled the request: a 429, or a 403 abuse detection page."""
+    if response.status_code == 429:
+        return True
+    if response.status_code == 403:
+        return 'Retry-After' in response.headers or b'rate limit' in response.content[:4096].lower()
+    return False
+
+
+class RequestScheduler:
+    """
+    Class to pace upstream requests: token buckets enforce a global and a per-proxy rate,
+    an AIMD limiter adapts the number of requests in flight, and throttled proxies are paused
+    for the time GitHub asks for in Retry-After.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT, burst: int = RATE_LIMIT_BURST,
+                 proxy_rate: float = PROXY_RATE_LIMIT, proxy_burst: int = PROXY_RATE_LIMIT_BURST,
+                 limiter: Optional[AIMDLimiter] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.proxy_rate = proxy_rate
+        self.proxy_burst = proxy_burst
+        self.clock = clock
+        self.sleep = sleep
+        self.limiter = limiter or AIMDLimiter(clock=clock)
+        self._bucket = TokenBucket(rate, burst, clock)
+        self._proxy_buckets: Dict[str, TokenBucket] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._pruned_at = clock()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def slot(self, proxy: str) -> Iterator[None]:
+        """
+        Waits until a request may be sent through the proxy, then holds a concurrency slot while it is sent.
+        The slot is only taken after the wait, so a paused proxy doesn't hold back requests through the others.
+        """
+        delay = self.delay(proxy)
+        if delay > 0:
+            self.sleep(delay)
+        self.limiter.acquire()
+        try:
+            yield
+        finally:
+            self.limiter.release()
+            SCHEDULER_CONCURRENCY.set(self.limiter.limit)
+
+    def delay(self, proxy: str) -> float:
+        """
+        Reserves the tokens of a request through the proxy and returns the seconds to wait before sending it,
+        for callers that wait themselves, like the asyncio crawler.
+        """
+        pause = self._paused_until.get(proxy, 0.0) - self.clock()
+        # Tokens refill while the proxy is paused
+        return max(pause, self._bucket.reserve(), self._proxy_bucket(proxy).reserve(), 0.0)
+
+    def record(self, proxy: str, response: requests.Response) -> bool:
+        """Adapts to the response and tells whether it was throttled, in which case the proxy is paused."""
+        if is_throttled(response):
+            THROTTLED_RESPONSES.inc(proxy=proxy)
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.pause(proxy, DEFAULT_RETRY_AFTER if retry_after is None else retry_after)
+            self.limiter.on_backoff()
+            return True
+        if response.status_code >= 500:
+            self.limiter.on_backoff()
+        else:
+            self.limiter.on_success()
+        return False
+
+    def pause(self, proxy: str, seconds: float) -> None:
+        """Keeps requests away from the proxy for the given number of seconds."""
+        with self._lock:
+            until = self.clock() + min(seconds, MAX_RETRY_AFTER)
+            self._paused_until[proxy] = max(self._paused_until.get(proxy, 0.0), until)
+
+    def paused(self, proxies: Iterable[str]) -> Set[str]:
+        """Returns the proxies that are currently paused."""
+        now = self.clock()
+        with self._lock:
+            return {proxy for proxy in proxies if self._paused_until.get(proxy, 0.0) > now}
+
+    def _proxy_bucket(self, proxy: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._proxy_buckets.get(proxy)
+            if bucket is None:
+                self._prune()
+                bucket = self._proxy_buckets[proxy] = TokenBucket(self.proxy_rate, self.proxy_burst, self.clock)
+            return bucket
+
+    def _prune(self) -> None:
+        """
+        Drops the buckets that refilled and the pauses that expired, at most once per PRUNE_INTERVAL, so proxies
+        clients stopped sending don't pile up. Pacing is unchanged: a refilled bucket is as good as a new one.
+        """
+        now = self.clock()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        for proxy in [proxy for proxy, bucket in self._proxy_buckets.items() if bucket.is_full()]:
+            del self._proxy_buckets[proxy]
+        for proxy in [proxy for proxy, until in self._paused_until.items() if until <= now]:
+            del self._paused_until[proxy]
+
+
+# Pacing is shared by every crawl running in this worker process
+SCHEDULER = RequestScheduler()
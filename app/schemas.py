@@ -3,13 +3,20 @@ import os
 from marshmallow import Schema, fields, ValidationError, validates
 
 VALID_TYPES = os.environ.get('VALID_TYPES', 'Repositories,Issues,Wikis').split(',')
+MAX_PAGES = int(os.environ.get('MAX_PAGES', 10))
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', 500))
+MAX_REPOSITORIES_LIMIT = int(os.environ.get('MAX_REPOSITORIES_LIMIT', 1000))
+MAX_ENRICH_URLS = int(os.environ.get('MAX_ENRICH_URLS', 100))
+# Fields a Repositories result can be limited to
+VALID_FIELDS = ['url', 'owner', 'stars', 'language', 'description', 'language_stats']
+# Layouts of the results: a list of records, or one array per field
+RESPONSE_FORMATS = ['records', 'columns']
 
 
-class InputSchema(Schema):
-    """Schema for validating input data."""
+class QuerySchema(Schema):
+    """Schema for validating a search query."""
 
     keywords = fields.List(fields.String(), required=True)
-    proxies = fields.List(fields.String(), required=True)
     type = fields.String(required=True)
 
     @validates("keywords")
@@ -22,6 +29,23 @@ class InputSchema(Schema):
             if not keyword:
                 raise ValidationError("keyword cannot be empty")
 
+    @validates("type")
+    def validate_type(self, type_value):
+        """Validate type."""
+        if not type_value:
+            raise ValidationError("type cannot be empty")
+
+        if type_value not in VALID_TYPES:
+            raise ValidationError(f"Unknown type: {type_value}")
+
+
+class EnrichmentOptionsSchema(Schema):
+    """Schema for validating the proxies, the result fields and the response format of a crawl."""
+
+    proxies = fields.List(fields.String(), required=True)
+    extra_fields = fields.List(fields.String(), data_key='fields')
+    response_format = fields.String(data_key='format')
+
     @validates("proxies")
     def validate_proxies(self, proxies):
         """Validate proxies."""
@@ -32,11 +56,125 @@ class InputSchema(Schema):
             if not proxy:
                 raise ValidationError("proxy cannot be empty")
 
-    @validates("type")
-    def validate_type(self, type_value):
-        """Validate type."""
-        if not type_value:
-            raise ValidationError("type cannot be empty")
+    @validates("extra_fields")
+    def validate_extra_fields(self, extra_fields):
+        """Validate fields."""
+        if not extra_fields:
+            raise ValidationError("fields cannot be empty")
 
-        if type_value not in VALID_TYPES:
-            raise ValidationError(f"Unknown type: {type_value}")
+        for field in extra_fields:
+            if field not in VALID_FIELDS:
+                raise ValidationError(f"Unknown field: {field}")
+
+    @validates("response_format")
+    def validate_response_format(self, response_format):
+        """Validate format."""
+        if response_format not in RESPONSE_FORMATS:
+            raise ValidationError(f"Unknown format: {response_format}")
+
+
+class CrawlOptionsSchema(EnrichmentOptionsSchema):
+    """Schema for validating the proxies, result fields, limits and search page freshness of a crawl."""
+
+    max_pages = fields.Integer()
+    max_results = fields.Integer()
+    max_age = fields.Integer()
+    no_cache = fields.Boolean()
+
+    @validates("max_pages")
+    def validate_max_pages(self, max_pages):
+        """Validate max_pages."""
+        if not 1 <= max_pages <= MAX_PAGES:
+            raise ValidationError(f"max_pages must be between 1 and {MAX_PAGES}")
+
+    @validates("max_results")
+    def validate_max_results(self, max_results):
+        """Validate max_results."""
+        if max_results < 1:
+            raise ValidationError("max_results must be positive")
+
+    @validates("max_age")
+    def validate_max_age(self, max_age):
+        """Validate max_age."""
+        if max_age < 0:
+            raise ValidationError("max_age cannot be negative")
+
+
+class InputSchema(QuerySchema, CrawlOptionsSchema):
+    """Schema for validating input data."""
+
+    stream = fields.Boolean()
+    run_async = fields.Boolean(data_key='async')
+
+
+class BatchInputSchema(CrawlOptionsSchema):
+    """Schema for validating batch input data."""
+
+    queries = fields.List(fields.Nested(QuerySchema), required=True)
+
+    @validates("queries")
+    def validate_queries(self, queries):
+        """Validate queries."""
+        if not queries:
+            raise ValidationError("queries cannot be empty")
+
+        if len(queries) > MAX_BATCH_QUERIES:
+            raise ValidationError(f"at most {MAX_BATCH_QUERIES} queries are allowed")
+
+
+class EnrichInputSchema(EnrichmentOptionsSchema):
+    """Schema for validating the repositories to enrich."""
+
+    urls = fields.List(fields.String(), required=True)
+
+    @validates("urls")
+    def validate_urls(self, urls):
+        """Validate urls."""
+        if not urls:
+            raise ValidationError("urls cannot be empty")
+
+        if len(urls) > MAX_ENRICH_URLS:
+            raise ValidationError(f"at most {MAX_ENRICH_URLS} urls are allowed")
+
+
+class RepositoryQuerySchema(Schema):
+    """Schema for validating the filters of stored repositories."""
+
+    owner = fields.String()
+    language = fields.String()
+    limit = fields.Integer()
+    offset = fields.Integer()
+
+    @validates("limit")
+    def validate_limit(self, limit):
+        """Validate limit."""
+        if not 1 <= limit <= MAX_REPOSITORIES_LIMIT:
+            raise ValidationError(f"limit must be between 1 and {MAX_REPOSITORIES_LIMIT}")
+
+    @validates("offset")
+    def validate_offset(self, offset):
+        """Validate offset."""
+        if offset < 0:
+            raise ValidationError("offset cannot be negative")
+
+
+class ProxyQuerySchema(Schema):
+    """Schema for validating the filters of the proxy list."""
+
+    https = fields.Boolean()
+    country = fields.String()
+    max_age = fields.Integer()
+    details = fields.Boolean()
+    response_format = fields.String(data_key='format')
+
+    @validates("max_age")
+    def validate_max_age(self, max_age):
+        """Validate max_age."""
+        if max_age < 0:
+            raise ValidationError("max_age cannot be negative")
+
+    @validates("response_format")
+    def validate_response_format(self, response_format):
+        """Validate format."""
+        if response_format not in RESPONSE_FORMATS:
+            raise ValidationError(f"Unknown format: {response_format}")
@@ -0,0 +1,178 @@
+import gzip
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from schemas import VALID_FIELDS
+
+# JSON encoder of the responses: 'auto' uses orjson when it is installed and falls back to the json module
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+# Smallest response body, in bytes, compressed for the clients accepting it
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# gzip level and brotli quality of compressed responses
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 4))
+
+# Fields of a result entry kept under its 'extra' key
+EXTRA_FIELDS = [field for field in VALID_FIELDS if field != 'url']
+
+
+class _Missing:
+    """Marks a field a result doesn't have, as opposed to one it has with a null value."""
+
+    def __repr__(self) -> str:
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def resolve_encoder(encoder: str = JSON_ENCODER) -> str:
+    """Returns the JSON encoder to use for the configured one."""
+    if encoder == 'auto':
+        return 'orjson' if orjson is not None else 'json'
+    if encoder not in ('orjson', 'json'):
+        raise Exception(f"Unknown JSON encoder: {encoder}")
+    if encoder == 'orjson' and orjson is None:
+        raise Exception("JSON encoder orjson is not installed")
+    return encoder
+
+
+ENCODER = resolve_encoder()
+
+
+def dumps(value: Any, encoder: str = ENCODER) -> bytes:
+    """Serializes to compact UTF-8 JSON."""
+    if encoder == 'orjson':
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(value: bytes, encoder: str = ENCODER) -> Any:
+    """Deserializes what `dumps` serialized."""
+    if encoder == 'orjson':
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    """Returns the encodings of an Accept-Encoding header that aren't refused with q=0."""
+    encodings = []
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        quality = params.strip().lower()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name.strip():
+            encodings.append(name.strip().lower())
+    return encodings
+
+
+def compress(body: bytes, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    """
+    Compresses the body with brotli, or else gzip, when the client accepts it, and returns the body with its
+    Content-Encoding. Bodies smaller than COMPRESS_MIN_SIZE are returned as they are.
+    """
+    if len(body) < COMPRESS_MIN_SIZE or not accept_encoding:
+        return body, None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
+
+
+class ResultRecord:
+    """
+    Class to hold a result entry as attributes instead of nested dicts. Fields the entry doesn't have are MISSING.
+    """
+
+    __slots__ = ('url', 'owner', 'stars', 'language', 'description', 'language_stats', 'error')
+
+    def __init__(self, url: str, owner: Any = MISSING, stars: Any = MISSING, language: Any = MISSING,
+                 description: Any = MISSING, language_stats: Any = MISSING, error: Any = MISSING):
+        self.url = url
+        self.owner = owner
+        self.stars = stars
+        self.language = language
+        self.description = description
+        self.language_stats = language_stats
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, result: Dict[str, Any]) -> 'ResultRecord':
+        extra = result.get('extra') or {}
+        return cls(result['url'], extra.get('owner', MISSING), extra.get('stars', MISSING),
+                   extra.get('language', MISSING), extra.get('description', MISSING),
+                   extra.get('language_stats', MISSING), result.get('error', MISSING))
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {'url': self.url}
+        extra = {field: getattr(self, field) for field in EXTRA_FIELDS if getattr(self, field) is not MISSING}
+        if extra:
+            result['extra'] = extra
+        if self.error is not MISSING:
+            result['error'] = self.error
+        return result
+
+
+class StringTable:
+    """Class to give each distinct string an index, in order of first use."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._indexes: Dict[str, int] = {}
+
+    def index(self, value: str) -> int:
+        index = self._indexes.get(value)
+        if index is None:
+            index = self._indexes[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+def to_columns(rows: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Turns flat records into one array per field, in record order, with null where a record lacks the field."""
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def results_to_columns(results: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """
+    Turns result entries into one array per field, in result order, with null where a result lacks the field.
+    Languages are indexes into the 'languages' array, and language statistics flat [index, share, ...] arrays.
+    """
+    languages = StringTable()
+    columns = {'url': [result['url'] for result in results]}
+    extras = [result.get('extra') or {} for result in results]
+    for field in EXTRA_FIELDS:
+        if not any(field in extra for extra in extras):
+            continue
+        values = [extra.get(field) for extra in extras]
+        if field == 'language':
+            values = [None if value is None else languages.index(value) for value in values]
+        elif field == 'language_stats':
+            values = [None if value is None else
+                      [item for language, share in value.items() for item in (languages.index(language), share)]
+                      for value in values]
+        columns[field] = values
+    if any('error' in result for result in results):
+        columns['error'] = [result.get('error') for result in results]
+    if languages.values:
+        columns['languages'] = languages.values
+    return columns
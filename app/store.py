@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from metrics import STORE_LOOKUPS
+
+# SQLite database of enriched repositories, ':memory:' keeps them for the lifetime of the process only
+STORE_PATH = os.environ.get('STORE_PATH', 'repositories.db')
+# Seconds a stored repository is served before its page is fetched again, 0 always fetches
+REPOSITORY_FRESHNESS = float(os.environ.get('REPOSITORY_FRESHNESS', 86400))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repositories (
+    url TEXT PRIMARY KEY,
+    owner TEXT,
+    extra TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS repositories_owner ON repositories (owner);
+CREATE TABLE IF NOT EXISTS repository_languages (
+    url TEXT NOT NULL REFERENCES repositories (url) ON DELETE CASCADE,
+    language TEXT NOT NULL,
+    share REAL NOT NULL,
+    PRIMARY KEY (url, language)
+);
+CREATE INDEX IF NOT EXISTS repository_languages_language ON repository_languages (language, share);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class RepositoryStore:
+    """
+    Class to keep enriched repositories in SQLite, keyed by URL, with the time their page was fetched.
+    Repositories are indexed by owner and by language, so stored results can be filtered without GitHub.
+    The database is opened on first use, so importing the module doesn't create it.
+    """
+
+    def __init__(self, path: str = STORE_PATH, freshness: float = REPOSITORY_FRESHNESS,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.freshness = freshness
+        self.clock = clock
+        # Identifies this process to the others sharing the database
+        self.holder = f"{os.getpid()}-{uuid.uuid4().hex}"
+        # One connection shared by the crawl threads, SQLite serializes writes anyway
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def get_fresh(self, urls: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Returns the result entries of the given repositories that were fetched within the freshness window."""
+        urls = list(dict.fromkeys(urls))
+        if not urls or self.freshness <= 0:
+            STORE_LOOKUPS.inc(len(urls), result='miss')
+            return {}
+
+        oldest = self.clock() - self.freshness
+        placeholders = ','.join('?' * len(urls))
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT url, extra FROM repositories WHERE fetched_at >= ? AND url IN ({placeholders})",
+                [oldest, *urls]).fetchall()
+
+        STORE_LOOKUPS.inc(len(rows), result='hit')
+        STORE_LOOKUPS.inc(len(urls) - len(rows), result='miss')
+        return {url: {'url': url, 'extra': json.loads(extra)} for url, extra in rows}
+
+    def put(self, url: str, extra: Dict[str, Any]) -> None:
+        """Stores the enriched repository, replacing what was stored for its URL."""
+        languages = [(url, language, share) for language, share in extra.get('language_stats', {}).items()]
+        with self._lock, self._connect():
+            self._connection.execute(
+                "INSERT OR REPLACE INTO repositories (url, owner, extra, fetched_at) VALUES (?, ?, ?, ?)",
+                (url, extra.get('owner'), json.dumps(extra), self.clock()))
+            self._connection.execute("DELETE FROM repository_languages WHERE url = ?", (url,))
+            self._connection.executemany(
+                "INSERT INTO repository_languages (url, language, share) VALUES (?, ?, ?)", languages)
+
+    def query(self, owner: Optional[str] = None, language: Optional[str] = None, limit: int = 100,
+              offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Returns stored repositories of the owner and using the language, when given, whatever their age.
+        Repositories using the language are sorted by its share, the others by URL.
+        """
+        query = "SELECT r.url, r.extra, r.fetched_at FROM repositories r"
+        conditions, parameters = [], []
+        if language is not None:
+            query += " JOIN repository_languages l ON l.url = r.url AND l.language = ?"
+            parameters.append(language)
+        if owner is not None:
+            conditions.append("r.owner = ?")
+            parameters.append(owner)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY l.share DESC, r.url" if language is not None else " ORDER BY r.url"
+        query += " LIMIT ? OFFSET ?"
+        parameters += [limit, offset]
+
+        with self._lock:
+            rows = self._connect().execute(query, parameters).fetchall()
+        return [{'url': url, 'extra': json.loads(extra), 'fetched_at': fetched_at} for url, extra, fetched_at in rows]
+
+    def acquire_lease(self, key: str, ttl: float) -> bool:
+        """
+        Takes the lease on the key for `ttl` seconds, unless another process holds it. Processes sharing
+        the database use it to fetch a repository only once.
+        """
+        now = self.clock()
+        with self._lock, self._connect():
+            cursor = self._connection.execute(
+                "INSERT INTO leases (key, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ? OR leases.holder = excluded.holder",
+                (key, self.holder, now + ttl, now))
+            return cursor.rowcount == 1
+
+    def release_lease(self, key: str) -> None:
+        with self._lock, self._connect():
+            self._connection.execute("DELETE FROM leases WHERE key = ? AND holder = ?", (key, self.holder))
+
+    def is_leased(self, key: str) -> bool:
+        """Tells whether a process holds an unexpired lease on the key."""
+        with self._lock:
+            row = self._connect().execute("SELECT 1 FROM leases WHERE key = ? AND expires_at >= ?",
+                                           (key, self.clock())).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the connection, opening the database and creating its tables on first use. Needs the lock."""
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            with connection:
+                if self.path != ':memory:':
+                    connection.execute('PRAGMA journal_mode=WAL')
+                    connection.execute('PRAGMA synchronous=NORMAL')
+                connection.execute('PRAGMA foreign_keys=ON')
+                connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+
+# Shared by every crawl running in this worker process, the database is created by the first crawl
+STORE = RepositoryStore()
@@ -1,9 +1,35 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch, MagicMock
-from app import app, ProxyParser, GitHubCrawler
-from schemas import InputSchema
+from unittest.mock import ANY, patch, MagicMock
+import requests
+from app import app, proxy_cache, ProxyParser, GitHubCrawler
+from cache import RefreshingCache
+from jobs import JobManager, JobQueueFull
+from metrics import (BYTES_SAVED, COALESCED_CALLS, CONDITIONAL_REQUESTS, REPO_PAGE_BYTES, UPSTREAM_CONNECTIONS,
+                     Counter, Histogram, LatencyWindow)
+from client import ConditionalCache, SessionPool
+from parsing import REPO_PAGE, make_soup, resolve_parser
+from process import CRAWLS, parse_proxy_list, parse_repo_page, parse_search_hits, read_repo_page
+from proxy_pool import ProxyPool
+from query_cache import QueryCache, normalize_keywords, search_page_key
+from singleflight import AsyncSingleFlight, SingleFlight
+from store import RepositoryStore
+from scheduler import AIMDLimiter, RequestScheduler, TokenBucket, parse_retry_after
+from benchmark import percentile
+from cli import Progress, read_queries, run as run_cli
+from fake_github import FakeGitHub, render_embedded_data, render_repo_page, render_search_hits, render_search_page
+from schemas import BatchInputSchema, InputSchema
+from serialization import MISSING, ResultRecord, accepted_encodings, compress, dumps, results_to_columns, to_columns
+from aiohttp.test_utils import TestClient, TestServer
+import async_app
 from dotenv import load_dotenv
-from requests.exceptions import ConnectionError, ProxyError
+from requests.exceptions import ConnectionError, HTTPError, ProxyError
 from marshmallow.exceptions import ValidationError
 from requests.exceptions import RequestException
 
@@ -11,12 +37,23 @@ from requests.exceptions import RequestException
 load_dotenv()
 
 
+def page_response(content: str, status_code: int = 200) -> requests.Response:
+    """Builds a response with the given page, readable whole or streamed."""
+    response = requests.Response()
+    response.status_code = status_code
+    response.encoding = 'utf-8'
+    response._content = content.encode('utf-8')
+    response._content_consumed = True
+    return response
+
+
 class ProxiesTestCase(unittest.TestCase):
     def setUp(self):
         # Set up the Flask app and test client
         self.app = app
         self.client = self.app.test_client()
         self.app.testing = True
+        proxy_cache.clear()
 
     @patch('app.ProxyParser')
     def test_get_proxies_success(self, MockProxyParser):
@@ -32,6 +69,52 @@ class ProxiesTestCase(unittest.TestCase):
         # Assert that the JSON response contains the expected proxies
         self.assertEqual(response.json, {"proxies": ['proxy1', 'proxy2']})
 
+    @patch('app.ProxyParser')
+    def test_get_proxies_filtered(self, MockProxyParser):
+        mock_proxies = MockProxyParser.return_value
+        mock_proxies.get_proxies.return_value = ['proxy1']
+        mock_proxies.get_records.return_value = [{'address': 'proxy1', 'https': True}]
+
+        response = self.client.get('/proxies?https=true&country=US&max_age=600')
+        self.assertEqual(response.json, {"proxies": ['proxy1']})
+        mock_proxies.get_proxies.assert_called_once_with(https=True, country='US', max_age=600)
+
+        # The filtered list is served from the cache too, with the details of each proxy when asked
+        response = self.client.get('/proxies?https=true&details=true')
+        self.assertEqual(response.json, {"proxies": [{'address': 'proxy1', 'https': True}]})
+        mock_proxies.get_records.assert_called_once_with(https=True)
+        self.assertEqual(mock_proxies.fetch_proxies.call_count, 1)
+
+    @patch('app.ProxyParser')
+    def test_get_proxies_columns(self, MockProxyParser):
+        MockProxyParser.return_value.get_records.return_value = [{'address': 'proxy1', 'https': True},
+                                                                 {'address': 'proxy2', 'https': False}]
+
+        response = self.client.get('/proxies?format=columns&country=US')
+
+        self.assertEqual(response.json, {"proxies": {'address': ['proxy1', 'proxy2'], 'https': [True, False]}})
+        MockProxyParser.return_value.get_records.assert_called_once_with(country='US')
+
+    def test_get_proxies_invalid_filter(self):
+        response = self.client.get('/proxies?max_age=-1')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Bad Request', response.json['error_message'])
+
+    @patch('app.ProxyParser')
+    def test_get_proxies_cached(self, MockProxyParser):
+        mock_proxies = MockProxyParser.return_value
+        mock_proxies.get_proxies.return_value = ['proxy1', 'proxy2']
+
+        # The first request fetches the proxies, the second one is served from the cache
+        self.assertEqual(self.client.get('/proxies').headers['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/proxies').headers['X-Cache'], 'HIT')
+        self.assertEqual(mock_proxies.fetch_proxies.call_count, 1)
+
+        response = self.client.get('/proxies/cache')
+        self.assertEqual(response.json['hits'], 1)
+        self.assertEqual(response.json['misses'], 1)
+
     @patch('app.ProxyParser')
     def test_get_proxies_connection_error(self, MockProxyParser):
         # Mock the ProxyParser to raise a ConnectionError when fetch_proxies is called
@@ -61,6 +144,46 @@ class ProxiesTestCase(unittest.TestCase):
         self.assertIn('Internal Server Error', response.json['error_message'])
 
 
+class RefreshingCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.loader = MagicMock(return_value=['proxy1'])
+        self.cache = RefreshingCache(self.loader, ttl=10, clock=lambda: self.now)
+
+    def test_stale_value_served_while_refreshing(self):
+        self.assertEqual(self.cache.get(), (['proxy1'], 'MISS'))
+
+        # Once the TTL passed the old value is served and reloaded in the background
+        self.now = 11.0
+        self.loader.return_value = ['proxy2']
+        self.assertEqual(self.cache.get(), (['proxy1'], 'STALE'))
+        self._wait_for_refresh()
+        self.assertEqual(self.cache.get(), (['proxy2'], 'HIT'))
+        self.assertEqual(self.cache.get_stats()['refreshes'], 1)
+
+    def test_last_good_value_kept_on_refresh_error(self):
+        self.cache.get()
+
+        self.now = 11.0
+        self.loader.side_effect = ConnectionError("Unable to connect")
+        self.assertEqual(self.cache.get(), (['proxy1'], 'STALE'))
+        self._wait_for_refresh()
+        self.assertEqual(self.cache.get(), (['proxy1'], 'STALE'))
+        self.assertGreaterEqual(self.cache.get_stats()['refresh_errors'], 1)
+
+    def test_error_without_cached_value(self):
+        self.loader.side_effect = ConnectionError("Unable to connect")
+
+        with self.assertRaises(ConnectionError):
+            self.cache.get()
+
+    def _wait_for_refresh(self):
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and thread.daemon:
+                thread.join(timeout=1)
+
+
 class CrawlerTestCase(unittest.TestCase):
     def setUp(self):
         # Set up the Flask app and test client
@@ -94,6 +217,139 @@ class CrawlerTestCase(unittest.TestCase):
         # Assert that the JSON response contains the expected result
         self.assertEqual(response.json, {"result": "some_result"})
 
+    @patch('app.GitHubCrawler')
+    def test_post_crawler_columns_compressed(self, MockGitHubCrawler):
+        results = [{'url': f"https://github.com/a/{i}", 'extra': {'owner': 'a', 'language_stats': {'Python': 100.0}}}
+                   for i in range(50)]
+        MockGitHubCrawler.return_value.crawl.return_value = results
+
+        response = self.client.post('/crawler', headers={'Accept-Encoding': 'gzip'}, json={
+            'proxies': ['proxy1'], 'keywords': ['keyword1'], 'type': 'Repositories', 'format': 'columns'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        columns = json.loads(gzip.decompress(response.data))
+        self.assertEqual(columns['url'], [result['url'] for result in results])
+        self.assertEqual(columns['language_stats'][0], [0, 100.0])
+        self.assertEqual(columns['languages'], ['Python'])
+
+    def test_post_crawler_unknown_format(self):
+        response = self.client.post('/crawler', json={
+            'proxies': ['proxy1'], 'keywords': ['keyword1'], 'type': 'Repositories', 'format': 'xml'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Bad Request', response.json['error_message'])
+
+    def test_get_crawler_cache(self):
+        response = self.client.get('/crawler/cache')
+
+        self.assertEqual(response.status_code, 200)
+        for key in ('hit_ratio', 'memory_hits', 'disk_hits', 'misses', 'evictions', 'entries', 'bytes'):
+            self.assertIn(key, response.json)
+
+    def test_post_crawler_negative_max_age(self):
+        response = self.client.post('/crawler', json={
+            'proxies': ['proxy1'], 'keywords': ['keyword1'], 'type': 'Repositories', 'max_age': -1})
+
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.GitHubCrawler')
+    def test_post_crawler_stream(self, MockGitHubCrawler):
+        # Mock the GitHubCrawler to yield two results
+        mock_crawler = MockGitHubCrawler.return_value
+        mock_crawler.iter_crawl.return_value = iter([{'url': 'https://github.com/a/b'},
+                                                     {'url': 'https://github.com/c/d'}])
+
+        # Make a POST request asking for a streamed response
+        response = self.client.post('/crawler', json={
+            'proxies': ['proxy1'],
+            'keywords': ['keyword1'],
+            'type': 'Wikis',
+            'max_pages': 2,
+            'stream': True
+        })
+
+        # Assert that every result is sent on its own line
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.get_data(as_text=True).splitlines(),
+                         ['{"url":"https://github.com/a/b"}', '{"url":"https://github.com/c/d"}'])
+        mock_crawler.iter_crawl.assert_called_once_with(['keyword1'], 'Wikis', max_pages=2, max_results=None,
+                                                        fields=None, on_page_error=ANY)
+
+    @patch('app.GitHubCrawler')
+    def test_post_crawler_reports_failed_pages(self, MockGitHubCrawler):
+        def crawl(keywords, search_type, on_page_error, **options):
+            on_page_error(2, "Error fetching data from GitHub")
+            return [{'url': 'https://github.com/a/b'}]
+
+        MockGitHubCrawler.return_value.crawl.side_effect = crawl
+
+        response = self.client.post('/crawler', json={
+            'proxies': ['proxy1'], 'keywords': ['keyword1'], 'type': 'Repositories', 'max_pages': 2})
+
+        # The results of the other pages are returned along with the pages that failed
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, [{'url': 'https://github.com/a/b'}])
+        self.assertEqual(response.headers['X-Failed-Pages'], '2')
+
+    @patch('app.GitHubCrawler')
+    def test_post_crawler_async(self, MockGitHubCrawler):
+        # Mock the GitHubCrawler to report two found results and yield them
+        def iter_crawl(keywords, search_type, on_found, **options):
+            on_found(2)
+            yield {'url': 'https://github.com/a/b'}
+            yield {'url': 'https://github.com/c/d'}
+
+        MockGitHubCrawler.return_value.iter_crawl.side_effect = iter_crawl
+
+        # Make a POST request asking for an asynchronous crawl
+        response = self.client.post('/crawler', json={
+            'proxies': ['proxy1'],
+            'keywords': ['keyword1'],
+            'type': 'Wikis',
+            'async': True
+        })
+
+        # Assert that the job id is returned before the crawl finishes
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json['job_id']
+        self.assertEqual(response.headers['Location'], f"/crawler/{job_id}")
+
+        # Poll until the job is done, then fetch the results after the first one
+        for _ in range(100):
+            response = self.client.get(f'/crawler/{job_id}')
+            if response.json['status'] == 'done':
+                break
+            time.sleep(0.01)
+        self.assertEqual(response.json['progress'], {'completed': 2, 'found': 2})
+
+        response = self.client.get(f'/crawler/{job_id}?offset=1')
+        self.assertEqual(response.json['results'], [{'url': 'https://github.com/c/d'}])
+
+    def test_get_crawler_unknown_job(self):
+        response = self.client.get('/crawler/unknown')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('Not Found', response.json['error_message'])
+
+    @patch('app.STORE')
+    def test_get_repositories(self, mock_store):
+        mock_store.query.return_value = [{'url': 'https://github.com/user/repo', 'extra': {}, 'fetched_at': 1.0}]
+
+        response = self.client.get('/repositories?owner=user&language=Python&limit=10')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['results']), 1)
+        mock_store.query.assert_called_once_with(owner='user', language='Python', limit=10)
+
+    def test_get_repositories_validation_error(self):
+        response = self.client.get('/repositories?limit=0')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Bad Request', response.json['error_message'])
+
     @patch('app.InputSchema')
     def test_post_crawler_validation_error(self, MockInputSchema):
         # Mock the InputSchema to raise a ValidationError
@@ -131,9 +387,108 @@ class CrawlerTestCase(unittest.TestCase):
         self.assertIn('Internal Server Error', response.json['error_message'])
 
 
+class JobManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.jobs = JobManager(workers=1, queue_size=1, ttl=60, clock=lambda: self.now)
+
+    def test_failed_job_expires(self):
+        def target(job):
+            job.add_result({'url': 'https://github.com/a/b'})
+            raise Exception("Error fetching data from GitHub")
+
+        job = self.jobs.submit(target)
+        self._wait(job)
+
+        # Partial results are kept along with the error
+        state = self.jobs.get(job.id).to_dict()
+        self.assertEqual(state['status'], 'failed')
+        self.assertEqual(state['results'], [{'url': 'https://github.com/a/b'}])
+        self.assertIn("Error fetching data from GitHub", state['error'])
+
+        self.now = 61.0
+        self.assertIsNone(self.jobs.get(job.id))
+
+    def test_queue_full(self):
+        release = threading.Event()
+        job = self.jobs.submit(lambda job: release.wait())
+
+        with self.assertRaises(JobQueueFull):
+            self.jobs.submit(lambda job: None)
+
+        release.set()
+        self._wait(job)
+
+    @staticmethod
+    def _wait(job):
+        for _ in range(100):
+            if job.finished_at is not None:
+                return
+            time.sleep(0.01)
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        # Set up the Flask app and test client
+        self.app = app
+        self.client = self.app.test_client()
+        self.app.testing = True
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_crawl_metrics_and_timing_header(self, mock_get, mock_head):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = render_search_page('metrics', 2)
+        mock_get.return_value = mock_response
+
+        response = self.client.post('/crawler', json={
+            'proxies': ['http://metrics-proxy'],
+            'keywords': ['metrics'],
+            'type': 'Wikis'
+        })
+
+        # The response carries the time spent in every stage
+        self.assertEqual(response.status_code, 200)
+        stages = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(sorted(stages), ['proxy_validation', 'search_fetch', 'search_parse', 'total'])
+
+        # The upstream request and the stage latencies show up on /metrics
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('crawler_upstream_requests_total{status="200",proxy="http://metrics-proxy"} 1', text)
+        self.assertIn('crawler_stage_seconds_count{stage="search_parse"}', text)
+        self.assertIn('crawler_results_total{type="Wikis"}', text)
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test.', ['stage'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage='a')
+        histogram.observe(0.5, stage='a')
+        histogram.observe(5.0, stage='a')
+
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{stage="a",le="0.1"} 1',
+            'test_seconds_bucket{stage="a",le="1.0"} 2',
+            'test_seconds_bucket{stage="a",le="+Inf"} 3',
+            'test_seconds_sum{stage="a"} 5.55',
+            'test_seconds_count{stage="a"} 3',
+        ])
+
+    def test_counter_label_escaping(self):
+        counter = Counter('test_total', 'Test.', ['proxy'])
+        counter.inc(proxy='a"b')
+
+        self.assertEqual(counter.render()[2:], ['test_total{proxy="a\\"b"} 1'])
+
+
 class ProxyParserTestCase(unittest.TestCase):
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_fetch_proxies_success(self, mock_get):
         mock_response = MagicMock()
         mock_response.raise_for_status.return_value = None
@@ -153,7 +508,84 @@ class ProxyParserTestCase(unittest.TestCase):
 
         self.assertEqual(parser.get_proxies(), ['123.456.789.0', '123.456.789.1'])
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
+    def test_fetch_proxies_merges_sources(self, mock_get):
+        table = """
+            <table class="table table-striped table-bordered">
+                <tr><th>IP Address</th><th>Port</th><th>Code</th><th>Country</th><th>Anonymity</th>
+                <th>Google</th><th>Https</th><th>Last Checked</th></tr>
+                <tr><td>1.1.1.1</td><td>80</td><td>US</td><td>United States</td><td>elite proxy</td>
+                <td>no</td><td>yes</td><td>2 mins ago</td></tr>
+                <tr><td>2.2.2.2</td><td>8080</td><td>DE</td><td>Germany</td><td>anonymous</td>
+                <td>no</td><td>no</td><td>1 hour 5 mins ago</td></tr>
+            </table>
+        """
+        pages = {'https://table': table, 'https://text': "2.2.2.2:8080\n3.3.3.3:3128\n"}
+
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.text = pages[url]
+            return response
+        mock_get.side_effect = get
+
+        parser = ProxyParser(['https://table', 'https://text'])
+        parser.fetch_proxies()
+
+        # The proxy listed twice keeps the details of the table
+        self.assertEqual(parser.get_proxies(), ['1.1.1.1:80', '2.2.2.2:8080', '3.3.3.3:3128'])
+        self.assertEqual(parser.get_proxies(https=True), ['1.1.1.1:80'])
+        self.assertEqual(parser.get_proxies(country='germany'), ['2.2.2.2:8080'])
+        self.assertEqual(parser.get_proxies(max_age=600), ['1.1.1.1:80'])
+
+        record = parser.get_records(country='US')[0]
+        self.assertEqual(record['anonymity'], 'elite proxy')
+        self.assertEqual(record['port'], '80')
+        self.assertAlmostEqual(record['age'], 120, delta=5)
+
+    @patch('requests.Session.get')
+    def test_fetch_proxies_partial_failure(self, mock_get):
+        def get(url, **kwargs):
+            if url == 'https://down':
+                raise RequestException("Source down")
+            response = MagicMock()
+            response.text = "4.4.4.4:80\n"
+            return response
+        mock_get.side_effect = get
+
+        parser = ProxyParser(['https://down', 'https://up'])
+        parser.fetch_proxies()
+
+        self.assertEqual(parser.get_proxies(), ['4.4.4.4:80'])
+        self.assertEqual(list(parser.errors), ['https://down'])
+
+    @patch('requests.Session.get')
+    def test_fetch_proxies_parse_failure(self, mock_get):
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.text = "unexpected" if url == 'https://broken' else "4.4.4.4:80\n"
+            return response
+        mock_get.side_effect = get
+
+        def parse(text):
+            if text == "unexpected":
+                raise ValueError("Unknown proxy list layout")
+            return parse_proxy_list(text)
+
+        parser = ProxyParser(['https://broken', 'https://up'])
+        with patch('process.parse_proxy_list', side_effect=parse):
+            parser.fetch_proxies()
+
+        self.assertEqual(parser.get_proxies(), ['4.4.4.4:80'])
+        self.assertEqual(parser.errors, {'https://broken': "Unknown proxy list layout"})
+
+    @patch('process.PROXY_URLS', [])
+    def test_fetch_proxies_without_urls(self):
+        parser = ProxyParser()
+        parser.fetch_proxies()
+
+        self.assertEqual(parser.get_proxies(), [])
+
+    @patch('requests.Session.get')
     def test_fetch_proxies_request_exception(self, mock_get):
         mock_get.side_effect = RequestException("Error fetching proxies")
 
@@ -174,14 +606,26 @@ class GitHubCrawlerTestCase(unittest.TestCase):
 
     def setUp(self):
         self.proxies = ['http://123.456.789.0:8080', 'http://123.456.789.1:8080']
-        self.crawler = GitHubCrawler(self.proxies)
+        self.store = RepositoryStore(':memory:')
+        self.crawler = GitHubCrawler(self.proxies, pool=ProxyPool(), scheduler=RequestScheduler(), store=self.store,
+                                     cache=QueryCache())
+
+        # Proxy validation passes for every proxy
+        head_patcher = patch('requests.Session.head')
+        head_patcher.start().return_value = MagicMock()
+        self.addCleanup(head_patcher.stop)
+
+        # Failed requests are retried without waiting
+        backoff_patcher = patch('process.RETRY_BACKOFF', 0)
+        backoff_patcher.start()
+        self.addCleanup(backoff_patcher.stop)
 
     @patch('app.GitHubCrawler._get_extra_info')
-    @patch('requests.get')
-    @patch('multiprocessing.Process')
-    def test_crawl_success(self, mock_process, mock_get, mock_get_extra_info):
+    @patch('requests.Session.get')
+    def test_crawl_success(self, mock_get, mock_get_extra_info):
         # Mock response for the initial GitHub search request
         mock_response = MagicMock()
+        mock_response.status_code = 200
         mock_response.raise_for_status.return_value = None
         mock_response.content = """
             <div class="Box-sc-g0xbh4-0 kXssRI">
@@ -195,15 +639,284 @@ class GitHubCrawlerTestCase(unittest.TestCase):
         # Mock the _get_extra_info method to avoid actual HTTP requests
         mock_get_extra_info.return_value = {}
 
-        # Mock the process to avoid creating actual child processes
-        mock_process.return_value = MagicMock()
-
         result = self.crawler.crawl(['test'], 'Wikis')
         expected_result = [{'url': 'https://github.com/user/repo'}]
 
         self.assertEqual(result, expected_result)
+        mock_get_extra_info.assert_not_called()
+
+    @patch('app.GitHubCrawler._get_extra_info')
+    @patch('requests.Session.get')
+    def test_crawl_repositories_keeps_search_order(self, mock_get, mock_get_extra_info):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.raise_for_status.return_value = None
+        mock_response.content = """
+            <div class="Box-sc-g0xbh4-0 kXssRI">
+                <div class="Box-sc-g0xbh4-0 bDcVHV">
+                    <a class="Link__StyledLink-sc-14289xe-0 dheQRw" href="/user/first"></a>
+                </div>
+                <div class="Box-sc-g0xbh4-0 bDcVHV">
+                    <a class="Link__StyledLink-sc-14289xe-0 dheQRw" href="/user/broken"></a>
+                </div>
+                <div class="Box-sc-g0xbh4-0 bDcVHV">
+                    <a class="Link__StyledLink-sc-14289xe-0 dheQRw" href="/user/second"></a>
+                </div>
+            </div>
+        """
+        mock_get.return_value = mock_response
+
+        def get_extra_info(url):
+            if url.endswith('broken'):
+                raise Exception("Error fetching extra info from GitHub")
+            return {'url': url, 'extra': {'owner': 'user', 'language_stats': {}}}
+
+        mock_get_extra_info.side_effect = get_extra_info
+
+        result = self.crawler.crawl(['test'], 'Repositories')
+
+        # Results come back directly, in search order, and the repository that failed carries its error
+        self.assertEqual([item['url'] for item in result], ['https://github.com/user/first',
+                                                            'https://github.com/user/broken',
+                                                            'https://github.com/user/second'])
+        self.assertEqual(result[1]['error'], "Error fetching extra info from GitHub")
+
+    @patch('requests.Session.get')
+    def test_crawl_multiple_pages(self, mock_get):
+        def get(url, **kwargs):
+            # Serve three results per page, based on the requested page number
+            page = int(url.split('&p=')[1]) if '&p=' in url else 1
+            response = MagicMock()
+            response.status_code = 200
+            response.content = render_search_page('test', 3, page)
+            return response
+
+        mock_get.side_effect = get
+
+        result = self.crawler.crawl(['test'], 'Issues', max_pages=3)
+
+        self.assertEqual([item['url'] for item in result],
+                         [f"https://github.com/owner{i}/test-{i}" for i in range(9)])
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch('requests.Session.get')
+    def test_crawl_max_results(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.content = render_search_page('test', 10)
+        mock_get.return_value = mock_response
+
+        result = self.crawler.crawl(['test'], 'Issues', max_pages=5, max_results=4)
+
+        # Only the pages needed for max_results are fetched
+        self.assertEqual(len(result), 4)
+        self.assertEqual(mock_get.call_count, 1)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
+    def test_crawl_max_results_keeps_first_hits(self, mock_get):
+        def get(url, **kwargs):
+            page = int(url.split('&p=')[1]) if '&p=' in url else 1
+            if page == 1:
+                # The first page finishes last
+                time.sleep(0.2)
+            return page_response(render_search_page('test', 10, page))
+
+        mock_get.side_effect = get
+
+        result = self.crawler.crawl(['test'], 'Issues', max_pages=2, max_results=12)
+        streamed = [item['url'] for item in self.crawler.iter_crawl(['test'], 'Issues', max_pages=2, max_results=12)]
+
+        expected = [f"https://github.com/owner{i}/test-{i}" for i in range(12)]
+        self.assertEqual([item['url'] for item in result], expected)
+        self.assertEqual(sorted(streamed), sorted(expected))
+
+    @patch('requests.Session.get')
+    def test_crawl_later_page_failure_keeps_other_pages(self, mock_get):
+        def get(url, **kwargs):
+            page = int(url.split('&p=')[1]) if '&p=' in url else 1
+            if page == 2:
+                raise RequestException("Request error")
+            return page_response(render_search_page('test', 10, page))
+
+        mock_get.side_effect = get
+        failed_pages = {}
+
+        result = self.crawler.crawl(['test'], 'Issues', max_pages=3, max_results=25,
+                                    on_page_error=failed_pages.__setitem__)
+
+        # Only the failed page is missing, and it is reported instead of failing the crawl
+        self.assertEqual([item['url'] for item in result],
+                         [f"https://github.com/owner{i}/test-{i}" for i in [*range(10), *range(20, 30)]])
+        self.assertEqual(list(failed_pages), [2])
+        self.assertIn("Error fetching data from GitHub", failed_pages[2])
+
+    @patch('requests.Session.get')
+    def test_crawl_skips_fresh_repositories(self, mock_get):
+        self.store.put('https://github.com/user/stored', {'owner': 'user', 'language_stats': {'Python': 100.0}})
+
+        def get(url, **kwargs):
+            if '/search' in url:
+                return page_response(render_search_hits([('user', 'stored'), ('user', 'new')]))
+            return page_response(render_repo_page('user', 'new'))
+
+        mock_get.side_effect = get
+
+        result = self.crawler.crawl(['test'], 'Repositories')
+
+        self.assertEqual(result[0], {'url': 'https://github.com/user/stored',
+                                     'extra': {'owner': 'user', 'language_stats': {'Python': 100.0}}})
+        # Only the search page and the page of the repository missing from the store are fetched
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertIn('https://github.com/user/new', self.store.get_fresh(['https://github.com/user/new']))
+
+    @patch('requests.Session.get')
+    def test_crawl_owner_field_skips_repository_pages(self, mock_get):
+        mock_response = MagicMock(status_code=200)
+        mock_response.content = render_search_hits([('user', 'first'), ('other', 'second')])
+        mock_get.return_value = mock_response
+
+        result = self.crawler.crawl(['test'], 'Repositories', fields=['url', 'owner'])
+
+        # The owner comes from the URL, so only the search page is fetched
+        self.assertEqual(result, [
+            {'url': 'https://github.com/user/first', 'extra': {'owner': 'user'}},
+            {'url': 'https://github.com/other/second', 'extra': {'owner': 'other'}},
+        ])
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('requests.Session.get')
+    def test_crawl_summary_fields_come_from_search_page(self, mock_get):
+        mock_response = MagicMock(status_code=200)
+        mock_response.content = render_search_hits([('user', 'repo')], embedded=True)
+        mock_get.return_value = mock_response
+
+        result = self.crawler.crawl(['test'], 'Repositories', fields=['url', 'stars', 'language'])
+
+        # Stars and language are in the embedded payload, so no repository page is fetched
+        self.assertEqual(result, [{'url': 'https://github.com/user/repo', 'extra': {'stars': 1000, 'language': 'Python'}}])
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('requests.Session.get')
+    def test_enrich_selected_repositories(self, mock_get):
+        mock_get.return_value = page_response(render_repo_page('user', 'repo'))
+
+        result = self.crawler.enrich(['https://github.com/user/repo', 'https://example.com/user/repo'],
+                                     fields=['language_stats'])
+
+        self.assertEqual(result, [
+            {'url': 'https://github.com/user/repo', 'extra': {'language_stats': {'Python': 75.5, 'HTML': 24.5}}},
+            {'url': 'https://example.com/user/repo', 'error': "Not a GitHub repository URL"},
+        ])
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch('requests.Session.get')
+    def test_crawl_batch_enriches_shared_repositories_once(self, mock_get):
+        def get(url, **kwargs):
+            if '/search' in url:
+                # Both searches find user/shared, each one also finds its own repository
+                query = url.split('q=')[1].split('&')[0]
+                return page_response(render_search_hits([('user', 'shared'), ('user', query)]))
+            return page_response(render_repo_page('user', url.rsplit('/', 1)[1]))
+
+        mock_get.side_effect = get
+
+        result = self.crawler.crawl_batch([
+            {'keywords': ['first'], 'type': 'Repositories'},
+            {'keywords': ['second'], 'type': 'Repositories'},
+            {'keywords': ['first'], 'type': 'Repositories'},
+        ])
+
+        self.assertEqual([[item['url'] for item in query['results']] for query in result['queries']], [
+            ['https://github.com/user/shared', 'https://github.com/user/first'],
+            ['https://github.com/user/shared', 'https://github.com/user/second'],
+            ['https://github.com/user/shared', 'https://github.com/user/first'],
+        ])
+        self.assertNotIn('error', result['queries'][0]['results'][0])
+        self.assertEqual(result['unique_repositories'], 3)
+        # Two search pages and three repository pages
+        self.assertEqual(mock_get.call_count, 5)
+
+    @patch('requests.Session.get')
+    def test_crawl_batch_max_results_enriches_returned_hits_only(self, mock_get):
+        def get(url, **kwargs):
+            if '/search' in url:
+                query = url.split('q=')[1].split('&')[0]
+                return page_response(render_search_hits([('user', 'shared'), ('user', query)]))
+            return page_response(render_repo_page('user', url.rsplit('/', 1)[1]))
+
+        mock_get.side_effect = get
+
+        result = self.crawler.crawl_batch([{'keywords': ['first'], 'type': 'Repositories'},
+                                           {'keywords': ['second'], 'type': 'Repositories'}], max_results=1)
+
+        self.assertEqual([[item['url'] for item in query['results']] for query in result['queries']],
+                         [['https://github.com/user/shared'], ['https://github.com/user/shared']])
+        # Two search pages and the page of the only repository returned
+        self.assertEqual(result['unique_repositories'], 1)
+        self.assertEqual(mock_get.call_count, 3)
+
+    @patch('requests.Session.get')
+    def test__get_extra_info(self, mock_get):
+        mock_get.return_value = page_response(render_repo_page('user', 'repo'))
+
+        result = self.crawler._get_extra_info('https://github.com/user/repo')
+
+        self.assertEqual(result, {
+            'url': 'https://github.com/user/repo',
+            'extra': {'owner': 'user', 'language_stats': {'Python': 75.5, 'HTML': 24.5}}
+        })
+
+    @patch('requests.Session.get')
+    def test_crawl_retries_throttled_request(self, mock_get):
+        throttled = MagicMock(status_code=429, headers={'Retry-After': '0'})
+        throttled.raise_for_status.side_effect = HTTPError("429 Too Many Requests", response=throttled)
+        mock_response = MagicMock(status_code=200)
+        mock_response.content = render_search_page('test', 2)
+        mock_get.side_effect = [throttled, mock_response]
+
+        result = self.crawler.crawl(['test'], 'Issues')
+
+        self.assertEqual(len(result), 2)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('requests.Session.get')
+    def test_fetch_fails_over_to_another_proxy(self, mock_get):
+        mock_get.side_effect = [ProxyError("Proxy error"), MagicMock(status_code=200)]
+
+        self.crawler._fetch('https://github.com/user/repo', 'repo_fetch')
+
+        # The retry went through the proxy that wasn't tried yet
+        stats = self.crawler.pool.get_stats()
+        self.assertEqual(sorted(stats[proxy]['consecutive_failures'] for proxy in self.proxies), [0, 1])
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('process.HEDGE_MIN_SAMPLES', 1)
+    @patch('process.HEDGE_PERCENTILE', 50)
+    @patch('requests.Session.get')
+    def test_slow_fetch_is_hedged(self, mock_get):
+        fast_response = MagicMock(status_code=200)
+        first_call = threading.Event()
+
+        def get(url, **kwargs):
+            # The first request hangs, the hedged one answers at once
+            if not first_call.is_set():
+                first_call.set()
+                time.sleep(0.5)
+            return fast_response
+
+        mock_get.side_effect = get
+        latency = LatencyWindow()
+        latency.observe(0.05)
+
+        with patch.dict('process.FETCH_LATENCY', {'repo_fetch': latency}):
+            started = time.monotonic()
+            response = self.crawler._fetch('https://github.com/user/repo', 'repo_fetch')
+
+        self.assertIs(response, fast_response)
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('requests.Session.get')
     def test_crawl_proxy_error(self, mock_get):
         mock_get.side_effect = ProxyError("Proxy error")
 
@@ -212,7 +925,7 @@ class GitHubCrawlerTestCase(unittest.TestCase):
 
         self.assertIn("Error fetching data from GitHub", str(context.exception))
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_crawl_request_exception(self, mock_get):
         mock_get.side_effect = RequestException("Request error")
 
@@ -221,6 +934,40 @@ class GitHubCrawlerTestCase(unittest.TestCase):
 
         self.assertIn("Error fetching data from GitHub", str(context.exception))
 
+    @patch('requests.Session.get')
+    def test_crawl_options_not_coalesced(self, mock_get):
+        mock_get.return_value = page_response(render_search_page('test', 1))
+        keys = []
+        do = CRAWLS.do
+
+        def record(key, function):
+            keys.append(key)
+            return do(key, function)
+
+        with patch.object(CRAWLS, 'do', record):
+            self.crawler.crawl(['test'], 'Issues')
+            for options in ({'no_cache': True}, {'max_age': 0}):
+                GitHubCrawler(self.proxies, pool=self.crawler.pool, scheduler=self.crawler.scheduler,
+                              store=self.store, cache=self.crawler.cache, **options).crawl(['test'], 'Issues')
+            GitHubCrawler(self.proxies[:1], pool=self.crawler.pool, scheduler=self.crawler.scheduler,
+                          store=self.store, cache=self.crawler.cache).crawl(['test'], 'Issues')
+
+        # A no_cache or max_age crawl never waits for one that may read older cached pages,
+        # and a crawl never gets results fetched through proxies it wasn't given
+        self.assertEqual(len(set(keys)), 4)
+
+    @patch('requests.Session.get')
+    def test_failed_streamed_response_closed(self, mock_get):
+        response = page_response('Not Found', 404)
+        mock_get.return_value = response
+
+        with patch.object(response, 'close') as close, self.assertRaises(Exception) as context:
+            self.crawler._fetch_extra_info('https://github.com/user/missing')
+
+        # The connection of the unread body is released
+        self.assertIn("404", str(context.exception))
+        close.assert_called_once_with()
+
     def test__get_valid_proxy(self):
         proxy = self.crawler._get_valid_proxy()
         self.assertIn(proxy, self.proxies)
@@ -233,6 +980,860 @@ class GitHubCrawlerTestCase(unittest.TestCase):
         self.assertIn("No valid proxies available", str(context.exception))
 
 
+class ProxyPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.pool = ProxyPool(failure_threshold=2, cooldown=60, clock=lambda: self.now)
+
+    def test_choose_prefers_healthy_proxy(self):
+        self.pool.record_success('fast', 0.1)
+        self.pool.record_success('slow', 2.0)
+
+        self.assertEqual(self.pool.choose(['fast', 'slow']), 'fast')
+
+    def test_circuit_opens_and_recovers(self):
+        self.pool.record_failure('bad')
+        self.pool.record_failure('bad')
+
+        # The tripped proxy is skipped while its circuit is open
+        with self.assertRaises(Exception) as context:
+            self.pool.choose(['bad'])
+        self.assertIn("No valid proxies available", str(context.exception))
+
+        # After the cooldown it gets a trial request, and a success closes the circuit
+        self.now = 61.0
+        self.assertEqual(self.pool.choose(['bad']), 'bad')
+        self.pool.record_success('bad', 0.5)
+        self.assertFalse(self.pool.get_stats()['bad']['circuit_open'])
+
+    @patch('requests.Session.head')
+    def test_validate_only_checks_new_proxies(self, mock_head):
+        mock_head.side_effect = ProxyError("Proxy error")
+
+        self.pool.validate(['http://proxy1', 'http://proxy2'])
+        self.pool.validate(['http://proxy1', 'http://proxy2'])
+
+        # A proxy failing its check is taken out of rotation at once
+        self.assertEqual(mock_head.call_count, 2)
+        self.assertTrue(self.pool.get_stats()['http://proxy1']['circuit_open'])
+        with self.assertRaises(Exception):
+            self.pool.choose(['http://proxy1', 'http://proxy2'])
+
+    @patch('requests.Session.head', autospec=True)
+    def test_validate_returns_once_a_proxy_works(self, mock_head):
+        released = threading.Event()
+
+        def head(session, url, **kwargs):
+            if session.proxies['https'] == 'http://slow':
+                released.wait(5)
+            return MagicMock()
+
+        mock_head.side_effect = head
+        self.pool.validate(['http://fast', 'http://slow'])
+
+        # The crawl goes on with the proxy that passed its check while the other one is still checked
+        self.assertEqual(self.pool.choose(['http://fast', 'http://slow']), 'http://fast')
+        released.set()
+
+    def test_idle_proxies_dropped(self):
+        pool = ProxyPool(stats_ttl=100, clock=lambda: self.now)
+        pool.record_success('idle', 0.1)
+        pool.record_success('busy', 0.1)
+        self.now = 60.0
+        pool.record_success('busy', 0.1)
+
+        # A new proxy prunes the records unused for stats_ttl seconds
+        self.now = 120.0
+        pool.record_success('new', 0.1)
+
+        self.assertEqual(sorted(pool.get_stats()), ['busy', 'new'])
+
+
+class RepositoryStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.store = RepositoryStore(':memory:', freshness=60, clock=lambda: self.now)
+        self.store.put('https://github.com/user/web', {'owner': 'user', 'language_stats': {'HTML': 60.0, 'CSS': 40.0}})
+        self.store.put('https://github.com/user/tool', {'owner': 'user', 'language_stats': {'Python': 100.0}})
+        self.store.put('https://github.com/other/site', {'owner': 'other', 'language_stats': {'HTML': 90.0}})
+
+    def test_get_fresh(self):
+        self.assertEqual(set(self.store.get_fresh(['https://github.com/user/tool', 'https://github.com/user/none'])),
+                         {'https://github.com/user/tool'})
+
+        # Past the freshness window the repository has to be fetched again
+        self.now += 61
+        self.assertEqual(self.store.get_fresh(['https://github.com/user/tool']), {})
+
+    def test_put_replaces_languages(self):
+        self.store.put('https://github.com/user/web', {'owner': 'user', 'language_stats': {'Go': 100.0}})
+
+        self.assertEqual(self.store.query(language='HTML'), [
+            {'url': 'https://github.com/other/site', 'extra': {'owner': 'other', 'language_stats': {'HTML': 90.0}},
+             'fetched_at': 1000.0}
+        ])
+
+    def test_query_by_owner_and_language(self):
+        self.assertEqual([item['url'] for item in self.store.query(owner='user')],
+                         ['https://github.com/user/tool', 'https://github.com/user/web'])
+        # Repositories are sorted by their share of the language
+        self.assertEqual([item['url'] for item in self.store.query(language='HTML')],
+                         ['https://github.com/other/site', 'https://github.com/user/web'])
+        self.assertEqual([item['url'] for item in self.store.query(owner='user', language='HTML')],
+                         ['https://github.com/user/web'])
+
+    def test_database_created_on_first_use(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'repositories.db')
+            store = RepositoryStore(path)
+            self.assertFalse(os.path.exists(path))
+
+            self.assertEqual(store.get_fresh(['https://github.com/user/web']), {})
+            self.assertTrue(os.path.exists(path))
+            store.close()
+
+
+class RepositoryLeaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'repositories.db')
+        self.now = 1000.0
+        # Two stores on one database stand for two worker processes
+        self.first = RepositoryStore(self.path, clock=lambda: self.now)
+        self.second = RepositoryStore(self.path, clock=lambda: self.now)
+        self.addCleanup(self.first.close)
+        self.addCleanup(self.second.close)
+
+    def test_lease_is_exclusive_until_released(self):
+        self.assertTrue(self.first.acquire_lease('https://github.com/user/repo', 60))
+        self.assertFalse(self.second.acquire_lease('https://github.com/user/repo', 60))
+        self.assertTrue(self.second.is_leased('https://github.com/user/repo'))
+
+        self.first.release_lease('https://github.com/user/repo')
+        self.assertTrue(self.second.acquire_lease('https://github.com/user/repo', 60))
+
+    def test_expired_lease_is_taken_over(self):
+        self.first.acquire_lease('https://github.com/user/repo', 60)
+
+        self.now += 61
+        self.assertTrue(self.second.acquire_lease('https://github.com/user/repo', 60))
+
+    @patch('process.ENRICHMENT_LEASE_POLL', 0.01)
+    @patch('requests.Session.get')
+    def test_enrichment_waits_for_other_process(self, mock_get):
+        self.now = time.time()
+        url = 'https://github.com/user/repo'
+        self.second.acquire_lease(url, 60)
+
+        def fetch_in_other_process():
+            time.sleep(0.1)
+            self.second.put(url, {'owner': 'user', 'language_stats': {}})
+            self.second.release_lease(url)
+
+        thread = threading.Thread(target=fetch_in_other_process)
+        thread.start()
+        crawler = GitHubCrawler(['http://proxy1'], pool=ProxyPool(), scheduler=RequestScheduler(), store=self.first,
+                                cache=QueryCache())
+        result = crawler._get_extra_info(url)
+        thread.join()
+
+        self.assertEqual(result, {'url': url, 'extra': {'owner': 'user', 'language_stats': {}}})
+        mock_get.assert_not_called()
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_concurrent_calls_share_one_call(self):
+        flight = SingleFlight('test')
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return ['result']
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', call)))
+        leader.start()
+        started.wait(1)
+        follower = threading.Thread(target=lambda: results.append(flight.do('key', call)))
+        follower.start()
+        # Let the follower join the call in flight before it finishes
+        while not COALESCED_CALLS.get(kind='test'):
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True])
+        self.assertIs(results[0][0], results[1][0])
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_exception_is_not_kept(self):
+        flight = SingleFlight('test')
+
+        with self.assertRaises(ValueError):
+            flight.do('key', lambda: int('invalid'))
+        # A finished call is not reused
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+
+    def test_async_concurrent_calls_share_one_call(self):
+        flight = AsyncSingleFlight('test')
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return ['result']
+
+        async def run():
+            return await asyncio.gather(flight.do('key', call), flight.do('key', call))
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([shared for _, shared in results], [False, True])
+        self.assertIs(results[0][0], results[1][0])
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_async_cancelled_leader_does_not_cancel_followers(self):
+        flight = AsyncSingleFlight('test')
+        cancelled = []
+
+        async def call():
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return ['result']
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do('key', call))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do('key', call))
+            await asyncio.sleep(0)
+            # The client of the leader disconnects
+            leader.cancel()
+            result = await follower
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+
+            # The call is cancelled once nobody waits for it
+            lone = asyncio.ensure_future(flight.do('other', call))
+            await asyncio.sleep(0)
+            lone.cancel()
+            await asyncio.sleep(0.01)
+            return result
+
+        self.assertEqual(asyncio.run(run()), (['result'], True))
+        self.assertEqual(cancelled, [1])
+        self.assertEqual(flight.in_flight(), 0)
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.scheduler = RequestScheduler(rate=10, burst=2, proxy_rate=1, proxy_burst=1,
+                                          clock=lambda: self.now, sleep=self.sleeps.append)
+
+    def test_token_bucket_spaces_requests_past_burst(self):
+        bucket = TokenBucket(rate=2, burst=2, clock=lambda: self.now)
+
+        self.assertEqual([bucket.reserve() for _ in range(4)], [0.0, 0.0, 0.5, 1.0])
+
+    def test_slot_waits_for_proxy_rate(self):
+        with self.scheduler.slot('proxy1'):
+            pass
+        with self.scheduler.slot('proxy1'):
+            pass
+
+        # The second request through the same proxy waits for its token
+        self.assertEqual(self.sleeps, [1.0])
+
+    def test_slot_taken_after_waiting(self):
+        active = []
+        scheduler = RequestScheduler(rate=10, burst=2, proxy_rate=1, proxy_burst=1, clock=lambda: self.now,
+                                     sleep=lambda delay: active.append(scheduler.limiter._active))
+        scheduler.pause('proxy1', 60)
+
+        with scheduler.slot('proxy1'):
+            pass
+
+        # A paused proxy waits without holding a concurrency slot
+        self.assertEqual(active, [0])
+
+    def test_delay_covers_pause_and_tokens(self):
+        self.assertEqual(self.scheduler.delay('proxy1'), 0.0)
+        self.assertEqual(self.scheduler.delay('proxy1'), 1.0)
+        self.scheduler.pause('proxy2', 5)
+        self.assertEqual(self.scheduler.delay('proxy2'), 5)
+
+    def test_throttled_response_pauses_proxy(self):
+        response = MagicMock(status_code=429, headers={'Retry-After': '30'})
+
+        self.assertTrue(self.scheduler.record('proxy1', response))
+        self.assertEqual(self.scheduler.paused(['proxy1', 'proxy2']), {'proxy1'})
+        self.now = 31.0
+        self.assertEqual(self.scheduler.paused(['proxy1', 'proxy2']), set())
+
+    def test_idle_proxies_pruned(self):
+        self.scheduler.delay('proxy1')
+        self.scheduler.pause('proxy2', 30)
+        self.scheduler.delay('proxy3')
+
+        # A new proxy drops the refilled buckets and expired pauses
+        self.now = 60.5
+        self.scheduler.delay('proxy3')
+        self.scheduler.delay('proxy4')
+
+        self.assertEqual(sorted(self.scheduler._proxy_buckets), ['proxy3', 'proxy4'])
+        self.assertEqual(self.scheduler._paused_until, {})
+
+    def test_aimd_limit(self):
+        limiter = AIMDLimiter(limit=8, minimum=1, maximum=8, clock=lambda: self.now)
+
+        limiter.on_backoff()
+        # A burst of throttled responses only backs off once
+        limiter.on_backoff()
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(4):
+            limiter.on_success()
+        self.assertAlmostEqual(limiter.limit, 5, delta=0.2)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now=1445412480), 30)
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+class ParsingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.bytes_before = REPO_PAGE_BYTES.get()
+
+    def test_partial_tree_keeps_only_targets(self):
+        soup = make_soup(render_repo_page('user', 'repo', 10_000), REPO_PAGE)
+
+        # Only the owner link and the about sidebar are built
+        self.assertEqual([tag.name for tag in soup.find_all(recursive=False)], ['a', 'div'])
+        self.assertEqual(soup.find_all('div', class_="js-navigation-item"), [])
+
+    def test_parsers_agree(self):
+        content = render_repo_page('user', 'repo', 10_000)
+
+        self.assertEqual(parse_repo_page(content, 'html.parser'), parse_repo_page(content, resolve_parser('auto')))
+
+    def test_resolve_explicit_parser(self):
+        self.assertEqual(resolve_parser('html.parser'), 'html.parser')
+
+    def test_repo_page_streaming_stops_early(self):
+        content = render_repo_page('user', 'repo', 100_000)
+        response = page_response(content)
+
+        with patch('process.STREAM_CHUNK_SIZE', 1024):
+            result = read_repo_page(response)
+
+        self.assertEqual(result, parse_repo_page(content))
+        # Everything needed is found about halfway through the page
+        self.assertLess(REPO_PAGE_BYTES.get(), len(content) * 0.6 + self.bytes_before)
+
+    def test_repo_page_streaming_falls_back_to_full_parse(self):
+        # The sidebar has no rows, the incremental parser fails and the full parse reports the error
+        content = render_repo_page('user', 'repo').replace('BorderGrid-row', 'other-row')
+
+        with self.assertRaises(IndexError):
+            read_repo_page(page_response(content))
+
+    def test_search_hits_from_embedded_payload(self):
+        hits = parse_search_hits(render_search_page('test', 2, embedded=True).encode('utf-8'))
+
+        self.assertEqual(hits[0], {'url': 'https://github.com/owner0/test-0', 'stars': 1000, 'language': 'Python',
+                                   'description': 'Fixture repository test-0 & more'})
+        self.assertEqual(len(hits), 2)
+
+    def test_search_hits_fall_back_to_dom(self):
+        # A payload in an unknown shape is ignored in favor of the DOM
+        page = render_search_page('test', 2).replace('<html><body>', '<html><body>' + render_embedded_data([])
+                                                     .replace('"results": []', '"results": [{"unknown": 1}]'))
+
+        self.assertEqual(parse_search_hits(page), [{'url': 'https://github.com/owner0/test-0'},
+                                                   {'url': 'https://github.com/owner1/test-1'}])
+
+
+class BatchInputSchemaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = BatchInputSchema()
+
+    def test_valid_input(self):
+        input_data = {
+            "queries": [{"keywords": ["test"], "type": "Repositories"}, {"keywords": ["other"], "type": "Wikis"}],
+            "proxies": ["http://proxy1"]
+        }
+        self.assertEqual(self.schema.load(input_data), input_data)
+
+    def test_invalid_query(self):
+        input_data = {
+            "queries": [{"keywords": [], "type": "Repositories"}],
+            "proxies": ["http://proxy1"]
+        }
+        with self.assertRaises(ValidationError) as context:
+            self.schema.load(input_data)
+        self.assertIn("keywords cannot be empty", str(context.exception))
+
+    def test_empty_queries(self):
+        with self.assertRaises(ValidationError) as context:
+            self.schema.load({"queries": [], "proxies": ["http://proxy1"]})
+        self.assertIn("queries cannot be empty", str(context.exception))
+
+
+class AsyncAppTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.fake = FakeGitHub(results=3).start()
+        self.addCleanup(self.fake.stop)
+        for target in ('async_app.GITHUB_URL', 'process.GITHUB_URL'):
+            patcher = patch(target, self.fake.url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.store = RepositoryStore(':memory:')
+        proxy_cache.clear()
+
+        app = async_app.create_app(pool=ProxyPool(check_url=self.fake.url), scheduler=RequestScheduler(),
+                                   store=self.store, cache=QueryCache())
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+        self.crawl_request = {'keywords': ['python'], 'type': 'Repositories', 'proxies': [self.fake.url]}
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_crawl(self):
+        response = await self.client.post('/crawler', json=self.crawl_request)
+
+        self.assertEqual(response.status, 200)
+        results = await response.json()
+        self.assertEqual([result['url'] for result in results],
+                         [f"{self.fake.url}/owner{i}/python-{i}" for i in range(3)])
+        self.assertEqual(results[0]['extra']['owner'], 'owner0')
+        self.assertIn('total', response.headers['Server-Timing'])
+        # Enriched repositories are stored like the threaded crawler does
+        self.assertEqual(len(self.store.query()), 3)
+
+    async def test_crawl_keeps_sqlite_off_event_loop(self):
+        threads = []
+
+        def on_thread(function):
+            def call(*args):
+                threads.append(threading.current_thread())
+                return function(*args)
+            return call
+
+        with patch.object(self.store, 'get_fresh', on_thread(self.store.get_fresh)), \
+                patch.object(self.store, 'put', on_thread(self.store.put)):
+            response = await self.client.post('/crawler', json=self.crawl_request)
+
+        self.assertEqual(response.status, 200)
+        # Queries of the store wait for the processes sharing it, so they run in the executor
+        self.assertTrue(threads)
+        self.assertNotIn(threading.main_thread(), threads)
+
+    async def test_crawl_stream(self):
+        response = await self.client.post('/crawler', json=dict(self.crawl_request, stream=True, fields=['owner']))
+
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in (await response.text()).splitlines()]
+        self.assertEqual(sorted(line['extra']['owner'] for line in lines), ['owner0', 'owner1', 'owner2'])
+
+    async def test_crawl_revalidates_pages(self):
+        self.fake.etags = True
+        self.store.freshness = 0
+        first = await (await self.client.post('/crawler', json=self.crawl_request)).json()
+        not_modified = CONDITIONAL_REQUESTS.get(result='not_modified')
+
+        # The search page is fetched again instead of being read from the query cache
+        second = await (await self.client.post('/crawler', json=dict(self.crawl_request, no_cache=True))).json()
+
+        self.assertEqual(second, first)
+        self.assertEqual(CONDITIONAL_REQUESTS.get(result='not_modified') - not_modified, 4)
+
+    async def test_crawl_invalid_input(self):
+        response = await self.client.post('/crawler', json=dict(self.crawl_request, keywords=[]))
+
+        self.assertEqual(response.status, 400)
+        self.assertIn('Bad Request', (await response.json())['error_message'])
+
+    async def test_crawl_upstream_failure(self):
+        self.fake.error_rate = 1.0
+        with patch('async_app.RETRY_BACKOFF', 0):
+            response = await self.client.post('/crawler', json=self.crawl_request)
+
+        self.assertEqual(response.status, 500)
+        self.assertIn('Error fetching data from GitHub', str(await response.json()))
+
+    @patch('app.ProxyParser')
+    async def test_get_proxies(self, MockProxyParser):
+        MockProxyParser.return_value.get_proxies.return_value = ['proxy1']
+
+        response = await self.client.get('/proxies?country=US')
+
+        self.assertEqual(await response.json(), {"proxies": ['proxy1']})
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        MockProxyParser.return_value.get_proxies.assert_called_once_with(country='US')
+
+
+class CliTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'results.jsonl')
+        self.checkpoint = self.output + '.checkpoint'
+        self.crawler = MagicMock()
+        self.crawler.crawl.side_effect = lambda keywords, search_type, **options: [
+            {'url': f"https://github.com/{keyword}"} for keyword in keywords]
+        self.log = MagicMock()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_output(self):
+        with open(self.output) as output:
+            return [json.loads(line) for line in output]
+
+    def test_read_queries(self):
+        lines = ['python django', '', '# comment', '{"keywords": ["flask"], "type": "Issues"}']
+
+        self.assertEqual(list(read_queries(lines, 'Repositories')), [
+            {'keywords': ['python', 'django'], 'type': 'Repositories'},
+            {'keywords': ['flask'], 'type': 'Issues'},
+        ])
+        with self.assertRaises(Exception) as context:
+            list(read_queries(['{"keywords": ["x"], "type": "Unknown"}'], 'Repositories'))
+        self.assertIn("line 1", str(context.exception))
+
+    def test_run_writes_results_and_resumes(self):
+        queries = [{'keywords': ['a', 'b'], 'type': 'Repositories'}, {'keywords': ['c'], 'type': 'Repositories'}]
+
+        summary = run_cli(queries, self.crawler, self.output, self.checkpoint, concurrency=2, log=self.log)
+
+        self.assertEqual(summary['done'], 2)
+        self.assertEqual(summary['results'], 3)
+        self.assertEqual(sorted(line['result']['url'] for line in self.read_output()),
+                         ['https://github.com/a', 'https://github.com/b', 'https://github.com/c'])
+
+        # A new run only crawls the searches that weren't finished
+        queries.append({'keywords': ['d'], 'type': 'Repositories'})
+        self.crawler.crawl.reset_mock()
+        summary = run_cli(queries, self.crawler, self.output, self.checkpoint, log=self.log)
+
+        self.crawler.crawl.assert_called_once_with(['d'], 'Repositories', on_page_error=ANY)
+        self.assertEqual(summary['done'], 3)
+        self.assertEqual(len(self.read_output()), 4)
+
+    def test_run_retries_failed_queries_and_drops_partial_output(self):
+        queries = [{'keywords': ['a'], 'type': 'Repositories'}, {'keywords': ['b'], 'type': 'Repositories'}]
+        self.crawler.crawl.side_effect = lambda keywords, search_type, **options: (
+            [{'url': 'https://github.com/a'}] if keywords == ['a'] else 1 / 0)
+
+        summary = run_cli(queries, self.crawler, self.output, self.checkpoint, concurrency=1, log=self.log)
+        self.assertEqual(summary['failed'], 1)
+        self.assertIn('error', self.read_output()[-1])
+
+        # Lines written after the last finished search, like the failure, are dropped and the search crawled again
+        with open(self.output, 'a') as output:
+            output.write('{"keywords": ["b"], "resu')
+        self.crawler.crawl.side_effect = lambda keywords, search_type, **options: [{'url': 'https://github.com/b'}]
+        summary = run_cli(queries, self.crawler, self.output, self.checkpoint, log=self.log)
+
+        self.assertEqual(summary['failed'], 0)
+        self.assertEqual([line['result']['url'] for line in self.read_output()],
+                         ['https://github.com/a', 'https://github.com/b'])
+
+    def test_run_without_checkpoint_empties_output(self):
+        # Lines of a run that stopped before finishing its first search
+        with open(self.output, 'w') as output:
+            output.write('{"keywords": ["a"], "result": {"url": "https://github.com/a"}}\n')
+
+        run_cli([{'keywords': ['a'], 'type': 'Repositories'}], self.crawler, self.output, self.checkpoint,
+                log=self.log)
+
+        self.assertEqual([line['result']['url'] for line in self.read_output()], ['https://github.com/a'])
+
+    def test_progress(self):
+        self.now = 0.0
+        progress = Progress(10, skipped=2, clock=lambda: self.now)
+        self.now = 4.0
+        progress.update(results=5)
+        progress.update(results=3)
+
+        self.assertEqual(progress.to_dict(), {'done': 4, 'total': 10, 'failed': 0, 'results': 8,
+                                              'queries_per_s': 0.5, 'results_per_s': 2.0, 'eta_s': 12})
+        self.assertIn('ETA 12s', progress.report())
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+
+    def test_fake_github_proxy_list(self):
+        with FakeGitHub(proxies=5) as fake:
+            parser = ProxyParser([fake.proxy_list_url])
+            parser.fetch_proxies()
+
+        self.assertEqual(parser.get_proxies(), [f"10.0.0.{i}:{8000 + i}" for i in range(5)])
+        # Every third proxy of the fake list doesn't support HTTPS
+        self.assertEqual(len(parser.get_proxies(https=True)), 3)
+
+    def test_fake_github_error_rate(self):
+        fake = FakeGitHub(error_rate=1.0)
+
+        self.assertEqual(fake.respond('/user/repo')[0], 500)
+        # The proxy check page never fails
+        self.assertEqual(fake.respond('/')[0], 200)
+
+
+class QueryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+
+    def clock(self):
+        return self.now
+
+    def test_key_normalized(self):
+        key = search_page_key(['Machine learning', 'ＰＹＴＨＯＮ'], 'Repositories', 1)
+
+        self.assertEqual(normalize_keywords(['Machine learning', 'ＰＹＴＨＯＮ']), ['learning', 'machine', 'python'])
+        self.assertEqual(search_page_key(['python', 'machine', 'Learning'], 'Repositories', 1), key)
+        self.assertNotEqual(search_page_key(['python', 'machine', 'learning'], 'Issues', 1), key)
+        self.assertNotEqual(search_page_key(['python', 'machine', 'learning'], 'Repositories', 2), key)
+
+    def test_key_keeps_order_of_operators_and_phrases(self):
+        self.assertNotEqual(search_page_key(['react', 'NOT', 'vue'], 'Repositories', 1),
+                            search_page_key(['vue', 'NOT', 'react'], 'Repositories', 1))
+        self.assertNotEqual(search_page_key(['react', 'not', 'vue'], 'Repositories', 1),
+                            search_page_key(['react', 'NOT', 'vue'], 'Repositories', 1))
+        self.assertEqual(normalize_keywords(['"Machine Learning"', 'python']), ['"machine learning"', 'python'])
+        self.assertEqual(normalize_keywords(['python', '-django', 'Flask']), ['python', '-django', 'flask'])
+
+    def test_ttl_and_max_age(self):
+        cache = QueryCache(ttl=60, clock=self.clock)
+        cache.put('key', [{'url': 'https://github.com/a/b'}])
+        cache.put('short', [], ttl=5)
+
+        self.now += 10
+        self.assertEqual(cache.get('key'), [{'url': 'https://github.com/a/b'}])
+        self.assertIsNone(cache.get('short'))
+        # A request can ask for younger hits than the TTL, or skip the cache
+        self.assertIsNone(cache.get('key', max_age=5))
+        self.assertIsNone(cache.get('key', no_cache=True))
+        self.now += 60
+        self.assertIsNone(cache.get('key'))
+
+        stats = cache.get_stats()
+        self.assertEqual((stats['memory_hits'], stats['misses'], stats['bypasses']), (1, 3, 1))
+        self.assertEqual(stats['hit_ratio'], 0.25)
+
+    def test_size_based_eviction(self):
+        value = [{'url': 'https://github.com/a/b'}]
+        entry_size = len('key0') + len(dumps(value))
+        cache = QueryCache(max_bytes=2 * entry_size, clock=self.clock)
+        for index in range(3):
+            cache.put(f"key{index}", value)
+
+        stats = cache.get_stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (2, 2 * entry_size, 1))
+        self.assertIsNone(cache.get('key0'))
+        self.assertEqual(cache.get('key2'), value)
+
+    def test_shared_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'queries.db')
+            first = QueryCache(path=path, clock=self.clock)
+            second = QueryCache(path=path, clock=self.clock)
+            # The database is only opened by the first lookup or write
+            self.assertFalse(os.path.exists(path))
+
+            first.put('key', [{'url': 'https://github.com/a/b'}])
+            self.assertEqual(second.get('key'), [{'url': 'https://github.com/a/b'}])
+            # The hit of the shared tier is kept in memory
+            self.assertEqual(second.get('key'), [{'url': 'https://github.com/a/b'}])
+            self.assertEqual((second.get_stats()['disk_hits'], second.get_stats()['memory_hits']), (1, 1))
+            first.close()
+            second.close()
+
+    def test_crawl_reads_cached_search_pages(self):
+        with FakeGitHub(results=3) as fake, patch('process.GITHUB_URL', fake.url):
+            crawler = GitHubCrawler([fake.url], pool=ProxyPool(check_url=fake.url), scheduler=RequestScheduler(),
+                                    store=RepositoryStore(':memory:'), cache=QueryCache())
+            first = crawler.crawl(['Python', 'web'], 'Repositories')
+            requests_count = fake.requests
+
+            # Repository pages come from the store and the search page from the query cache
+            self.assertEqual(crawler.crawl(['web', 'python'], 'Repositories'), first)
+            self.assertEqual(fake.requests, requests_count)
+
+            # Only the search page is fetched again when the cached one is too old
+            crawler.max_age = 0
+            self.assertEqual(crawler.crawl(['Python', 'web'], 'Repositories'), first)
+            self.assertEqual(fake.requests, requests_count + 1)
+
+
+class SerializationTestCase(unittest.TestCase):
+
+    def test_encoders_agree(self):
+        value = {'url': 'https://github.com/a/b', 'extra': {'description': 'Ünïcode', 'stars': None}}
+
+        self.assertEqual(dumps(value, 'json'), dumps(value, 'orjson'))
+        self.assertEqual(json.loads(dumps(value, 'json')), value)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, deflate;q=0.5, br;q=0'), ['gzip', 'deflate'])
+        self.assertEqual(accepted_encodings(''), [])
+
+    def test_compress(self):
+        body = dumps([{'url': f"https://github.com/a/{i}"} for i in range(100)])
+
+        compressed, encoding = compress(body, 'gzip, br')
+        self.assertEqual(encoding, 'br')
+        self.assertLess(len(compressed), len(body))
+        compressed, encoding = compress(body, 'gzip, br;q=0')
+        self.assertEqual((gzip.decompress(compressed), encoding), (body, 'gzip'))
+        # Small bodies and clients not accepting compression get the body as it is
+        self.assertEqual(compress(b'[]', 'gzip'), (b'[]', None))
+        self.assertEqual(compress(body, 'identity'), (body, None))
+
+    def test_results_to_columns(self):
+        results = [
+            {'url': 'https://github.com/a/b', 'extra': {'language': 'Go', 'language_stats': {'Go': 90.0, 'C': 10.0}}},
+            {'url': 'https://github.com/c/d', 'error': 'Not Found'},
+            {'url': 'https://github.com/e/f', 'extra': {'language': 'C', 'language_stats': {'C': 100.0}}},
+        ]
+
+        self.assertEqual(results_to_columns(results), {
+            'url': ['https://github.com/a/b', 'https://github.com/c/d', 'https://github.com/e/f'],
+            'language': [0, None, 1],
+            'language_stats': [[0, 90.0, 1, 10.0], None, [1, 100.0]],
+            'error': [None, 'Not Found', None],
+            'languages': ['Go', 'C'],
+        })
+        self.assertEqual(to_columns([{'a': 1}, {'b': 2}]), {'a': [1, None], 'b': [None, 2]})
+
+    def test_result_record(self):
+        result = {'url': 'https://github.com/a/b', 'extra': {'owner': 'a', 'stars': None}}
+        record = ResultRecord.from_dict(result)
+
+        # A field given as null is kept, one that isn't given is left out
+        self.assertIsNone(record.stars)
+        self.assertIs(record.language, MISSING)
+        self.assertEqual(record.to_dict(), result)
+        self.assertFalse(hasattr(record, '__dict__'))
+
+
+class SessionPoolTestCase(unittest.TestCase):
+
+    def test_session_reused_per_proxy(self):
+        pool = SessionPool()
+
+        # The same proxy always gets the same keep-alive session
+        self.assertIs(pool.get('http://proxy1'), pool.get('http://proxy1'))
+        self.assertIsNot(pool.get('http://proxy1'), pool.get('http://proxy2'))
+        self.assertEqual(pool.get('http://proxy1').proxies,
+                         {"http": "http://proxy1", "https": "http://proxy1"})
+        pool.close()
+
+    def test_least_recently_used_session_closed(self):
+        pool = SessionPool(max_sessions=2)
+        first = pool.get('http://proxy1')
+        pool.get('http://proxy2')
+        pool.get('http://proxy1')
+
+        with patch.object(requests.Session, 'close') as close:
+            pool.get('http://proxy3')
+
+        # proxy2 was used least recently
+        close.assert_called_once_with()
+        self.assertEqual(len(pool), 2)
+        self.assertIs(pool.get('http://proxy1'), first)
+        pool.close()
+
+    def test_connections_counted(self):
+        pool = SessionPool()
+        connections = UPSTREAM_CONNECTIONS.get()
+        with FakeGitHub() as fake:
+            for _ in range(3):
+                pool.get().get(fake.url).raise_for_status()
+        pool.close()
+
+        # The kept-alive connection is reused by the following requests
+        self.assertEqual(UPSTREAM_CONNECTIONS.get() - connections, 1)
+
+
+class ConditionalCacheTestCase(unittest.TestCase):
+
+    def test_only_pages_with_validators_are_kept(self):
+        cache = ConditionalCache()
+        cache.put('https://github.com/a/b', {}, 'value', 100)
+        cache.put('https://github.com/c/d', {'ETag': '"abc"', 'Last-Modified': 'yesterday'}, 'value', 100)
+
+        self.assertIsNone(cache.get('https://github.com/a/b'))
+        self.assertEqual(cache.get('https://github.com/c/d').headers,
+                         {'If-None-Match': '"abc"', 'If-Modified-Since': 'yesterday'})
+
+    def test_least_recently_used_evicted(self):
+        cache = ConditionalCache(size=2)
+        for url in ('a', 'b'):
+            cache.put(url, {'ETag': url}, url, 1)
+        cache.get('a')
+        cache.put('c', {'ETag': 'c'}, 'c', 1)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').value, 'a')
+
+    def test_revalidated(self):
+        cache = ConditionalCache()
+        cache.put('a', {'ETag': 'a'}, 'value', 500)
+        saved = BYTES_SAVED.get(reason='not_modified')
+
+        self.assertFalse(cache.revalidated(None, 304))
+        self.assertFalse(cache.revalidated(cache.get('a'), 200))
+        self.assertTrue(cache.revalidated(cache.get('a'), 304))
+        self.assertEqual(BYTES_SAVED.get(reason='not_modified') - saved, 500)
+
+    def test_crawl_revalidates_pages(self):
+        with FakeGitHub(results=3, etags=True, compress=True) as fake, patch('process.GITHUB_URL', fake.url):
+            crawler = GitHubCrawler([fake.url], pool=ProxyPool(check_url=fake.url), scheduler=RequestScheduler(),
+                                    store=RepositoryStore(':memory:', freshness=0), conditional=ConditionalCache(),
+                                    cache=QueryCache(ttl=0))
+            first = crawler.crawl(['python'], 'Repositories')
+            sent = fake.bytes_sent
+            not_modified = CONDITIONAL_REQUESTS.get(result='not_modified')
+            compressed = BYTES_SAVED.get(reason='compression')
+
+            second = crawler.crawl(['python'], 'Repositories')
+
+        self.assertEqual(second, first)
+        # The search page and the three repository pages were answered with an empty 304
+        self.assertEqual(CONDITIONAL_REQUESTS.get(result='not_modified') - not_modified, 4)
+        self.assertEqual(fake.bytes_sent, sent)
+        self.assertGreater(compressed, 0)
+
+
 class InputSchemaTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -307,6 +1908,28 @@ class InputSchemaTestCase(unittest.TestCase):
             self.schema.load(input_data)
         self.assertIn("Unknown type: InvalidType", str(context.exception))
 
+    def test_invalid_max_pages(self):
+        input_data = {
+            "keywords": ["test"],
+            "proxies": ["http://proxy1"],
+            "type": "Repositories",
+            "max_pages": 0
+        }
+        with self.assertRaises(ValidationError) as context:
+            self.schema.load(input_data)
+        self.assertIn("max_pages must be between", str(context.exception))
+
+    def test_unknown_field(self):
+        input_data = {
+            "keywords": ["test"],
+            "proxies": ["http://proxy1"],
+            "type": "Repositories",
+            "fields": ["url", "forks"]
+        }
+        with self.assertRaises(ValidationError) as context:
+            self.schema.load(input_data)
+        self.assertIn("Unknown field: forks", str(context.exception))
+
     def test_valid_types(self):
         for valid_type in ['Repositories', 'Issues', 'Wikis']:
             input_data = {